@@ -1,39 +1,65 @@
 # 🔹 Módulos estándar de Python
 import os
+from arranque import registro_arranque
 env = os.getenv('FLASK_ENV', 'development')
 dotenv_file = f'.env.{env}'
 from dotenv import load_dotenv
 load_dotenv(dotenv_file)
 import json
-import mimetypes
 import logging
 import traceback
+import shutil
+import uuid
 import base64
-import pickle
+import threading
+import time
 from datetime import datetime
-from functools import wraps
-from email.mime.text import MIMEText
+from functools import wraps, partial
 
 # 🔹 Librerías externas
-import requests
-import mysql.connector
-from google.oauth2 import service_account, credentials as google_credentials
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import Flow
-from google.api_core.exceptions import InvalidArgument
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session
-
-# 🔹 Google Cloud
-from google.cloud import secretmanager
-from google.cloud import documentai_v1 as documentai
-from google.cloud import storage
+# Los SDK de Google (Document AI, Storage, Secret Manager, Gmail) y el conector
+# de MySQL se importan en su primer uso o durante el precalentamiento.
+from flask import Flask, Response, render_template, request, url_for, jsonify, stream_with_context
 
 # 🔹 Módulos internos
-from auth import auth_bp
+from auth import auth_bp, TOKEN_FILE
+from http_cache import configurar_cache_http, respuesta_condicional
+from secretos import ValidadorToken, comparar_tokens
+from db import conexion_db, get_db_connection, pool_db, ErrorConexionDB
+from pipeline import ejecutar_en_paralelo, ResultadoTarea
+from clientes import registro_clientes
+from correo_gmail import GestorGmail, ErrorCredencialesGmail
+from cargas import cargar_archivo, DocumentoCargado, DocumentoGCS
+from trabajos import crear_cola, PoolTrabajadores
+from persistencia import guardar_solicitud, reservar_subida, confirmar_subida, liberar_subida, purgar_subidas
+from bandeja_salida import RemitenteCorreos, encolar_correo, encolar_correos
+from cache_extraccion import crear_cache_extracciones, clave_extraccion
+from detalle_solicitud import cargar_detalle, CacheSolicitudes
+from entidades import EntidadExtraida, campos_desde_entidades, MASCARA_ENTIDADES
+from optimizacion import crear_optimizador
+from subida_directa import preparar_subidas, leer_ticket, verificar_objetos, ErrorSubidaDirecta, VIGENCIA_URL
+import subida_fragmentada
+from subida_fragmentada import ErrorFragmentos
+from metricas import configurar_metricas, registrar_colector, instrumentar_dependencia, medir_dependencia
+from eventos import crear_difusor, flujo_sse, leer_ultimo_id, SOLICITUD_NUEVA, SOLICITUD_ESTADO
+from listados import leer_filtros, consulta_solicitudes, paginar, ParametroInvalido, ESTADOS_VALIDOS
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'clave-secreta-default')
 app.register_blueprint(auth_bp)
+configurar_cache_http(app)
+configurar_metricas(app)
+
+# Precalienta en segundo plano los clientes de Google y el pool de MySQL (importa
+# sus SDK) para que la primera petición no pague su creación
+def precalentar():
+    with registro_arranque.etapa("precalentar_clientes"):
+        registro_clientes.precalentar()
+    with registro_arranque.etapa("precalentar_db"):
+        pool_db.precalentar()
+
+if os.getenv("PRECALENTAR_CLIENTES", "1" if env == "production" else "0") == "1":
+    threading.Thread(target=precalentar, daemon=True, name="precalentar").start()
 
 SCOPES = ["https://www.googleapis.com/auth/gmail.send"]
 
@@ -43,29 +69,25 @@ SCOPES = ["https://www.googleapis.com/auth/gmail.send"]
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configuración de la base de datos
-db_config = {
-    'host': os.getenv('DB_HOST'),
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'database': os.getenv('DB_NAME')
-}
+# Los tickets de /subir/firmar y las sesiones de /subir/fragmentos solo se firman
+# con un secreto configurado: con la llave por defecto cualquiera podría fabricarlos
+SECRETO_SUBIDAS = os.getenv('FLASK_SECRET_KEY') or None
+if not SECRETO_SUBIDAS:
+    logger.warning("⚠️ FLASK_SECRET_KEY no configurada: la subida directa y por fragmentos quedan deshabilitadas.")
+SUBIDAS_SIN_SECRETO = ({"error": "Subida directa deshabilitada: falta configurar FLASK_SECRET_KEY"}, 503)
 
-def get_db_connection():
-    try:
-        conn = mysql.connector.connect(**db_config)
-        return conn
-    except mysql.connector.Error as err:
-        logger.error(f"Error al conectar a la base de datos: {err}")
-        return None
+# Registro único de las subidas en dos pasos (migración 007): una reserva sin
+# resultado de más de RESERVA_VENCE segundos se da por abandonada
+SUBIDAS_RESERVA_VENCE = int(os.getenv("SUBIDAS_RESERVA_VENCE", "900"))
+SUBIDAS_RETENCION = int(os.getenv("SUBIDAS_RETENCION", str(7 * 24 * 3600)))
 
 # Validación de sesión externa
 def validar_sesion(token):
-    token_secreto = obtener_token_secreto()
+    token_secreto = validador_token.obtener()
     if not token_secreto:
         logger.error("Token secreto no disponible")
         return False
-    return token == token_secreto
+    return comparar_tokens(token, token_secreto)
 
 def requiere_sesion(f):
     @wraps(f)
@@ -85,6 +107,13 @@ def requiere_sesion(f):
 UPLOAD_FOLDER = 'uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Tiempos límite por tarea del pipeline de /subir (segundos)
+TIMEOUT_SUBIDA_GCS = float(os.getenv("TIMEOUT_SUBIDA_GCS", "60"))
+TIMEOUT_EXTRACCION = float(os.getenv("TIMEOUT_EXTRACCION", "90"))
+
+# Modo por defecto de /subir: "sync" procesa en la petición, "async" responde 202 con un job_id
+SUBIR_MODO = os.getenv("SUBIR_MODO", "sync")
+
 # Configuración de Document AI
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "co-impocali-cld-01")
 LOCATION = os.getenv("GCP_REGION", "us")
@@ -94,115 +123,502 @@ PROCESSORS = {
     "camara_comercio": os.getenv("PROCESSOR_CAMARA")
 }
 
+# Caché de lectura del detalle de solicitudes; /aceptar y /rechazar invalidan su entrada y los
+# cambios de otras réplicas se ven al vencer CACHE_DETALLE_TTL
+cache_solicitudes = CacheSolicitudes(
+    capacidad=int(os.getenv("CACHE_DETALLE_CAPACIDAD", "500")),
+    ttl=int(os.getenv("CACHE_DETALLE_TTL", "60"))
+)
 
-def procesar_documento_con_ai(file_path, processor_id):
-    mime_type, _ = mimetypes.guess_type(file_path)
-    mime_type = mime_type or "application/pdf"
-    try:
-        client = documentai.DocumentProcessorServiceClient()
-        name = f"projects/{PROJECT_ID}/locations/{LOCATION}/processors/{processor_id}"
+# Caché de resultados de Document AI por contenido (None si CACHE_EXTRACCION_DESACTIVADA=1)
+cache_extracciones = crear_cache_extracciones()
 
-        with open(file_path, "rb") as file:
-            document = {"content": file.read(), "mime_type": mime_type}
+# Reescalado de imágenes y recorte de páginas antes de Document AI (el original va igual a GCS)
+optimizador = crear_optimizador()
 
-        request = {"name": name, "raw_document": document}
-        result = client.process_document(request=request)
-        doc = result.document
+# Cambios de solicitudes en vivo para /admin (SSE); EVENTOS_BACKEND=mysql los comparte entre réplicas
+difusor_eventos = crear_difusor(conexion_db)
+SSE_LATIDO = float(os.getenv("SSE_LATIDO", "15"))
+SSE_DURACION = float(os.getenv("SSE_DURACION", "300"))
+# Cada flujo ocupa un hilo del servidor WSGI: se limita para no dejar sin hilos al resto de rutas
+SSE_MAX_CONEXIONES = int(os.getenv("SSE_MAX_CONEXIONES", "4"))
+conexiones_sse = threading.BoundedSemaphore(SSE_MAX_CONEXIONES)
 
-        entidades = {}
-        for entity in doc.entities:
-            tipo = entity.type_.lower().replace(" ", "_")
-            valor = entity.mention_text
-            confianza = round(entity.confidence * 100, 2)
-            entidades[tipo] = {"valor": valor, "confianza": f"{confianza}%"}
 
+def buscar_extraccion(documento, processor_id, usar_cache=True):
+    """
+    Devuelve (clave, resultado en caché o None). La clave es None si no hay
+    caché de extracciones o si `usar_cache=False`.
+    """
+    if cache_extracciones is None:
+        return None, None
+    if not usar_cache:
+        cache_extracciones.registrar_omision()
+        return None, None
+    clave = clave_extraccion(documento.huella(), processor_id)
+    en_cache = cache_extracciones.obtener(clave)
+    if en_cache is not None:
+        logger.info(f"♻️ Extracción de {documento.nombre} servida desde caché")
+    return clave, en_cache
+
+
+def guardar_extraccion(clave, documento, processor_id, entidades):
+    if cache_extracciones is not None:
+        cache_extracciones.guardar(clave or clave_extraccion(documento.huella(), processor_id), entidades)
+
+
+def peticion_documentai(documento, processor_id):
+    name = f"projects/{PROJECT_ID}/locations/{LOCATION}/processors/{processor_id}"
+    # Solo se piden las entidades: sin texto, páginas ni imágenes en la respuesta
+    if isinstance(documento, DocumentoGCS):
+        # Subida directa: Document AI lee el objeto del bucket, sin enviar los bytes
+        document = {"gcs_uri": documento.uri, "mime_type": documento.mime_type}
+        peticion = {"name": name, "gcs_document": document, "field_mask": MASCARA_ENTIDADES}
+        if documento.paginas:
+            # El recorte de páginas que el optimizador hace en el pod, aquí lo hace Document AI
+            inicio, fin = documento.paginas
+            peticion["process_options"] = (
+                {"from_start": fin} if inicio == 1
+                else {"individual_page_selector": {"pages": list(range(inicio, fin + 1))}}
+            )
+        return peticion
+    document = {"content": documento.leer_bytes(), "mime_type": documento.mime_type}
+    return {"name": name, "raw_document": document, "field_mask": MASCARA_ENTIDADES}
+
+
+def procesar_documento_con_ai(documento, processor_id, usar_cache=True):
+    from google.api_core.exceptions import InvalidArgument
+
+    clave, en_cache = buscar_extraccion(documento, processor_id, usar_cache)
+    if en_cache is not None:
+        return en_cache
+
+    try:
+        client = registro_clientes.obtener("documentai")
+        request = peticion_documentai(documento, processor_id)
+        with medir_dependencia("documentai"):
+            result = client.process_document(request=request)
+
+        entidades = campos_desde_entidades(EntidadExtraida.desde_proto(e) for e in result.document.entities)
+        del result
+
+        guardar_extraccion(clave, documento, processor_id, entidades)
         return entidades
 
     except InvalidArgument as e:
         logger.error(f"Error en Document AI: {e}")
-        return {"error": f"Formato no soportado ({mime_type}): {str(e)}"}
+        return {"error": f"Formato no soportado ({documento.mime_type}): {str(e)}"}
+
+def extraer_documento(documento, tipo, processor_id, usar_cache=True, reportes=None):
+    """
+    Optimiza el documento para Document AI y extrae sus campos. El reporte de
+    la optimización (bytes, páginas y confianza) queda en `reportes[tipo]`.
+    """
+    enviado, reporte = optimizador.optimizar(documento, tipo)
+    if reportes is not None:
+        reportes[tipo] = reporte
+
+    campos = procesar_documento_con_ai(enviado, processor_id, usar_cache)
+    optimizador.registrar_extraccion(reporte, campos)
+
+    if optimizador.debe_comparar(documento, enviado):
+        optimizador.registrar_comparacion(reporte, procesar_documento_con_ai(documento, processor_id, usar_cache))
+    return campos
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def listar_solicitudes(args):
+    """Devuelve (solicitudes, cursor_siguiente, filtros, limite) según los filtros de la URL."""
+    filtros, posicion, limite = leer_filtros(args)
+    sql, parametros = consulta_solicitudes(filtros, posicion, limite)
+
+    with conexion_db() as conn:
+        if not conn:
+            return None
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(sql, parametros)
+        filas = cursor.fetchall()
+
+    solicitudes, siguiente = paginar(filas, limite)
+    return solicitudes, siguiente, filtros, limite
+
+
+def version_solicitudes(id_solicitud=None):
+    """
+    Marcador barato de cambios para los ETag: (actualizado, id) de una solicitud
+    o (MAX(actualizado), MAX(id)) de la tabla. None si no se puede leer.
+    """
+    import mysql.connector
+    try:
+        with conexion_db() as conn:
+            if not conn:
+                return None
+            cursor = conn.cursor()
+            if id_solicitud is None:
+                cursor.execute("SELECT MAX(actualizado), MAX(id) FROM solicitudes")
+            else:
+                cursor.execute("SELECT actualizado, id FROM solicitudes WHERE id = %s", (id_solicitud,))
+            return cursor.fetchone()
+    except mysql.connector.Error as e:
+        logger.warning(f"⚠️ No se pudo leer la versión de solicitudes: {e}")
+        return None
+
+
+def con_etag(version, generar, *extra):
+    """
+    Responde 304 si `version` no cambió desde la copia del cliente; si no, genera
+    la respuesta. `extra` se suma al ETag (p. ej. el último evento del panel).
+    """
+    if not version:
+        return generar()
+    ultima_modificacion, _ = version
+    return respuesta_condicional(tuple(version) + extra, ultima_modificacion, generar)
+
+
 @app.route('/admin')
 @requiere_sesion
 def admin():
-    conn = get_db_connection()
-    if not conn:
-        return "Error al conectar a la base de datos", 500
+    # Se lee antes que la tabla: los eventos posteriores se reenvían al abrir el flujo
+    try:
+        ultimo_evento = difusor_eventos.ultimo_id()
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo leer el último evento del panel: {e}")
+        ultimo_evento = None
+
+    def generar():
+        try:
+            listado = listar_solicitudes(request.args)
+        except ParametroInvalido as e:
+            return str(e), 400
+        if listado is None:
+            return "Error al conectar a la base de datos", 500
+
+        solicitudes, siguiente, filtros, limite = listado
+        return render_template(
+            'admin.html',
+            solicitudes=solicitudes,
+            siguiente=siguiente,
+            filtros=request.args,
+            limite=limite,
+            estados=ESTADOS_VALIDOS,
+            ultimo_evento=ultimo_evento
+        )
+
+    return con_etag(version_solicitudes(), generar, ultimo_evento)
+
+
+@app.route('/admin/solicitudes')
+@requiere_sesion
+def admin_solicitudes_json():
+    def generar():
+        try:
+            listado = listar_solicitudes(request.args)
+        except ParametroInvalido as e:
+            return jsonify({"error": str(e)}), 400
+        if listado is None:
+            return jsonify({"error": "Error al conectar a la base de datos"}), 500
+
+        solicitudes, siguiente, _, limite = listado
+        return jsonify({
+            "solicitudes": [dict(s, fecha=str(s["fecha"])) for s in solicitudes],
+            "siguiente": siguiente,
+            "limite": limite
+        })
 
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT s.id, s.fecha, s.estado, s.usuario_id, u.correo
-        FROM solicitudes s
-        LEFT JOIN usuarios u ON s.usuario_id = u.id
-        ORDER BY s.fecha DESC
-    """)
+    return con_etag(version_solicitudes(), generar)
 
-    solicitudes = cursor.fetchall()
-    conn.close()
-    return render_template('admin.html', solicitudes=solicitudes)
+
+@app.route('/admin/eventos')
+@requiere_sesion
+def admin_eventos():
+    """
+    Flujo SSE con las solicitudes nuevas y los cambios de estado. El navegador
+    envía Last-Event-ID al reconectarse; la primera conexión usa ?ultimo_id=
+    con el valor con que se generó la página.
+    """
+    ultimo_id = leer_ultimo_id(request.headers.get("Last-Event-ID") or request.args.get("ultimo_id"))
+    cabeceras = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    if not conexiones_sse.acquire(blocking=False):
+        # Sin hilos libres: se pide al navegador que reintente más tarde con el mismo id
+        logger.warning("⚠️ Límite de conexiones SSE alcanzado; se pide reintentar en 30 s")
+        return Response("retry: 30000\n\n", mimetype="text/event-stream", headers=cabeceras)
+
+    def generar():
+        try:
+            yield from flujo_sse(difusor_eventos, ultimo_id, SSE_LATIDO, SSE_DURACION)
+        finally:
+            conexiones_sse.release()
+
+    return Response(stream_with_context(generar()), mimetype="text/event-stream", headers=cabeceras)
 
 
 @app.route('/detalle/<int:id>')
 @requiere_sesion  # Valida token en header Authorization
 def detalle(id):
-    conn = get_db_connection()
-    if not conn:
-        return "Error al conectar a la base de datos", 500
+    def cargar():
+        with conexion_db() as conn:
+            if not conn:
+                raise ErrorConexionDB()
+            return cargar_detalle(conn, id)
 
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM solicitudes WHERE id = %s", (id,))
-    solicitud_base = cursor.fetchone()
+    try:
+        solicitud = cache_solicitudes.obtener(id, cargar)
+    except ErrorConexionDB:
+        return "Error al conectar a la base de datos", 500
 
-    if not solicitud_base:
-        conn.close()
+    if not solicitud:
         return "Solicitud no encontrada", 404
 
-    cursor.execute("SELECT * FROM archivos WHERE solicitud_id = %s", (id,))
-    archivos = cursor.fetchall()
+    # La versión viene con los datos (o con la entrada de caché): un acierto no consulta la BD
+    return con_etag(solicitud["version"], lambda: render_template('detalle.html', solicitud=solicitud))
+
+@instrumentar_dependencia("gcs")
+def subir_a_gcs(documento, carpeta, nombre_archivo):
+    client = registro_clientes.obtener("storage")
+    bucket = client.bucket(os.getenv("GCS_BUCKET_NAME"))
+    blob = bucket.blob(f"{carpeta}/{nombre_archivo}")
+    with documento.abrir() as contenido:
+        blob.upload_from_file(contenido, size=documento.tamano, content_type=documento.mime_type)
+    return blob.public_url
+
+# Documento -> (clave de datos extraídos, procesador de Document AI)
+DOCUMENTOS = {
+    'doc_identidad': ('cedulas', PROCESSORS["cedulas"]),
+    'rut': ('RUT', PROCESSORS["RUT"]),
+    'camara_comercio': ('camara_comercio', PROCESSORS["camara_comercio"])
+}
+
+# Campo del formulario -> tipo de documento
+CAMPOS_ARCHIVOS = {
+    'docIdentidad': 'doc_identidad',
+    'rut': 'rut',
+    'camara': 'camara_comercio'
+}
+
+
+def obtener_carpeta_gcs(usuario_id, correo, fecha_para_archivo):
+    with conexion_db() as conn:
+        if not conn:
+            return None
+        cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("SELECT * FROM datos_extraidos WHERE solicitud_id = %s", (id,))
-    datos_extraidos_raw = cursor.fetchall()
+        cursor.execute("SELECT carpeta_gcs FROM usuarios WHERE id = %s", (usuario_id,))
+        row = cursor.fetchone()
 
-    conn.close()
+        if row and row.get('carpeta_gcs'):
+            return row['carpeta_gcs']
+
+        carpeta_gcs = f"{fecha_para_archivo}-{correo}"
+        cursor.execute("UPDATE usuarios SET carpeta_gcs = %s WHERE id = %s", (carpeta_gcs, usuario_id))
+        conn.commit()
+        return carpeta_gcs
+
+
+def subidas_previas(archivos_subidos):
+    """Resultados de subida de los documentos que ya están en el bucket (subida directa)."""
+    return {
+        ("subida", tipo): ResultadoTarea(True, valor=datos["documento"].url_publica)
+        for tipo, datos in archivos_subidos.items()
+        if isinstance(datos["documento"], DocumentoGCS)
+    }
+
+
+def procesar_solicitud(usuario_id, correo, fecha_actual, carpeta_gcs, archivos_subidos, reportar=None, usar_cache=True):
+    """
+    Sube los documentos a GCS, los procesa con Document AI y registra la solicitud.
 
-    datos_extraidos = {}
-    for dato in datos_extraidos_raw:
-        tipo = dato['tipo_documento']
-        if tipo not in datos_extraidos:
-            datos_extraidos[tipo] = {}
-        datos_extraidos[tipo][dato['campo']] = {
-            "valor": dato['valor'],
-            "confianza": dato['confianza']
+    `archivos_subidos` es {tipo: {"documento": DocumentoCargado, "final_name": str}}.
+    Devuelve (codigo_http, cuerpo_json). Lo usan tanto /subir como los
+    trabajadores del modo asíncrono. Con `usar_cache=False` se ignora la caché
+    de extracciones y se consulta siempre a Document AI.
+    """
+    reportar = reportar or (lambda etapa, porcentaje: None)
+
+    # Subidas a GCS y extracciones con Document AI en paralelo
+    reportar("subiendo_y_extrayendo", 20)
+    optimizaciones = {}
+    tareas = {}
+    ya_subidos = subidas_previas(archivos_subidos)
+    for tipo, datos in archivos_subidos.items():
+        tipo_doc, processor_id = DOCUMENTOS[tipo]
+        if ("subida", tipo) not in ya_subidos:
+            tareas[("subida", tipo)] = (
+                partial(subir_a_gcs, datos["documento"], carpeta_gcs, datos["final_name"]), TIMEOUT_SUBIDA_GCS
+            )
+        tareas[("extraccion", tipo)] = (
+            partial(extraer_documento, datos["documento"], tipo, processor_id, usar_cache, optimizaciones),
+            TIMEOUT_EXTRACCION
+        )
+    resultados = {**ejecutar_en_paralelo(tareas), **ya_subidos}
+    return registrar_solicitud(
+        usuario_id, correo, fecha_actual, archivos_subidos, resultados, optimizaciones, reportar
+    )
+
+
+def registrar_solicitud(usuario_id, correo, fecha_actual, archivos_subidos, resultados, optimizaciones, reportar=None):
+    """
+    Arma el reporte por documento a partir de los resultados de subida y
+    extracción ({("subida"|"extraccion", tipo): ResultadoTarea}) y guarda la
+    solicitud. Devuelve (codigo_http, cuerpo_json).
+    """
+    reportar = reportar or (lambda etapa, porcentaje: None)
+    reporte = {
+        tipo: {
+            "subida": resultados[("subida", tipo)].resumen(),
+            "extraccion": resultados[("extraccion", tipo)].resumen(),
+            "optimizacion": optimizaciones.get(tipo)
+        }
+        for tipo in archivos_subidos
+    }
+
+    if not all(resultados[("subida", tipo)].ok for tipo in archivos_subidos):
+        logger.error(f"❌ Falló la subida a GCS de uno o más documentos: {reporte}")
+        return 502, {
+            "error": "No se pudieron subir todos los documentos",
+            "documentos": reporte
         }
 
-    solicitud = {
-        "id": solicitud_base['id'],
-        "usuario_id": solicitud_base['usuario_id'],
-        "fecha": solicitud_base['fecha'],
-        "estado": solicitud_base['estado'],
-        "motivo": solicitud_base['motivo_rechazo'],
-        "archivos": [
-            {
-                "nombre": archivo["nombre_archivo"],
-                "ruta": archivo["ruta_archivo"]
-            }
-            for archivo in archivos
-        ],
-        "info": datos_extraidos
+    extracciones = {}
+    for tipo, datos in archivos_subidos.items():
+        datos["url"] = resultados[("subida", tipo)].valor
+        tipo_doc = DOCUMENTOS[tipo][0]
+        resultado = resultados[("extraccion", tipo)]
+        extracciones[tipo_doc] = resultado.valor if resultado.ok else {"error": resultado.error}
+
+    reportar("guardando", 80)
+    with conexion_db() as conn:
+        if not conn:
+            return 500, {"error": "Error al conectar a la base de datos"}
+        solicitud_id, metricas_guardado = guardar_solicitud(
+            conn, usuario_id, correo, fecha_actual,
+            [(tipo, datos['final_name'], datos['url']) for tipo, datos in archivos_subidos.items()],
+            extracciones
+        )
+
+    difusor_eventos.publicar(SOLICITUD_NUEVA, {
+        "id": solicitud_id, "fecha": fecha_actual, "estado": "sin revisar",
+        "usuario_id": usuario_id, "correo": correo
+    })
+
+    fallidos = [tipo_doc for tipo_doc, datos in extracciones.items() if "error" in datos]
+    if fallidos:
+        logger.warning(f"⚠️ Solicitud {solicitud_id} creada con errores de extracción en: {fallidos}")
+        return 200, {
+            "status": "parcial",
+            "solicitud_id": solicitud_id,
+            "mensaje": "Documentos cargados; algunos no pudieron procesarse automáticamente.",
+            "documentos": reporte,
+            "persistencia": metricas_guardado
+        }
+
+    logger.info(f"✅ Solicitud {solicitud_id} creada exitosamente.")
+    return 200, {
+        "status": "ok",
+        "solicitud_id": solicitud_id,
+        "mensaje": "Documentos cargados y procesados correctamente.",
+        "documentos": reporte,
+        "persistencia": metricas_guardado
     }
 
-    return render_template('detalle.html', solicitud=solicitud)
 
-def subir_a_gcs(ruta_local, carpeta, nombre_archivo):
-    client = storage.Client.from_service_account_json(os.getenv("GCS_CREDENTIALS_PATH"))
-    bucket = client.bucket(os.getenv("GCS_BUCKET_NAME"))
-    blob = bucket.blob(f"{carpeta}/{nombre_archivo}")
-    blob.upload_from_filename(ruta_local)
-    return blob.public_url
+def procesar_trabajo_subida(trabajo, reportar):
+    """Manejador de la cola de /subir en modo asíncrono."""
+    payload = trabajo["payload"]
+    archivos_subidos = {
+        tipo: {"documento": DocumentoCargado.desde_ruta(datos["ruta"], datos["nombre"]), "final_name": datos["final_name"]}
+        for tipo, datos in payload["archivos"].items()
+    }
+    try:
+        codigo, cuerpo = procesar_solicitud(
+            payload["usuario_id"], payload["correo"], payload["fecha_actual"],
+            payload["carpeta_gcs"], archivos_subidos, reportar, payload.get("usar_cache", True)
+        )
+    finally:
+        for datos in archivos_subidos.values():
+            datos["documento"].liberar()
+        shutil.rmtree(payload["directorio"], ignore_errors=True)
+
+    if codigo >= 400:
+        raise RuntimeError(cuerpo.get("error", "Error procesando la solicitud"))
+    return cuerpo
+
+
+# Cola y trabajadores del modo asíncrono de /subir (COLA_TRABAJOS_BACKEND=memoria|sqlite)
+cola_trabajos = crear_cola()
+trabajadores_subida = PoolTrabajadores(
+    cola_trabajos, procesar_trabajo_subida, cantidad=int(os.getenv("TRABAJADORES_SUBIDA", "2"))
+)
+# Con una cola persistente los trabajos pendientes de antes de un reinicio se retoman
+# al arrancar, sin esperar a que llegue una nueva subida asíncrona
+if cola_trabajos.persistente:
+    trabajadores_subida.asegurar_iniciado()
+
+
+def encolar_subida(usuario_id, correo, fecha_actual, fecha_para_archivo, carpeta_gcs, archivos, usar_cache=True):
+    """Guarda los archivos en disco con nombres únicos y encola su procesamiento."""
+    job_id = uuid.uuid4().hex
+    directorio = os.path.join(UPLOAD_FOLDER, "trabajos", job_id)
+    os.makedirs(directorio, exist_ok=True)
+
+    archivos_payload = {}
+    for tipo, archivo in archivos.items():
+        ruta = os.path.join(directorio, tipo)
+        archivo.save(ruta)
+        archivos_payload[tipo] = {
+            "ruta": ruta,
+            "nombre": archivo.filename,
+            "final_name": f"{fecha_para_archivo}-{archivo.filename}"
+        }
+
+    cola_trabajos.encolar({
+        "usuario_id": usuario_id,
+        "correo": correo,
+        "fecha_actual": fecha_actual,
+        "carpeta_gcs": carpeta_gcs,
+        "directorio": directorio,
+        "archivos": archivos_payload,
+        "usar_cache": usar_cache
+    }, job_id=job_id)
+    trabajadores_subida.asegurar_iniciado()
+    return job_id
+
+
+def verificar_token_subida(token, token_sistema):
+    """(cuerpo, codigo) del error de autenticación de /subir, o None si el token es válido."""
+    if not token_sistema:
+        logger.error("❌ Token desde Secret Manager no disponible")
+        return {"error": "No se pudo validar el token"}, 500
+
+    if not comparar_tokens(token, token_sistema):
+        logger.warning("❌ Token inválido.")
+        return {"error": "Token inválido"}, 401
+    return None
+
+
+def leer_formulario_subida(formulario, archivos):
+    """
+    Valida los campos de /subir. `archivos` es cualquier contenedor con los
+    nombres de los archivos recibidos. Devuelve (error, usuario_id, correo),
+    donde `error` es (cuerpo, codigo) o None.
+    """
+    usuario_id = int(formulario.get("usuario_id", "0"))
+    correo = formulario.get("correo")
+    logger.info(f"👤 Usuario ID: {usuario_id}, Correo: {correo}")
+
+    if not usuario_id or not correo:
+        logger.warning("❌ Falta ID o correo.")
+        return ({"error": "Falta el ID o el correo del usuario"}, 400), usuario_id, correo
+
+    if any(campo not in archivos for campo in CAMPOS_ARCHIVOS):
+        logger.warning(f"📁 Archivos recibidos incompletos: {list(archivos.keys())}")
+        return ({"error": "Faltan uno o más archivos obligatorios"}, 400), usuario_id, correo
+
+    logger.info("📁 Archivos recibidos correctamente")
+    return None, usuario_id, correo
+
 
 @app.route('/subir', methods=['POST'])
 def subir_documentos():
@@ -213,110 +629,370 @@ def subir_documentos():
         token = auth_header.replace('Bearer ', '').strip()
         logger.info(f"🔑 Token recibido: {token[:10]}...")
 
-        token_sistema = obtener_token_secreto()
-        if not token_sistema:
-            logger.error("❌ Token desde Secret Manager no disponible")
-            return jsonify({"error": "No se pudo validar el token"}), 500
+        error = verificar_token_subida(token, validador_token.obtener())
+        if error:
+            return jsonify(error[0]), error[1]
 
-        if token != token_sistema:
-            logger.warning("❌ Token inválido.")
-            return jsonify({"error": "Token inválido"}), 401
+        error, usuario_id, correo = leer_formulario_subida(request.form, request.files)
+        if error:
+            return jsonify(error[0]), error[1]
 
-        usuario_id = int(request.form.get("usuario_id", "0"))
-        correo = request.form.get("correo")
-        logger.info(f"👤 Usuario ID: {usuario_id}, Correo: {correo}")
-
-        if not usuario_id or not correo:
-            logger.warning("❌ Falta ID o correo.")
-            return jsonify({"error": "Falta el ID o el correo del usuario"}), 400
-
-        if 'docIdentidad' not in request.files or 'rut' not in request.files or 'camara' not in request.files:
-            logger.warning(f"📁 Archivos recibidos incompletos: {list(request.files.keys())}")
-            return jsonify({"error": "Faltan uno o más archivos obligatorios"}), 400
-
-        logger.info("📁 Archivos recibidos correctamente")
-
-        doc_identidad = request.files['docIdentidad']
-        rut = request.files['rut']
-        camara = request.files['camara']
+        archivos = {tipo: request.files[campo] for campo, tipo in CAMPOS_ARCHIVOS.items()}
 
         now = datetime.now()
         fecha_actual = now.strftime("%Y-%m-%d %H:%M:%S")
         fecha_para_archivo = now.strftime("%Y-%m-%d")
 
-        conn = get_db_connection()
-        if not conn:
+        carpeta_gcs = obtener_carpeta_gcs(usuario_id, correo, fecha_para_archivo)
+        if not carpeta_gcs:
             return "Error al conectar a la base de datos", 500
-        cursor = conn.cursor(dictionary=True)
 
-        cursor.execute("SELECT carpeta_gcs FROM usuarios WHERE id = %s", (usuario_id,))
-        row = cursor.fetchone()
+        # sin_cache=1 fuerza una nueva extracción aunque el documento ya se haya procesado
+        usar_cache = (request.args.get("sin_cache") or request.form.get("sin_cache")) != "1"
 
-        if row and row.get('carpeta_gcs'):
-            carpeta_gcs = row['carpeta_gcs']
-        else:
-            carpeta_gcs = f"{fecha_para_archivo}-{correo}"
-            cursor.execute("UPDATE usuarios SET carpeta_gcs = %s WHERE id = %s", (carpeta_gcs, usuario_id))
-            conn.commit()
+        modo = request.args.get("modo") or request.form.get("modo") or SUBIR_MODO
+        if modo == "async":
+            job_id = encolar_subida(
+                usuario_id, correo, fecha_actual, fecha_para_archivo, carpeta_gcs, archivos, usar_cache
+            )
+            logger.info(f"📨 Subida encolada como trabajo {job_id}")
+            return jsonify({
+                "status": "en_cola",
+                "job_id": job_id,
+                "estado_url": url_for('estado_subida', job_id=job_id)
+            }), 202
+
+        archivos_subidos = {}
+        try:
+            # Cada archivo se lee una sola vez; GCS y Document AI comparten los mismos bytes
+            for tipo, archivo in archivos.items():
+                archivos_subidos[tipo] = {
+                    "documento": cargar_archivo(archivo, UPLOAD_FOLDER),
+                    "final_name": f"{fecha_para_archivo}-{archivo.filename}"
+                }
+            codigo, cuerpo = procesar_solicitud(
+                usuario_id, correo, fecha_actual, carpeta_gcs, archivos_subidos, usar_cache=usar_cache
+            )
+        finally:
+            for datos in archivos_subidos.values():
+                datos["documento"].liberar()
 
-        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        return jsonify(cuerpo), codigo
 
-        archivos_guardados = [
-            ('doc_identidad', doc_identidad),
-            ('rut', rut),
-            ('camara_comercio', camara)
-        ]
+    except Exception as e:
+        logger.error("❌ Error en /subir:")
+        logger.error(traceback.format_exc())
+        return jsonify({"error": "Error interno del servidor", "detalle": str(e)}), 500
 
-        rutas_temporales = {}
 
-        for tipo, archivo in archivos_guardados:
-            path_local = os.path.join(UPLOAD_FOLDER, archivo.filename)
-            archivo.save(path_local)
-            nombre_archivo_final = f"{fecha_para_archivo}-{archivo.filename}"
-            url = subir_a_gcs(path_local, carpeta_gcs, nombre_archivo_final)
-            rutas_temporales[tipo] = {"local": path_local, "final_name": nombre_archivo_final, "url": url}
+def token_subida():
+    return request.headers.get('Authorization', '').replace('Bearer ', '').strip()
 
-        texto_identidad = procesar_documento_con_ai(rutas_temporales['doc_identidad']['local'], PROCESSORS["cedulas"])
-        texto_rut = procesar_documento_con_ai(rutas_temporales['rut']['local'], PROCESSORS["RUT"])
-        texto_camara = procesar_documento_con_ai(rutas_temporales['camara_comercio']['local'], PROCESSORS["camara_comercio"])
 
-        cursor.execute(
-            "INSERT INTO solicitudes (usuario_id, fecha, estado, correo) VALUES (%s, %s, %s, %s)",
-            (usuario_id, fecha_actual, 'sin revisar', correo)
+def reservar_registro(clave):
+    """
+    Reserva el registro de la solicitud de un ticket o sesión (`clave`). Devuelve
+    None si esta petición debe registrarla; si no, (cuerpo, codigo) a responder:
+    el resultado del primer registro, o 409 si otra petición lo está haciendo.
+    """
+    import mysql.connector
+    try:
+        with conexion_db() as conn:
+            if not conn:
+                return {"error": "Error al conectar a la base de datos"}, 500
+            reservada, resultado = reservar_subida(conn, clave, SUBIDAS_RESERVA_VENCE)
+    except mysql.connector.Error as e:
+        logger.error(f"❌ No se pudo reservar el registro de la subida {clave}: {e}")
+        return {"error": "Error al conectar a la base de datos"}, 500
+
+    if reservada:
+        return None
+    if resultado:
+        logger.info(f"🔁 Subida {clave} ya registrada como solicitud {resultado.get('solicitud_id')}; se repite su resultado")
+        return resultado, 200
+    return {"error": "La subida ya se está registrando; reintenta en unos segundos"}, 409
+
+
+_ultima_purga_subidas = 0.0
+
+
+def cerrar_registro(clave, codigo, cuerpo):
+    """
+    Guarda el resultado si se creó la solicitud de `clave`; si no, libera la
+    reserva para que el cliente pueda reintentar. De paso purga, como mucho una
+    vez por hora, los registros más viejos que SUBIDAS_RETENCION.
+    """
+    global _ultima_purga_subidas
+    import mysql.connector
+    if clave is None:
+        return
+    solicitud_id = (cuerpo or {}).get("solicitud_id") if codigo == 200 else None
+    try:
+        with conexion_db() as conn:
+            if not conn:
+                raise ErrorConexionDB()
+            if solicitud_id:
+                confirmar_subida(conn, clave, solicitud_id, cuerpo)
+            else:
+                liberar_subida(conn, clave)
+            if time.monotonic() - _ultima_purga_subidas > 3600:
+                _ultima_purga_subidas = time.monotonic()
+                purgar_subidas(conn, SUBIDAS_RETENCION)
+    except (mysql.connector.Error, ErrorConexionDB) as e:
+        logger.error(f"❌ No se pudo cerrar el registro de la subida {clave} (solicitud {solicitud_id}): {e}")
+
+
+@app.route('/subir/firmar', methods=['POST'])
+def firmar_subida():
+    """
+    Primer paso de la subida directa a GCS. Recibe JSON con usuario_id, correo
+    y archivos ({campo: {nombre, tipo_mime, tamano}}, con los campos de /subir)
+    y devuelve una URL PUT firmada por archivo y el ticket para /subir/finalizar.
+    """
+    error = verificar_token_subida(token_subida(), validador_token.obtener())
+    if error:
+        return jsonify(error[0]), error[1]
+    if not SECRETO_SUBIDAS:
+        return jsonify(SUBIDAS_SIN_SECRETO[0]), SUBIDAS_SIN_SECRETO[1]
+
+    datos = request.get_json(silent=True) or {}
+    archivos = datos.get("archivos") if isinstance(datos.get("archivos"), dict) else {}
+    error, usuario_id, correo = leer_formulario_subida(datos, archivos)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    fecha_para_archivo = datetime.now().strftime("%Y-%m-%d")
+    carpeta_gcs = obtener_carpeta_gcs(usuario_id, correo, fecha_para_archivo)
+    if not carpeta_gcs:
+        return "Error al conectar a la base de datos", 500
+
+    try:
+        subidas, ticket = preparar_subidas(
+            SECRETO_SUBIDAS, os.getenv("GCS_BUCKET_NAME"), usuario_id, correo, carpeta_gcs, fecha_para_archivo,
+            {campo: archivos[campo] for campo in CAMPOS_ARCHIVOS}
         )
-        solicitud_id = cursor.lastrowid
+    except ErrorSubidaDirecta as e:
+        return jsonify({"error": str(e)}), 400
 
-        for tipo, datos in rutas_temporales.items():
-            cursor.execute(
-                "INSERT INTO archivos (solicitud_id, tipo, nombre_archivo, ruta_archivo) VALUES (%s, %s, %s, %s)",
-                (solicitud_id, tipo, datos['final_name'], datos['url'])
-            )
+    logger.info(f"✍️ URLs firmadas para el usuario {usuario_id} en {carpeta_gcs}")
+    return jsonify({"subidas": subidas, "ticket": ticket, "expira_en": VIGENCIA_URL})
 
-        for tipo_doc, datos in {'cedulas': texto_identidad, 'RUT': texto_rut, 'camara_comercio': texto_camara}.items():
-            for campo, detalle in datos.items():
-                cursor.execute(
-                    "INSERT INTO datos_extraidos (solicitud_id, tipo_documento, campo, valor, confianza) VALUES (%s, %s, %s, %s, %s)",
-                    (solicitud_id, tipo_doc, campo, detalle.get("valor", ""), detalle.get("confianza", ""))
-                )
 
-        conn.commit()
-        conn.close()
+def preparar_finalizacion(datos):
+    """
+    Valida el ticket de /subir/finalizar, reserva su registro y comprueba los
+    objetos en el bucket. Devuelve (error, contexto): `error` es (cuerpo, codigo)
+    o None (también el resultado ya guardado si el ticket se repite) y `contexto`
+    es (clave, usuario_id, correo, carpeta_gcs, archivos_subidos). Quien recibe
+    el contexto debe llamar a cerrar_registro(clave, ...) al terminar.
+    """
+    if not SECRETO_SUBIDAS:
+        return SUBIDAS_SIN_SECRETO, None
+    try:
+        ticket = leer_ticket(SECRETO_SUBIDAS, datos.get("ticket"))
+    except ErrorSubidaDirecta as e:
+        logger.warning(f"❌ Finalización rechazada: {e}")
+        return ({"error": str(e)}, 400), None
+
+    clave = ticket["subida"]
+    error = reservar_registro(clave)
+    if error:
+        return error, None
+    try:
+        documentos = verificar_objetos(
+            registro_clientes.obtener("storage"), os.getenv("GCS_BUCKET_NAME"),
+            {CAMPOS_ARCHIVOS[campo]: objeto for campo, objeto in ticket["objetos"].items()}
+        )
+    except ErrorSubidaDirecta as e:
+        cerrar_registro(clave, 400, None)
+        logger.warning(f"❌ Finalización rechazada: {e}")
+        return ({"error": str(e)}, 400), None
+    except Exception:
+        cerrar_registro(clave, 500, None)
+        raise
+
+    archivos_subidos = {
+        tipo: {"documento": documento, "final_name": os.path.basename(documento.objeto)}
+        for tipo, documento in documentos.items()
+    }
+    return None, (clave, ticket["usuario_id"], ticket["correo"], ticket["carpeta"], archivos_subidos)
 
-        for datos in rutas_temporales.values():
-            if os.path.exists(datos["local"]):
-                os.remove(datos["local"])
 
-        logger.info(f"✅ Solicitud {solicitud_id} creada exitosamente.")
-        return jsonify({"status": "ok", "mensaje": "Documentos cargados y procesados correctamente."})
+@app.route('/subir/finalizar', methods=['POST'])
+def finalizar_subida():
+    """Segundo paso de la subida directa: procesa los objetos ya subidos y registra la solicitud."""
+    error = verificar_token_subida(token_subida(), validador_token.obtener())
+    if error:
+        return jsonify(error[0]), error[1]
 
-    except Exception as e:
-        logger.error("❌ Error en /subir:")
-        logger.error(traceback.format_exc())
-        return jsonify({"error": "Error interno del servidor", "detalle": str(e)}), 500
+    datos = request.get_json(silent=True) or {}
+    error, contexto = preparar_finalizacion(datos)
+    if error:
+        return jsonify(error[0]), error[1]
 
+    clave, usuario_id, correo, carpeta_gcs, archivos_subidos = contexto
+    fecha_actual = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    codigo, cuerpo = 500, None
+    try:
+        codigo, cuerpo = procesar_solicitud(
+            usuario_id, correo, fecha_actual, carpeta_gcs, archivos_subidos, usar_cache=str(datos.get("sin_cache")) != "1"
+        )
+    finally:
+        cerrar_registro(clave, codigo, cuerpo)
+    return jsonify(cuerpo), codigo
+
+
+@app.route('/subir/fragmentos', methods=['POST'])
+def iniciar_subida_fragmentada():
+    """
+    Abre una sesión de subida por fragmentos. Recibe JSON como /subir/firmar
+    (más `tamano_fragmento` opcional) y devuelve la sesión y los fragmentos esperados.
+    """
+    error = verificar_token_subida(token_subida(), validador_token.obtener())
+    if error:
+        return jsonify(error[0]), error[1]
+
+    datos = request.get_json(silent=True) or {}
+    archivos = datos.get("archivos") if isinstance(datos.get("archivos"), dict) else {}
+    error, usuario_id, correo = leer_formulario_subida(datos, archivos)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    fecha_para_archivo = datetime.now().strftime("%Y-%m-%d")
+    carpeta_gcs = obtener_carpeta_gcs(usuario_id, correo, fecha_para_archivo)
+    if not carpeta_gcs:
+        return "Error al conectar a la base de datos", 500
+
+    try:
+        sesion, plan = subida_fragmentada.iniciar_sesion(
+            SECRETO_SUBIDAS, usuario_id, correo, carpeta_gcs, fecha_para_archivo,
+            {campo: archivos[campo] for campo in CAMPOS_ARCHIVOS}, datos.get("tamano_fragmento")
+        )
+    except (ErrorFragmentos, TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), getattr(e, "codigo", 400)
+
+    # Aprovecha la actividad para borrar temporales de sesiones abandonadas
+    subida_fragmentada.programar_limpieza(
+        lambda: registro_clientes.obtener("storage"), os.getenv("GCS_BUCKET_NAME")
+    )
+    logger.info(f"🧩 Sesión de subida por fragmentos abierta para el usuario {usuario_id}")
+    return jsonify({"sesion": sesion, "archivos": plan, "expira_en": subida_fragmentada.VIGENCIA_SESION}), 201
+
+
+def sesion_fragmentada(sesion):
+    """(error, datos de la sesión): valida el token de /subir y el de la sesión."""
+    error = verificar_token_subida(token_subida(), validador_token.obtener())
+    if error:
+        return error, None
+    try:
+        return None, subida_fragmentada.leer_sesion(SECRETO_SUBIDAS, sesion)
+    except ErrorFragmentos as e:
+        return ({"error": str(e)}, e.codigo), None
+
+
+@app.route('/subir/fragmentos/<sesion>/<campo>/<int:numero>', methods=['PUT'])
+def subir_fragmento(sesion, campo, numero):
+    error, datos_sesion = sesion_fragmentada(sesion)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    # Se rechaza antes de leer el cuerpo: la memoria por petición queda acotada al fragmento
+    if request.content_length is None:
+        return jsonify({"error": "Falta Content-Length"}), 411
+    if request.content_length > datos_sesion["tamano_fragmento"]:
+        return jsonify({"error": "El fragmento supera el tamaño de la sesión"}), 413
+
+    try:
+        crc32c = subida_fragmentada.guardar_fragmento(
+            registro_clientes.obtener("storage"), os.getenv("GCS_BUCKET_NAME"), datos_sesion, campo, numero,
+            request.get_data(cache=False), subida_fragmentada.crc32c_de_cabecera(request.headers.get("X-Goog-Hash"))
+        )
+    except ErrorFragmentos as e:
+        return jsonify({"error": str(e)}), e.codigo
+    return jsonify({"campo": campo, "fragmento": numero, "crc32c": crc32c})
+
+
+@app.route('/subir/fragmentos/<sesion>', methods=['GET'])
+def estado_subida_fragmentada(sesion):
+    error, datos_sesion = sesion_fragmentada(sesion)
+    if error:
+        return jsonify(error[0]), error[1]
+    estado = subida_fragmentada.estado_sesion(
+        registro_clientes.obtener("storage"), os.getenv("GCS_BUCKET_NAME"), datos_sesion
+    )
+    return jsonify({"archivos": estado, "completa": not any(e["faltantes"] for e in estado.values())})
+
+
+def preparar_completar(datos_sesion):
+    """
+    Reserva el registro de una sesión ya validada y une sus fragmentos.
+    Devuelve (error, contexto) con el mismo formato que preparar_finalizacion;
+    un reintento de una sesión ya registrada recibe su resultado como `error`.
+    """
+    clave = datos_sesion["id"]
+    error = reservar_registro(clave)
+    if error:
+        return error, None
+    try:
+        documentos = subida_fragmentada.completar_sesion(
+            registro_clientes.obtener("storage"), os.getenv("GCS_BUCKET_NAME"), datos_sesion
+        )
+    except ErrorFragmentos as e:
+        cerrar_registro(clave, e.codigo, None)
+        logger.warning(f"❌ No se pudo completar la sesión {clave}: {e}")
+        return ({"error": str(e)}, e.codigo), None
+    except Exception:
+        cerrar_registro(clave, 500, None)
+        raise
+
+    archivos_subidos = {
+        CAMPOS_ARCHIVOS[campo]: {"documento": documento, "final_name": os.path.basename(documento.objeto)}
+        for campo, documento in documentos.items()
+    }
+    return None, (clave, datos_sesion["usuario_id"], datos_sesion["correo"], datos_sesion["carpeta"], archivos_subidos)
+
+
+@app.route('/subir/fragmentos/<sesion>/completar', methods=['POST'])
+def completar_subida_fragmentada(sesion):
+    error, datos_sesion = sesion_fragmentada(sesion)
+    if error:
+        return jsonify(error[0]), error[1]
+    error, contexto = preparar_completar(datos_sesion)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    clave, usuario_id, correo, carpeta_gcs, archivos_subidos = contexto
+    fecha_actual = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    sin_cache = request.args.get("sin_cache") or (request.get_json(silent=True) or {}).get("sin_cache")
+    codigo, cuerpo = 500, None
+    try:
+        codigo, cuerpo = procesar_solicitud(
+            usuario_id, correo, fecha_actual, carpeta_gcs, archivos_subidos, usar_cache=str(sin_cache) != "1"
+        )
+    finally:
+        cerrar_registro(clave, codigo, cuerpo)
+    return jsonify(cuerpo), codigo
+
+
+@app.route('/subir/estado/<job_id>', methods=['GET'])
+@requiere_sesion
+def estado_subida(job_id):
+    trabajo = cola_trabajos.obtener(job_id)
+    if not trabajo:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+
+    return jsonify({
+        "job_id": job_id,
+        "estado": trabajo["estado"],
+        "progreso": trabajo["progreso"],
+        "resultado": trabajo["resultado"],
+        "error": trabajo["error"]
+    })
+
+@instrumentar_dependencia("secret_manager", es_error=lambda token: token is None)
 def obtener_token_secreto(nombre_secreto="token"):
     try:
-        client = secretmanager.SecretManagerServiceClient()
+        client = registro_clientes.obtener("secretmanager")
         project_id = os.getenv('GCP_PROJECT_ID')
         if not project_id:
             logger.error("❌ GCP_PROJECT_ID está vacío o no definido")
@@ -337,6 +1013,13 @@ def obtener_token_secreto(nombre_secreto="token"):
         logger.error(f"❌ Error accediendo a Secret Manager: {e}")
         return None
 
+# Caché del token de Secret Manager (se refresca en segundo plano antes de expirar)
+validador_token = ValidadorToken(
+    obtener_token_secreto,
+    ttl=int(os.getenv("TOKEN_CACHE_TTL", "300")),
+    margen_refresco=float(os.getenv("TOKEN_CACHE_MARGEN_REFRESCO", "0.2"))
+)
+
 @app.route('/rechazar/<int:id>', methods=['POST'])
 @requiere_sesion
 def rechazar(id):
@@ -344,9 +1027,97 @@ def rechazar(id):
     if not motivo:
         return jsonify({"error": "El motivo es obligatorio"}), 400
 
+    cuerpo, codigo = revisar_solicitud(id, "rechazado", motivo)
+    return jsonify(cuerpo), codigo
+
+def mensaje_aprobacion():
+    asunto = "✅ Documentación aprobada - Impocali"
+    mensaje_html = """
+    <div style="font-family: Arial, sans-serif; color: #333;">
+        <h2 style="color: #5cb85c;">¡Documentación Aprobada!</h2>
+        <p>Hola,</p>
+        <p>Nos complace informarte que tu documentación ha sido <strong>aprobada correctamente</strong>.</p>
+        <p>Ya puedes continuar con los siguientes pasos desde la plataforma de autogestión.</p>
+        <p style="margin-top: 20px;">Gracias,<br><strong>Equipo Impocali</strong></p>
+    </div>
+    """
+    return asunto, mensaje_html
+
+def mensaje_rechazo(motivo):
+    asunto = "📄 Tu solicitud ha sido rechazada - Impocali"
+    mensaje_html = f"""
+    <div style="font-family: Arial, sans-serif; color: #333;">
+        <h2 style="color: #d9534f;">Solicitud Rechazada</h2>
+        <p>Hola,</p>
+        <p>Lamentamos informarte que tu solicitud fue <strong>rechazada</strong> por el siguiente motivo:</p>
+        <blockquote style="border-left: 4px solid #d9534f; padding-left: 10px; color: #a94442;">
+            {motivo}
+        </blockquote>
+        <p>Por favor revisa la documentación y vuelve a subirla en el portal de autogestión.</p>
+        <p style="margin-top: 20px;">Gracias,<br><strong>Equipo Impocali</strong></p>
+    </div>
+    """
+    return asunto, mensaje_html
+
+def enviar_correo(destinatario, asunto, mensaje_html):
+    """Envía un correo HTML por Gmail. Lanza una excepción si no se pudo enviar."""
+    from email.mime.text import MIMEText
+    remitente = os.getenv('GMAIL_SENDER')
+
+    mensaje = MIMEText(mensaje_html, 'html')
+    mensaje['to'] = destinatario
+    mensaje['from'] = remitente
+    mensaje['subject'] = asunto
+
+    mensaje_base64 = base64.urlsafe_b64encode(mensaje.as_bytes()).decode()
+    cuerpo = {'raw': mensaje_base64}
+
+    gestor_gmail.enviar(cuerpo)
+    logger.info(f"📧 Correo '{asunto}' enviado a {destinatario}")
+
+# Credenciales y servicio de Gmail compartidos (se recargan si cambia el secreto montado)
+gestor_gmail = GestorGmail(TOKEN_FILE, margen_refresco=int(os.getenv("GMAIL_MARGEN_REFRESCO", "300")))
+
+# Remitente en segundo plano de la bandeja de salida (tabla correos_salida)
+remitente_correos = RemitenteCorreos(
+    conexion_db,
+    enviar_correo,
+    lote=int(os.getenv("CORREOS_LOTE", "20")),
+    max_intentos=int(os.getenv("CORREOS_MAX_INTENTOS", "6")),
+    concurrencia=int(os.getenv("CORREOS_CONCURRENCIA", "4")),
+    # messages.send consume 100 de las 250 unidades por segundo que Gmail permite por usuario
+    por_segundo=float(os.getenv("CORREOS_POR_SEGUNDO", "2"))
+)
+if os.getenv("REMITENTE_CORREOS_ACTIVO", "1" if env == "production" else "0") == "1":
+    remitente_correos.asegurar_iniciado()
+
+# Contadores internos expuestos en /metrics junto con las latencias
+registrar_colector("token", validador_token.metricas)
+registrar_colector("pool_db", pool_db.metricas)
+registrar_colector("cache_solicitudes", cache_solicitudes.metricas)
+registrar_colector("remitente_correos", remitente_correos.metricas)
+registrar_colector("gmail", gestor_gmail.metricas)
+registrar_colector("optimizacion", optimizador.metricas)
+registrar_colector("eventos_admin", difusor_eventos.metricas)
+if cache_extracciones is not None:
+    registrar_colector("cache_extracciones", cache_extracciones.metricas)
+
+# Estado -> (mensaje del error de conexión, prefijo del log de error) de cada decisión
+REVISIONES = {
+    "aprobado": ("Error de conexión", "Error en aprobación"),
+    "rechazado": ("Error de conexión a la base de datos", "Error en rechazo de solicitud"),
+}
+
+
+def revisar_solicitud(id, estado, motivo=None):
+    """
+    Aprueba o rechaza una solicitud y encola su correo en la misma transacción.
+    Devuelve (cuerpo_json, codigo_http). La usan /aceptar, /rechazar y el modo ASGI.
+    """
+    error_conexion, error_log = REVISIONES[estado]
     conn = get_db_connection()
     if not conn:
-        return jsonify({"error": "Error de conexión a la base de datos"}), 500
+        return {"error": error_conexion}, 500
 
     try:
         cursor = conn.cursor(dictionary=True)
@@ -355,167 +1126,178 @@ def rechazar(id):
         correo_destino = fila['correo'] if fila else None
 
         cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE solicitudes SET estado = %s, motivo_rechazo = %s WHERE id = %s",
-            ('rechazado', motivo, id)
-        )
+        if estado == "rechazado":
+            cursor.execute(
+                "UPDATE solicitudes SET estado = %s, motivo_rechazo = %s WHERE id = %s",
+                (estado, motivo, id)
+            )
+        else:
+            cursor.execute("UPDATE solicitudes SET estado = %s WHERE id = %s", (estado, id))
+        # El correo se confirma en la misma transacción y lo envía el remitente en segundo plano
+        if correo_destino:
+            asunto, mensaje_html = mensaje_rechazo(motivo) if estado == "rechazado" else mensaje_aprobacion()
+            encolar_correo(cursor, id, correo_destino, asunto, mensaje_html)
         conn.commit()
-        logger.info(f"📄 Solicitud {id} rechazada con motivo: {motivo}")
+        cache_solicitudes.invalidar(id)
+        if estado == "rechazado":
+            logger.info(f"📄 Solicitud {id} rechazada con motivo: {motivo}")
+        else:
+            logger.info(f"Solicitud {id} aprobada.")
 
         if correo_destino:
-            asunto = "📄 Tu solicitud ha sido rechazada - Impocali"
-            mensaje_html = f"""
-            <div style="font-family: Arial, sans-serif; color: #333;">
-                <h2 style="color: #d9534f;">Solicitud Rechazada</h2>
-                <p>Hola,</p>
-                <p>Lamentamos informarte que tu solicitud fue <strong>rechazada</strong> por el siguiente motivo:</p>
-                <blockquote style="border-left: 4px solid #d9534f; padding-left: 10px; color: #a94442;">
-                    {motivo}
-                </blockquote>
-                <p>Por favor revisa la documentación y vuelve a subirla en el portal de autogestión.</p>
-                <p style="margin-top: 20px;">Gracias,<br><strong>Equipo Impocali</strong></p>
-            </div>
-            """
-            enviar_correo_rechazo(correo_destino, asunto, mensaje_html)
+            remitente_correos.despertar()
+        if fila:
+            difusor_eventos.publicar(SOLICITUD_ESTADO, {"id": id, "estado": estado})
 
-        return jsonify({"status": "ok"})
+        return {"status": "ok"}, 200
 
     except Exception as e:
-        logger.error(f"❌ Error en rechazo de solicitud: {e}")
-        return jsonify({"error": "Error interno"}), 500
+        conn.rollback()
+        logger.error(f"❌ {error_log}: {e}")
+        return {"error": "Error interno"}, 500
 
     finally:
         conn.close()
 
-def enviar_correo_aprobacion(destinatario):
-    remitente = os.getenv('GMAIL_SENDER')
 
-    try:
-        from auth import TOKEN_FILE
-        from google.auth.transport.requests import Request
+# Decisión del cuerpo de /revisar -> estado de la solicitud
+DECISIONES = {"aceptar": "aprobado", "rechazar": "rechazado"}
+REVISION_LOTE_MAXIMO = int(os.getenv("REVISION_LOTE_MAXIMO", "500"))
 
-        with open(TOKEN_FILE, "rb") as token_file:
-            creds = pickle.load(token_file)
-
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-                logger.info("🔁 Token de Gmail refrescado exitosamente.")
-            else:
-                logger.error("❌ Token inválido y sin refresh_token. Requiere reautenticación.")
-                return False
 
-        service = build('gmail', 'v1', credentials=creds)
+def leer_revision_lote(datos):
+    """Valida el cuerpo de /revisar. Devuelve (error, ids, estado, motivo)."""
+    if not isinstance(datos, dict):
+        return "Se esperaba un objeto JSON", None, None, None
+    estado = DECISIONES.get(datos.get("decision"))
+    if not estado:
+        return "'decision' debe ser 'aceptar' o 'rechazar'", None, None, None
 
-        mensaje_html = """
-        <div style="font-family: Arial, sans-serif; color: #333;">
-            <h2 style="color: #5cb85c;">¡Documentación Aprobada!</h2>
-            <p>Hola,</p>
-            <p>Nos complace informarte que tu documentación ha sido <strong>aprobada correctamente</strong>.</p>
-            <p>Ya puedes continuar con los siguientes pasos desde la plataforma de autogestión.</p>
-            <p style="margin-top: 20px;">Gracias,<br><strong>Equipo Impocali</strong></p>
-        </div>
-        """
-
-        mensaje = MIMEText(mensaje_html, 'html')
-        mensaje['to'] = destinatario
-        mensaje['from'] = remitente
-        mensaje['subject'] = "✅ Documentación aprobada - Impocali"
+    ids = datos.get("ids")
+    if not isinstance(ids, list) or not ids:
+        return "'ids' debe ser una lista no vacía", None, None, None
+    if any(not isinstance(i, int) or isinstance(i, bool) or i <= 0 for i in ids):
+        return "'ids' solo admite enteros positivos", None, None, None
+    # Sin duplicados y en el orden recibido
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > REVISION_LOTE_MAXIMO:
+        return f"Máximo {REVISION_LOTE_MAXIMO} solicitudes por petición", None, None, None
 
-        mensaje_base64 = base64.urlsafe_b64encode(mensaje.as_bytes()).decode()
-        cuerpo = {'raw': mensaje_base64}
+    motivo = str(datos.get("motivo") or "").strip()
+    if estado == "rechazado" and not motivo:
+        return "El motivo es obligatorio", None, None, None
+    return None, ids, estado, motivo or None
 
-        service.users().messages().send(userId="me", body=cuerpo).execute()
-        logger.info(f"📧 Correo de aprobación enviado a {destinatario}")
-        return True  # Éxito
 
-    except Exception as e:
-        logger.error(f"❌ Error al enviar correo de aprobación a {destinatario}: {e}")
-        return False  # Falla
-@app.route('/aceptar/<int:id>', methods=['POST'])
-@requiere_sesion
-def aceptar(id):
+def revisar_lote(ids, estado, motivo=None):
+    """
+    Aplica la misma decisión a varias solicitudes en una sola transacción: un
+    SELECT y un UPDATE sobre el conjunto de ids y los correos en un único
+    INSERT a la bandeja de salida, uno por destinatario aunque tenga varias
+    solicitudes en el lote. Las que ya tenían ese estado no se modifican ni se
+    vuelven a notificar, así que reintentar un lote es seguro.
+    Devuelve (cuerpo_json, codigo_http) con el resultado de cada id.
+    """
+    error_conexion, error_log = REVISIONES[estado]
     conn = get_db_connection()
     if not conn:
-        return jsonify({"error": "Error de conexión"}), 500
+        return {"error": error_conexion}, 500
 
+    cambiar, destinatarios = [], {}
     try:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT correo FROM solicitudes WHERE id = %s", (id,))
-        fila = cursor.fetchone()
-        correo_destino = fila['correo'] if fila else None
+        cursor.execute(
+            f"SELECT id, estado, correo FROM solicitudes WHERE id IN ({', '.join(['%s'] * len(ids))})", ids
+        )
+        filas = {fila["id"]: fila for fila in cursor.fetchall()}
+        cambiar = [i for i in ids if i in filas and filas[i]["estado"] != estado]
 
-        cursor = conn.cursor()
-        cursor.execute("UPDATE solicitudes SET estado = %s WHERE id = %s", ('aprobado', id))
+        if cambiar:
+            marcadores = ", ".join(["%s"] * len(cambiar))
+            cursor = conn.cursor()
+            if estado == "rechazado":
+                cursor.execute(
+                    f"UPDATE solicitudes SET estado = %s, motivo_rechazo = %s WHERE id IN ({marcadores})",
+                    [estado, motivo, *cambiar]
+                )
+            else:
+                cursor.execute(f"UPDATE solicitudes SET estado = %s WHERE id IN ({marcadores})", [estado, *cambiar])
+
+            asunto, mensaje_html = mensaje_rechazo(motivo) if estado == "rechazado" else mensaje_aprobacion()
+            for i in cambiar:
+                correo = filas[i]["correo"]
+                if correo and correo not in destinatarios:
+                    destinatarios[correo] = i
+            encolar_correos(cursor, [(i, correo, asunto, mensaje_html) for correo, i in destinatarios.items()])
         conn.commit()
-        logger.info(f"Solicitud {id} aprobada.")
-
-        if correo_destino:
-            exito = enviar_correo_aprobacion(correo_destino)
-            if not exito:
-                return jsonify({
-                    "status": "error",
-                    "mensaje": "La solicitud fue aprobada, pero el correo no pudo enviarse."
-                }), 202  # Aprobado, pero con advertencia
-
-        return jsonify({"status": "ok"})
 
     except Exception as e:
-        logger.error(f"❌ Error en aprobación: {e}")
-        return jsonify({"error": "Error interno"}), 500
+        conn.rollback()
+        logger.error(f"❌ {error_log} (lote de {len(ids)}): {e}")
+        return {"error": "Error interno"}, 500
 
     finally:
         conn.close()
 
-def enviar_correo_rechazo(destinatario, asunto, mensaje_html):
-    remitente = os.getenv('GMAIL_SENDER')
-
-    try:
-        from auth import TOKEN_FILE
-        from google.auth.transport.requests import Request
-
-        with open(TOKEN_FILE, "rb") as token_file:
-            creds = pickle.load(token_file)
-
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-                logger.info("🔁 Token de Gmail refrescado exitosamente.")
-            else:
-                logger.error("❌ Token inválido y sin refresh_token. Requiere reautenticación.")
-                return False
-
-        service = build('gmail', 'v1', credentials=creds)
+    for i in cambiar:
+        cache_solicitudes.invalidar(i)
+    if destinatarios:
+        remitente_correos.despertar()
+    difusor_eventos.publicar_varios(SOLICITUD_ESTADO, [{"id": i, "estado": estado} for i in cambiar])
+
+    resultados = []
+    for i in ids:
+        fila = filas.get(i)
+        if fila is None:
+            resultados.append({"id": i, "resultado": "no_encontrada"})
+        elif fila["estado"] == estado:
+            resultados.append({"id": i, "resultado": "sin_cambios"})
+        else:
+            correo = fila["correo"]
+            # "agrupado": el destinatario ya recibe el correo de otra solicitud del lote
+            notificacion = "sin_correo" if not correo else "encolado" if destinatarios[correo] == i else "agrupado"
+            resultados.append({"id": i, "resultado": "actualizada", "correo": notificacion})
+
+    resumen = {
+        "actualizadas": len(cambiar),
+        "sin_cambios": sum(r["resultado"] == "sin_cambios" for r in resultados),
+        "no_encontradas": sum(r["resultado"] == "no_encontrada" for r in resultados),
+        "correos": len(destinatarios),
+    }
+    logger.info(f"🗂️ Revisión masiva ({estado}): {resumen}")
+    return {"status": "ok", "estado": estado, "resumen": resumen, "resultados": resultados}, 200
 
-        mensaje = MIMEText(mensaje_html, 'html')
-        mensaje['to'] = destinatario
-        mensaje['from'] = remitente
-        mensaje['subject'] = asunto
 
-        mensaje_base64 = base64.urlsafe_b64encode(mensaje.as_bytes()).decode()
-        cuerpo = {'raw': mensaje_base64}
+@app.route('/revisar', methods=['POST'])
+@requiere_sesion
+def revisar():
+    """Cuerpo: {"ids": [...], "decision": "aceptar" | "rechazar", "motivo": "..."}."""
+    error, ids, estado, motivo = leer_revision_lote(request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
+    cuerpo, codigo = revisar_lote(ids, estado, motivo)
+    return jsonify(cuerpo), codigo
 
-        service.users().messages().send(userId="me", body=cuerpo).execute()
-        logger.info(f"📧 Correo de rechazo enviado a {destinatario}")
-        return True  # éxito
 
-    except Exception as e:
-        logger.error(f"❌ Error al enviar correo de rechazo a {destinatario}: {e}")
-        return False  # falla
+@app.route('/aceptar/<int:id>', methods=['POST'])
+@requiere_sesion
+def aceptar(id):
+    cuerpo, codigo = revisar_solicitud(id, "aprobado")
+    return jsonify(cuerpo), codigo
 
 @app.route('/validar-token', methods=['GET'])
 def validar_token_simple():
     auth_header = request.headers.get('Authorization', '')
     token = auth_header.replace('Bearer ', '').strip()
-    if token == obtener_token_secreto():
+    if validador_token.validar(token):
         return jsonify({"status": "ok"})
     return jsonify({"error": "Token inválido"}), 401
 @app.route('/probar-envio-correo', methods=['POST'])
 
 def probar_envio_correo():
+    from email.mime.text import MIMEText
     from google.auth.exceptions import GoogleAuthError
     from googleapiclient.errors import HttpError
-    from google.auth.transport.requests import Request
 
     data = request.json
     destinatario = data.get('destinatario')
@@ -534,19 +1316,11 @@ def probar_envio_correo():
     """
 
     try:
-        from auth import TOKEN_FILE
-        with open(TOKEN_FILE, "rb") as token_file:
-            creds = pickle.load(token_file)
-
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-                logger.info("🔁 Token de Gmail refrescado exitosamente.")
-            else:
-                logger.error("❌ Token inválido y sin refresh_token.")
-                return jsonify({"error": "Token inválido o requiere reautenticación"}), 401
-
-        service = build('gmail', 'v1', credentials=creds)
+        try:
+            gestor_gmail.credenciales()
+        except ErrorCredencialesGmail:
+            logger.error("❌ Token inválido y sin refresh_token.")
+            return jsonify({"error": "Token inválido o requiere reautenticación"}), 401
 
         mensaje = MIMEText(mensaje_html, 'html')
         mensaje['to'] = destinatario
@@ -556,7 +1330,7 @@ def probar_envio_correo():
         mensaje_base64 = base64.urlsafe_b64encode(mensaje.as_bytes()).decode()
         cuerpo = {'raw': mensaje_base64}
 
-        service.users().messages().send(userId="me", body=cuerpo).execute()
+        gestor_gmail.enviar(cuerpo)
 
         return jsonify({
             "status": "ok",
@@ -598,6 +1372,17 @@ def handle_exception(e):
 def iframe():
     return render_template('iframe.html')
 
+@app.route('/healthz')
+def healthz():
+    """
+    Chequeo liviano para las sondas de Kubernetes: no toca la BD ni los SDK.
+    Los tiempos de arranque van en /metrics; el detalle por import, con
+    `python arranque.py`.
+    """
+    return jsonify({"status": "ok"})
+
+registrar_colector("arranque", registro_arranque.metricas)
+registro_arranque.finalizar()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,123 @@
+import sys
+import time
+import importlib
+import logging
+import builtins
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class RegistroArranque:
+    """
+    Mide cuánto tarda en cargar app.py y cuánto cuesta cada import.
+
+    El total y las etapas (`etapa()` mide bloques sueltos, como el
+    precalentamiento de clientes) se registran siempre. El costo por import
+    solo se mide con `python arranque.py`: entre `iniciar_medicion()` y
+    `detener_medicion()` se reemplaza `builtins.__import__` para cronometrar
+    las sentencias import del hilo que carga la app (solo las de primer nivel:
+    el costo de las dependencias que arrastra cada módulo queda incluido en él).
+    En producción no se toca `builtins`.
+    """
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.importaciones = {}
+        self.etapas = {}
+        self.total = None
+        self._lock = threading.Lock()
+        self._original = None
+
+    def iniciar_medicion(self):
+        if self._original is not None:
+            return
+        original = self._original = builtins.__import__
+        hilo = threading.get_ident()
+        local = threading.local()
+
+        def importar(name, globals=None, locals=None, fromlist=(), level=0):
+            if threading.get_ident() != hilo or getattr(local, "dentro", False):
+                return original(name, globals, locals, fromlist, level)
+            local.dentro = True
+            inicio = time.perf_counter()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                local.dentro = False
+                nombre = "." * level + name
+                if fromlist:
+                    nombre += f" ({', '.join(fromlist)})"
+                self.importaciones[nombre] = self.importaciones.get(nombre, 0.0) + time.perf_counter() - inicio
+
+        builtins.__import__ = importar
+
+    def detener_medicion(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def registrar(self, nombre, segundos):
+        with self._lock:
+            self.etapas[nombre] = segundos
+
+    @contextmanager
+    def etapa(self, nombre):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar(nombre, time.perf_counter() - inicio)
+
+    def finalizar(self, mas_lentos=8):
+        """Cierra la medición y deja en el log el total y los imports más costosos."""
+        self.detener_medicion()
+        self.total = time.perf_counter() - self.inicio
+        lentos = sorted(self.importaciones.items(), key=lambda x: x[1], reverse=True)[:mas_lentos]
+        mensaje = f"🚀 App cargada en {self.total * 1000:.0f} ms."
+        # Los imports solo se miden con `python arranque.py`
+        if lentos:
+            mensaje += " Imports más lentos: " + ", ".join(f"{nombre} {segundos * 1000:.0f} ms" for nombre, segundos in lentos)
+        logger.info(mensaje)
+
+    def reporte(self):
+        return {
+            "total_ms": round(self.total * 1000, 1) if self.total is not None else None,
+            "importaciones_ms": {
+                nombre: round(segundos * 1000, 1)
+                for nombre, segundos in sorted(self.importaciones.items(), key=lambda x: x[1], reverse=True)
+            },
+            "etapas_ms": {nombre: round(segundos * 1000, 1) for nombre, segundos in self.etapas.items()},
+        }
+
+    def metricas(self):
+        valores = {"total_ms": round(self.total * 1000, 1) if self.total is not None else 0.0}
+        with self._lock:
+            for nombre, segundos in self.etapas.items():
+                valores[f"{nombre}_ms"] = round(segundos * 1000, 1)
+        return valores
+
+
+registro_arranque = RegistroArranque()
+
+
+if __name__ == "__main__":
+    # python arranque.py → carga app.py y muestra el costo de cada import
+    logging.basicConfig(level=logging.WARNING)
+    # app.py usa el módulo `arranque` importado, no este __main__
+    from arranque import registro_arranque as registro
+    registro.iniciar_medicion()
+    try:
+        importlib.import_module("app")
+    finally:
+        # Si la carga falla, __import__ se restaura igual
+        registro.detener_medicion()
+    reporte = registro.reporte()
+    print(f"Carga de app.py: {reporte['total_ms']} ms")
+    for nombre, ms in reporte["importaciones_ms"].items():
+        if ms >= 0.5:
+            print(f"  {ms:8.1f} ms  {nombre}")
+    for nombre, ms in reporte["etapas_ms"].items():
+        print(f"  {ms:8.1f} ms  [etapa] {nombre}")
+    sys.exit(0)
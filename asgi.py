@@ -0,0 +1,415 @@
+"""
+Modo de servicio ASGI.
+
+    uvicorn asgi:aplicacion --host 0.0.0.0 --port 8000
+
+/subir, /subir/finalizar, /subir/fragmentos/<sesion>/completar, /aceptar,
+/rechazar, /revisar y el flujo SSE /admin/eventos se atienden en el event
+loop: la espera a Document AI, GCS y Secret Manager usa sus clientes
+asíncronos y no ocupa un hilo, así que un solo worker sostiene cientos de
+subidas en curso. Las
+consultas a MySQL son cortas y siguen en el pool de db.py, en un executor del
+mismo tamaño que el pool. El resto de rutas (admin, detalle, auth, métricas...)
+las sirve la app Flask montada como WSGI, con los mismos contratos.
+"""
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+import traceback
+from datetime import datetime
+from functools import wraps, partial
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route, Mount
+
+import app as app_flask
+import subida_fragmentada
+from db import DB_POOL_SIZE
+from cargas import cargar_archivo
+from clientes import registro_clientes_async
+from pipeline import ejecutar_en_paralelo_async
+from eventos import flujo_sse_async, leer_ultimo_id
+from entidades import EntidadExtraida, campos_desde_entidades
+from metricas import medir_dependencia, dependencia_errores, peticiones_duracion, peticiones_total, peticiones_en_curso
+
+logger = logging.getLogger(__name__)
+
+# Hilos para las consultas a MySQL (más hilos que conexiones solo harían esperar al pool)
+executor_db = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="asgi-db")
+
+
+async def en_hilo_db(funcion, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(executor_db, partial(funcion, *args, **kwargs))
+
+
+def medido(ruta):
+    """Registra la petición en las métricas HTTP, como los hooks de configurar_metricas en Flask."""
+    def decorador(f):
+        @wraps(f)
+        async def envoltura(request):
+            peticiones_en_curso.inc(ruta)
+            inicio = time.perf_counter()
+            codigo = 500
+            try:
+                respuesta = await f(request)
+                codigo = respuesta.status_code
+                return respuesta
+            finally:
+                peticiones_duracion.observar(time.perf_counter() - inicio, ruta, request.method)
+                peticiones_total.inc(ruta, request.method, codigo)
+                peticiones_en_curso.dec(ruta)
+        return envoltura
+    return decorador
+
+
+# 🔹 Secret Manager
+
+async def obtener_token_secreto_async(nombre_secreto="token"):
+    project_id = os.getenv('GCP_PROJECT_ID')
+    if not project_id:
+        logger.error("❌ GCP_PROJECT_ID está vacío o no definido")
+        dependencia_errores.inc("secret_manager")
+        return None
+    try:
+        client = await registro_clientes_async.obtener("secretmanager")
+        name = f"projects/{project_id}/secrets/{nombre_secreto}/versions/latest"
+        with medir_dependencia("secret_manager"):
+            response = await client.access_secret_version(request={"name": name})
+        return json.loads(response.payload.data.decode("UTF-8")).get("token")
+    except Exception as e:
+        logger.error(f"❌ Error accediendo a Secret Manager: {e}")
+        return None
+
+
+async def token_sistema():
+    return await app_flask.validador_token.obtener_async(obtener_token_secreto_async)
+
+
+def token_de(request):
+    return request.headers.get('Authorization', '').replace('Bearer ', '').strip()
+
+
+def requiere_sesion(f):
+    @wraps(f)
+    async def decorated(request):
+        token = token_de(request) or request.query_params.get('token', '')
+        esperado = await token_sistema()
+        if not esperado:
+            logger.error("Token secreto no disponible")
+        if not token or not app_flask.comparar_tokens(token, esperado):
+            return JSONResponse({"error": "Sesión inválida o expirada."}, status_code=401)
+        return await f(request)
+    return decorated
+
+
+# 🔹 Document AI y GCS
+
+async def procesar_documento_async(documento, processor_id, usar_cache=True):
+    from google.api_core.exceptions import InvalidArgument
+
+    clave, en_cache = await asyncio.to_thread(app_flask.buscar_extraccion, documento, processor_id, usar_cache)
+    if en_cache is not None:
+        return en_cache
+
+    try:
+        client = await registro_clientes_async.obtener("documentai")
+        request = await asyncio.to_thread(app_flask.peticion_documentai, documento, processor_id)
+        with medir_dependencia("documentai"):
+            result = await client.process_document(request=request)
+        del request
+
+        entidades = campos_desde_entidades(EntidadExtraida.desde_proto(e) for e in result.document.entities)
+        del result
+
+        await asyncio.to_thread(app_flask.guardar_extraccion, clave, documento, processor_id, entidades)
+        return entidades
+
+    except InvalidArgument as e:
+        logger.error(f"Error en Document AI: {e}")
+        return {"error": f"Formato no soportado ({documento.mime_type}): {str(e)}"}
+
+
+async def extraer_documento_async(documento, tipo, processor_id, usar_cache=True, reportes=None):
+    """Equivalente asíncrono de app.extraer_documento (la optimización corre en un hilo)."""
+    optimizador = app_flask.optimizador
+    enviado, reporte = await asyncio.to_thread(optimizador.optimizar, documento, tipo)
+    if reportes is not None:
+        reportes[tipo] = reporte
+
+    campos = await procesar_documento_async(enviado, processor_id, usar_cache)
+    optimizador.registrar_extraccion(reporte, campos)
+
+    if optimizador.debe_comparar(documento, enviado):
+        optimizador.registrar_comparacion(reporte, await procesar_documento_async(documento, processor_id, usar_cache))
+    return campos
+
+
+async def subir_a_gcs_async(documento, carpeta, nombre_archivo):
+    client = await registro_clientes_async.obtener("storage")
+    with medir_dependencia("gcs"):
+        return await client.subir(documento, os.getenv("GCS_BUCKET_NAME"), f"{carpeta}/{nombre_archivo}")
+
+
+async def procesar_solicitud_async(usuario_id, correo, fecha_actual, carpeta_gcs, archivos_subidos, usar_cache=True):
+    """Como app.procesar_solicitud: subidas y extracciones concurrentes en el loop; el guardado en un hilo."""
+    optimizaciones = {}
+    tareas = {}
+    ya_subidos = app_flask.subidas_previas(archivos_subidos)
+    for tipo, datos in archivos_subidos.items():
+        _, processor_id = app_flask.DOCUMENTOS[tipo]
+        if ("subida", tipo) not in ya_subidos:
+            tareas[("subida", tipo)] = (
+                partial(subir_a_gcs_async, datos["documento"], carpeta_gcs, datos["final_name"]),
+                app_flask.TIMEOUT_SUBIDA_GCS
+            )
+        tareas[("extraccion", tipo)] = (
+            partial(extraer_documento_async, datos["documento"], tipo, processor_id, usar_cache, optimizaciones),
+            app_flask.TIMEOUT_EXTRACCION
+        )
+    resultados = {**await ejecutar_en_paralelo_async(tareas), **ya_subidos}
+    return await en_hilo_db(
+        app_flask.registrar_solicitud, usuario_id, correo, fecha_actual, archivos_subidos, resultados, optimizaciones
+    )
+
+
+class ArchivoFormulario:
+    """Adapta un `UploadFile` de Starlette a lo que esperan cargar_archivo y encolar_subida (FileStorage)."""
+
+    def __init__(self, subido):
+        self.filename = subido.filename
+        self.stream = subido.file
+
+    def save(self, ruta):
+        self.stream.seek(0)
+        with open(ruta, "wb") as destino:
+            shutil.copyfileobj(self.stream, destino, 1024 * 1024)
+
+
+# 🔹 Rutas
+
+@medido("/subir")
+async def subir_documentos(request):
+    formulario = None
+    try:
+        logger.info("📥 [INICIO] Subida de documentos (ASGI)")
+        token = token_de(request)
+        logger.info(f"🔑 Token recibido: {token[:10]}...")
+
+        error = app_flask.verificar_token_subida(token, await token_sistema())
+        if error:
+            return JSONResponse(error[0], status_code=error[1])
+
+        # Starlette vuelca a disco las partes grandes: la memoria por subida queda acotada
+        formulario = await request.form()
+        archivos_form = {
+            campo: formulario[campo] for campo in formulario
+            if not isinstance(formulario[campo], str)
+        }
+        error, usuario_id, correo = app_flask.leer_formulario_subida(formulario, archivos_form)
+        if error:
+            return JSONResponse(error[0], status_code=error[1])
+
+        archivos = {
+            tipo: ArchivoFormulario(archivos_form[campo]) for campo, tipo in app_flask.CAMPOS_ARCHIVOS.items()
+        }
+
+        now = datetime.now()
+        fecha_actual = now.strftime("%Y-%m-%d %H:%M:%S")
+        fecha_para_archivo = now.strftime("%Y-%m-%d")
+
+        carpeta_gcs = await en_hilo_db(app_flask.obtener_carpeta_gcs, usuario_id, correo, fecha_para_archivo)
+        if not carpeta_gcs:
+            return PlainTextResponse("Error al conectar a la base de datos", status_code=500)
+
+        usar_cache = (request.query_params.get("sin_cache") or formulario.get("sin_cache")) != "1"
+
+        modo = request.query_params.get("modo") or formulario.get("modo") or app_flask.SUBIR_MODO
+        if modo == "async":
+            job_id = await asyncio.to_thread(
+                app_flask.encolar_subida,
+                usuario_id, correo, fecha_actual, fecha_para_archivo, carpeta_gcs, archivos, usar_cache
+            )
+            logger.info(f"📨 Subida encolada como trabajo {job_id}")
+            return JSONResponse({
+                "status": "en_cola",
+                "job_id": job_id,
+                "estado_url": f"/subir/estado/{job_id}"
+            }, status_code=202)
+
+        archivos_subidos = {}
+        try:
+            for tipo, archivo in archivos.items():
+                archivos_subidos[tipo] = {
+                    "documento": await asyncio.to_thread(cargar_archivo, archivo, app_flask.UPLOAD_FOLDER),
+                    "final_name": f"{fecha_para_archivo}-{archivo.filename}"
+                }
+            codigo, cuerpo = await procesar_solicitud_async(
+                usuario_id, correo, fecha_actual, carpeta_gcs, archivos_subidos, usar_cache
+            )
+        finally:
+            for datos in archivos_subidos.values():
+                datos["documento"].liberar()
+
+        return JSONResponse(cuerpo, status_code=codigo)
+
+    except Exception as e:
+        logger.error("❌ Error en /subir:")
+        logger.error(traceback.format_exc())
+        return JSONResponse({"error": "Error interno del servidor", "detalle": str(e)}, status_code=500)
+
+    finally:
+        if formulario is not None:
+            await formulario.close()
+
+
+@medido("/subir/finalizar")
+async def finalizar_subida(request):
+    error = app_flask.verificar_token_subida(token_de(request), await token_sistema())
+    if error:
+        return JSONResponse(error[0], status_code=error[1])
+
+    try:
+        datos = await request.json()
+    except ValueError:
+        datos = None
+    if not isinstance(datos, dict):
+        datos = {}
+    # La verificación de los objetos usa el cliente síncrono de GCS (una lectura de metadatos por archivo)
+    error, contexto = await asyncio.to_thread(app_flask.preparar_finalizacion, datos)
+    if error:
+        return JSONResponse(error[0], status_code=error[1])
+
+    clave, usuario_id, correo, carpeta_gcs, archivos_subidos = contexto
+    fecha_actual = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    codigo, cuerpo = 500, None
+    try:
+        codigo, cuerpo = await procesar_solicitud_async(
+            usuario_id, correo, fecha_actual, carpeta_gcs, archivos_subidos, str(datos.get("sin_cache")) != "1"
+        )
+    finally:
+        await en_hilo_db(app_flask.cerrar_registro, clave, codigo, cuerpo)
+    return JSONResponse(cuerpo, status_code=codigo)
+
+
+@medido("/subir/fragmentos/<sesion>/completar")
+async def completar_subida_fragmentada(request):
+    error = app_flask.verificar_token_subida(token_de(request), await token_sistema())
+    if error:
+        return JSONResponse(error[0], status_code=error[1])
+    try:
+        datos_sesion = subida_fragmentada.leer_sesion(app_flask.SECRETO_SUBIDAS, request.path_params["sesion"])
+    except subida_fragmentada.ErrorFragmentos as e:
+        return JSONResponse({"error": str(e)}, status_code=e.codigo)
+
+    # Como en Flask: sin_cache en la query o en el cuerpo JSON
+    sin_cache = request.query_params.get("sin_cache")
+    if not sin_cache:
+        try:
+            datos = await request.json()
+        except ValueError:
+            datos = None
+        if isinstance(datos, dict):
+            sin_cache = datos.get("sin_cache")
+
+    # La reserva, compose y el borrado de temporales usan la BD y el cliente síncrono de GCS
+    error, contexto = await asyncio.to_thread(app_flask.preparar_completar, datos_sesion)
+    if error:
+        return JSONResponse(error[0], status_code=error[1])
+
+    clave, usuario_id, correo, carpeta_gcs, archivos_subidos = contexto
+    fecha_actual = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    codigo, cuerpo = 500, None
+    try:
+        codigo, cuerpo = await procesar_solicitud_async(
+            usuario_id, correo, fecha_actual, carpeta_gcs, archivos_subidos, str(sin_cache) != "1"
+        )
+    finally:
+        await en_hilo_db(app_flask.cerrar_registro, clave, codigo, cuerpo)
+    return JSONResponse(cuerpo, status_code=codigo)
+
+
+@medido("/rechazar/<int:id>")
+@requiere_sesion
+async def rechazar(request):
+    formulario = await request.form()
+    motivo = (formulario.get("motivo") or "").strip()
+    if not motivo:
+        return JSONResponse({"error": "El motivo es obligatorio"}, status_code=400)
+
+    cuerpo, codigo = await en_hilo_db(app_flask.revisar_solicitud, request.path_params["id"], "rechazado", motivo)
+    return JSONResponse(cuerpo, status_code=codigo)
+
+
+@medido("/aceptar/<int:id>")
+@requiere_sesion
+async def aceptar(request):
+    cuerpo, codigo = await en_hilo_db(app_flask.revisar_solicitud, request.path_params["id"], "aprobado")
+    return JSONResponse(cuerpo, status_code=codigo)
+
+
+@medido("/revisar")
+@requiere_sesion
+async def revisar(request):
+    try:
+        datos = await request.json()
+    except ValueError:
+        datos = None
+    error, ids, estado, motivo = app_flask.leer_revision_lote(datos)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+
+    cuerpo, codigo = await en_hilo_db(app_flask.revisar_lote, ids, estado, motivo)
+    return JSONResponse(cuerpo, status_code=codigo)
+
+
+@medido("/admin/eventos")
+@requiere_sesion
+async def admin_eventos(request):
+    # En el event loop cada conexión abierta cuesta una corrutina, no un hilo: no hace falta SSE_MAX_CONEXIONES
+    ultimo_id = leer_ultimo_id(request.headers.get("Last-Event-ID") or request.query_params.get("ultimo_id"))
+    flujo = flujo_sse_async(app_flask.difusor_eventos, ultimo_id, app_flask.SSE_LATIDO, app_flask.SSE_DURACION)
+    return StreamingResponse(
+        flujo, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def error_inesperado(request, exc):
+    logger.error("Error inesperado:", exc_info=exc)
+    return JSONResponse({"error": "Error interno del servidor"}, status_code=500)
+
+
+@asynccontextmanager
+async def ciclo_de_vida(_aplicacion):
+    if os.getenv("PRECALENTAR_CLIENTES", "1" if app_flask.env == "production" else "0") == "1":
+        await registro_clientes_async.precalentar()
+    yield
+    await registro_clientes_async.cerrar()
+
+
+aplicacion = Starlette(
+    routes=[
+        Route("/subir", subir_documentos, methods=["POST"]),
+        Route("/subir/finalizar", finalizar_subida, methods=["POST"]),
+        Route("/subir/fragmentos/{sesion}/completar", completar_subida_fragmentada, methods=["POST"]),
+        Route("/aceptar/{id:int}", aceptar, methods=["POST"]),
+        Route("/rechazar/{id:int}", rechazar, methods=["POST"]),
+        Route("/revisar", revisar, methods=["POST"]),
+        Route("/admin/eventos", admin_eventos, methods=["GET"]),
+        # Todo lo demás lo atiende Flask en un pool de hilos propio
+        Mount("/", app=WSGIMiddleware(app_flask.app, workers=int(os.getenv("ASGI_HILOS_WSGI", "8")))),
+    ],
+    exception_handlers={Exception: error_inesperado},
+    lifespan=ciclo_de_vida,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(aplicacion, host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
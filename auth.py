@@ -1,5 +1,4 @@
 from flask import Blueprint, redirect, request, session, url_for
-from google_auth_oauthlib.flow import Flow
 import os
 import pickle
 import logging
@@ -33,6 +32,7 @@ def login():
     if os.path.exists(TOKEN_FILE):
         return redirect("/admin")
 
+    from google_auth_oauthlib.flow import Flow
     flow = Flow.from_client_secrets_file(
         CLIENT_SECRETS_FILE,
         scopes=SCOPES,
@@ -53,6 +53,7 @@ def callback():
         return "⚠️ Error: No se encontró el estado de sesión. Intenta nuevamente desde /login.", 400
 
     try:
+        from google_auth_oauthlib.flow import Flow
         flow = Flow.from_client_secrets_file(
             CLIENT_SECRETS_FILE,
             scopes=SCOPES,
@@ -0,0 +1,240 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PENDIENTE = "pendiente"
+ENVIANDO = "enviando"
+ENVIADO = "enviado"
+FALLIDO = "fallido"
+
+
+def encolar_correo(cursor, solicitud_id, destinatario, asunto, mensaje_html):
+    """
+    Inserta el correo en la bandeja de salida usando el cursor de la transacción
+    en curso, de modo que queda confirmado junto con el cambio de estado.
+    """
+    cursor.execute(
+        "INSERT INTO correos_salida (solicitud_id, destinatario, asunto, mensaje_html, estado, intentos, proximo_intento) "
+        "VALUES (%s, %s, %s, %s, %s, 0, NOW())",
+        (solicitud_id, destinatario, asunto, mensaje_html, PENDIENTE)
+    )
+    return cursor.lastrowid
+
+
+def encolar_correos(cursor, correos):
+    """
+    Igual que `encolar_correo` para varios correos a la vez: `correos` es una
+    lista de (solicitud_id, destinatario, asunto, mensaje_html) y se inserta
+    con un único INSERT de varias filas.
+    """
+    if not correos:
+        return
+    cursor.executemany(
+        "INSERT INTO correos_salida (solicitud_id, destinatario, asunto, mensaje_html, estado, intentos, proximo_intento) "
+        "VALUES (%s, %s, %s, %s, %s, 0, NOW())",
+        [(solicitud_id, destinatario, asunto, mensaje_html, PENDIENTE)
+         for solicitud_id, destinatario, asunto, mensaje_html in correos]
+    )
+
+
+class LimitadorTasa:
+    """
+    Cubeta de fichas compartida por los hilos de envío: como máximo
+    `por_segundo` envíos sostenidos, con ráfagas de hasta `rafaga`. Con
+    `por_segundo` <= 0 no limita.
+    """
+
+    def __init__(self, por_segundo, rafaga=1):
+        self.por_segundo = por_segundo
+        self.rafaga = max(1, rafaga)
+        self._fichas = float(self.rafaga)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+        self.esperas = 0
+
+    def esperar(self):
+        if self.por_segundo <= 0:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            self._fichas = min(self.rafaga, self._fichas + (ahora - self._ultimo) * self.por_segundo)
+            self._ultimo = ahora
+            # La ficha se reserva aunque falte: cada hilo espera su turno sin volver a competir
+            self._fichas -= 1
+            espera = -self._fichas / self.por_segundo if self._fichas < 0 else 0
+            if espera:
+                self.esperas += 1
+        if espera:
+            time.sleep(espera)
+
+
+class RemitenteCorreos:
+    """
+    Hilo que vacía la tabla `correos_salida`.
+
+    Cada ciclo reclama un lote de correos con un único UPDATE ... LIMIT (así
+    dos workers o réplicas no envían el mismo correo), los envía y registra el
+    resultado. Cada reclamo cuenta como un intento, así que los fallos se
+    reintentan con espera exponencial hasta `max_intentos`. Un correo
+    reclamado por un proceso que murió vuelve a estar disponible al vencer
+    `lease` segundos; si ya agotó sus intentos (p. ej. tumba al worker cada
+    vez) se marca como fallido en vez de reclamarse para siempre.
+
+    Los correos de un lote se envían con hasta `concurrencia` hilos y a no
+    más de `por_segundo` envíos por segundo en el proceso (cuota de Gmail),
+    para que una revisión masiva no se despache de a uno.
+    """
+
+    def __init__(self, obtener_conexion, enviar, lote=20, max_intentos=6,
+                 espera_base=30, espera_maxima=3600, lease=300, intervalo=5,
+                 concurrencia=1, por_segundo=0):
+        self._obtener_conexion = obtener_conexion
+        self._enviar = enviar
+        self._lote = lote
+        self._max_intentos = max_intentos
+        self._espera_base = espera_base
+        self._espera_maxima = espera_maxima
+        self._lease = lease
+        self._intervalo = intervalo
+        self._concurrencia = max(1, concurrencia)
+        self._limitador = LimitadorTasa(por_segundo, rafaga=self._concurrencia)
+
+        self._pid = None
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+
+        self.enviados = 0
+        self.fallidos = 0
+        self.reintentos = 0
+
+    def asegurar_iniciado(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            threading.Thread(target=self._bucle, daemon=True, name="remitente-correos").start()
+            self._pid = pid
+            logger.info(f"📮 Remitente de correos iniciado (pid {pid})")
+
+    def despertar(self):
+        self.asegurar_iniciado()
+        self._despertar.set()
+
+    def _bucle(self):
+        while True:
+            try:
+                procesados = self.procesar_lote()
+            except Exception as e:
+                logger.error(f"❌ Error procesando la bandeja de salida: {e}")
+                procesados = 0
+            # Si el lote vino lleno puede haber más pendientes: se sigue sin esperar
+            if procesados < self._lote:
+                self._despertar.wait(self._intervalo)
+                self._despertar.clear()
+
+    def _reclamar(self, reclamo):
+        with self._obtener_conexion() as conn:
+            if not conn:
+                return []
+            cursor = conn.cursor(dictionary=True)
+            # Lease vencido sin intentos restantes: el proceso murió con él las veces permitidas
+            cursor.execute(
+                "UPDATE correos_salida SET estado = %s, reclamado_por = NULL, "
+                "ultimo_error = COALESCE(ultimo_error, %s) "
+                "WHERE estado = %s AND proximo_intento <= NOW() AND intentos >= %s",
+                (FALLIDO, "Lease vencido sin respuesta del remitente", ENVIANDO, self._max_intentos)
+            )
+            if cursor.rowcount:
+                self.fallidos += cursor.rowcount
+                logger.error(f"❌ {cursor.rowcount} correos descartados: el remitente murió en cada uno de sus intentos")
+            cursor.execute(
+                "UPDATE correos_salida SET estado = %s, reclamado_por = %s, intentos = intentos + 1, "
+                "proximo_intento = NOW() + INTERVAL %s SECOND "
+                "WHERE estado IN (%s, %s) AND proximo_intento <= NOW() "
+                "ORDER BY id LIMIT %s",
+                (ENVIANDO, reclamo, self._lease, PENDIENTE, ENVIANDO, self._lote)
+            )
+            conn.commit()
+            cursor.execute(
+                "SELECT id, solicitud_id, destinatario, asunto, mensaje_html, intentos "
+                "FROM correos_salida WHERE reclamado_por = %s AND estado = %s",
+                (reclamo, ENVIANDO)
+            )
+            return cursor.fetchall()
+
+    def procesar_lote(self):
+        reclamo = uuid.uuid4().hex
+        correos = self._reclamar(reclamo)
+        if not correos:
+            return 0
+
+        if self._concurrencia > 1 and len(correos) > 1:
+            with ThreadPoolExecutor(min(self._concurrencia, len(correos)), thread_name_prefix="remitente") as executor:
+                resultados = list(executor.map(self._intentar, correos))
+        else:
+            resultados = [self._intentar(correo) for correo in correos]
+
+        enviados = [fila for destino, fila in resultados if destino == ENVIADO]
+        reintentar = [fila for destino, fila in resultados if destino == PENDIENTE]
+        fallidos = [fila for destino, fila in resultados if destino == FALLIDO]
+
+        with self._obtener_conexion() as conn:
+            if not conn:
+                # Los correos quedan "enviando" y se reintentan al vencer el lease
+                return len(correos)
+            cursor = conn.cursor()
+            if enviados:
+                cursor.executemany(
+                    "UPDATE correos_salida SET estado = %s, enviado_en = NOW(), "
+                    "ultimo_error = NULL, reclamado_por = NULL WHERE id = %s",
+                    enviados
+                )
+            if reintentar:
+                cursor.executemany(
+                    "UPDATE correos_salida SET estado = %s, ultimo_error = %s, "
+                    "proximo_intento = NOW() + INTERVAL %s SECOND, reclamado_por = NULL WHERE id = %s",
+                    reintentar
+                )
+            if fallidos:
+                cursor.executemany(
+                    "UPDATE correos_salida SET estado = %s, ultimo_error = %s, "
+                    "reclamado_por = NULL WHERE id = %s",
+                    fallidos
+                )
+            conn.commit()
+
+        self.enviados += len(enviados)
+        self.reintentos += len(reintentar)
+        self.fallidos += len(fallidos)
+        logger.info(f"📧 Bandeja de salida: {len(enviados)} enviados, {len(reintentar)} por reintentar, {len(fallidos)} fallidos")
+        return len(correos)
+
+    def _intentar(self, correo):
+        """Envía un correo y devuelve (estado siguiente, fila para el UPDATE que lo registra)."""
+        try:
+            self._limitador.esperar()
+            self._enviar(correo["destinatario"], correo["asunto"], correo["mensaje_html"])
+            return ENVIADO, (ENVIADO, correo["id"])
+        except Exception as e:
+            # El reclamo ya sumó este intento
+            intentos = correo["intentos"]
+            error = str(e)[:1000]
+            if intentos >= self._max_intentos:
+                logger.error(f"❌ Correo {correo['id']} a {correo['destinatario']} descartado tras {intentos} intentos: {e}")
+                return FALLIDO, (FALLIDO, error, correo["id"])
+            espera = min(self._espera_base * 2 ** (intentos - 1), self._espera_maxima)
+            logger.warning(f"⚠️ Correo {correo['id']} falló (intento {intentos}); se reintenta en {espera}s: {e}")
+            return PENDIENTE, (PENDIENTE, error, espera, correo["id"])
+
+    def metricas(self):
+        return {
+            "enviados": self.enviados, "reintentos": self.reintentos, "fallidos": self.fallidos,
+            "esperas_limite_tasa": self._limitador.esperas
+        }
@@ -0,0 +1,372 @@
+"""
+Base de datos local (SQLite) con el esquema de solicitudes, archivos y
+datos_extraidos, sembrada a escala, y un pool que la expone con la interfaz
+del conector de MySQL que usa la app (`cursor(dictionary=True)`, `%s`,
+`start_transaction`, `lastrowid`...).
+
+No reproduce el planificador de MySQL: sirve para comparar una versión de la
+app contra otra en la misma máquina, no para estimar tiempos absolutos de
+producción.
+"""
+import os
+import json
+import queue
+import random
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+logger = logging.getLogger(__name__)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS usuarios (
+    id INTEGER PRIMARY KEY,
+    correo TEXT NOT NULL,
+    carpeta_gcs TEXT
+);
+CREATE TABLE IF NOT EXISTS solicitudes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    usuario_id INTEGER NOT NULL,
+    fecha TIMESTAMP NOT NULL,
+    estado TEXT NOT NULL DEFAULT 'sin revisar',
+    correo TEXT,
+    motivo_rechazo TEXT,
+    actualizado TIMESTAMP NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+CREATE TABLE IF NOT EXISTS archivos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    solicitud_id INTEGER NOT NULL,
+    tipo TEXT,
+    nombre_archivo TEXT,
+    ruta_archivo TEXT
+);
+CREATE TABLE IF NOT EXISTS datos_extraidos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    solicitud_id INTEGER NOT NULL,
+    tipo_documento TEXT,
+    campo TEXT,
+    valor TEXT,
+    confianza TEXT
+);
+CREATE TABLE IF NOT EXISTS extracciones (
+    solicitud_id INTEGER NOT NULL,
+    tipo_documento TEXT NOT NULL,
+    campos TEXT NOT NULL,
+    error TEXT,
+    numero_identificacion TEXT GENERATED ALWAYS AS (substr(json_extract(campos, '$.numero_identificacion.valor'), 1, 64)) VIRTUAL,
+    nit TEXT GENERATED ALWAYS AS (substr(json_extract(campos, '$.nit.valor'), 1, 64)) VIRTUAL,
+    PRIMARY KEY (solicitud_id, tipo_documento)
+);
+CREATE TABLE IF NOT EXISTS correos_salida (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    solicitud_id INTEGER,
+    destinatario TEXT NOT NULL,
+    asunto TEXT NOT NULL,
+    mensaje_html TEXT NOT NULL,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    reclamado_por TEXT,
+    ultimo_error TEXT,
+    creado TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    enviado_en TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS eventos_admin (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tipo TEXT NOT NULL,
+    datos TEXT NOT NULL,
+    creado TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS subidas_registradas (
+    clave TEXT PRIMARY KEY,
+    solicitud_id INTEGER,
+    resultado TEXT,
+    creado TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS bench_meta (clave TEXT PRIMARY KEY, valor TEXT);
+
+-- Mismos índices que migraciones/ y los de las claves foráneas
+CREATE INDEX IF NOT EXISTS idx_solicitudes_fecha_id ON solicitudes (fecha, id);
+CREATE INDEX IF NOT EXISTS idx_subidas_registradas_creado ON subidas_registradas (creado);
+CREATE INDEX IF NOT EXISTS idx_solicitudes_estado_fecha_id ON solicitudes (estado, fecha, id);
+CREATE INDEX IF NOT EXISTS idx_solicitudes_correo_fecha_id ON solicitudes (correo, fecha, id);
+CREATE INDEX IF NOT EXISTS idx_solicitudes_actualizado ON solicitudes (actualizado);
+CREATE INDEX IF NOT EXISTS idx_archivos_solicitud ON archivos (solicitud_id);
+CREATE INDEX IF NOT EXISTS idx_archivos_tipo_id ON archivos (tipo, id);
+CREATE INDEX IF NOT EXISTS idx_datos_extraidos_solicitud ON datos_extraidos (solicitud_id);
+CREATE INDEX IF NOT EXISTS idx_extracciones_numero_identificacion ON extracciones (numero_identificacion);
+CREATE INDEX IF NOT EXISTS idx_extracciones_nit ON extracciones (nit);
+
+-- Equivalente a ON UPDATE CURRENT_TIMESTAMP(6) de la migración 003
+CREATE TRIGGER IF NOT EXISTS solicitudes_actualizado AFTER UPDATE OF estado, motivo_rechazo ON solicitudes
+BEGIN
+    UPDATE solicitudes SET actualizado = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+END;
+"""
+
+ESTADOS = ("sin revisar", "aprobado", "rechazado")
+DOCUMENTOS = (("doc_identidad", "cedulas"), ("rut", "RUT"), ("camara_comercio", "camara_comercio"))
+
+sqlite3.register_adapter(datetime, lambda fecha: fecha.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda valor: datetime.fromisoformat(valor.decode()))
+
+
+def _conectar(ruta):
+    conn = sqlite3.connect(
+        ruta, detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None, check_same_thread=False
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=10000")
+    return conn
+
+
+def _lotes(filas, tamano=20000):
+    lote = []
+    for fila in filas:
+        lote.append(fila)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def sembrar(ruta, solicitudes=100_000, usuarios=5_000, campos=4, semilla=42, formato="eav"):
+    """
+    Crea la base en `ruta` con `solicitudes` solicitudes, 3 archivos y
+    3 × `campos` datos extraídos por solicitud, en filas de datos_extraidos
+    (formato "eav") o un JSON por documento en extracciones ("json"). Si ya
+    existe una base sembrada con los mismos parámetros se reutiliza.
+    """
+    parametros = f"{solicitudes}|{usuarios}|{campos}|{semilla}"
+    if formato != "eav":
+        parametros += f"|{formato}"
+    if os.path.exists(ruta):
+        conn = _conectar(ruta)
+        try:
+            fila = conn.execute("SELECT valor FROM bench_meta WHERE clave = 'parametros'").fetchone()
+        except sqlite3.Error:
+            fila = None
+        if fila and fila[0] == parametros:
+            # Crea las tablas agregadas después de sembrar la base
+            conn.executescript(ESQUEMA)
+            conn.close()
+            logger.info(f"🗄️ Reutilizando base sembrada en {ruta}")
+            return ruta
+        conn.close()
+        os.remove(ruta)
+
+    aleatorio = random.Random(semilla)
+    conn = _conectar(ruta)
+    conn.executescript(ESQUEMA)
+    conn.execute("BEGIN")
+
+    conn.executemany(
+        "INSERT INTO usuarios (id, correo) VALUES (?, ?)",
+        ((i, f"usuario{i}@ejemplo.com") for i in range(1, usuarios + 1))
+    )
+
+    inicio = datetime(2023, 1, 1)
+    segundos = 2 * 365 * 24 * 3600
+
+    def filas_solicitudes():
+        for _ in range(solicitudes):
+            usuario = aleatorio.randint(1, usuarios)
+            fecha = inicio + timedelta(seconds=aleatorio.randrange(segundos))
+            estado = aleatorio.choice(ESTADOS)
+            motivo = "Documento ilegible" if estado == "rechazado" else None
+            yield (usuario, fecha, estado, f"usuario{usuario}@ejemplo.com", motivo)
+
+    for lote in _lotes(filas_solicitudes()):
+        conn.executemany(
+            "INSERT INTO solicitudes (usuario_id, fecha, estado, correo, motivo_rechazo) VALUES (?, ?, ?, ?, ?)", lote
+        )
+
+    def filas_archivos():
+        for solicitud_id in range(1, solicitudes + 1):
+            for tipo, _ in DOCUMENTOS:
+                nombre = f"{tipo}_{solicitud_id}.pdf"
+                yield (solicitud_id, tipo, nombre, f"https://storage.googleapis.com/bench/{solicitud_id}/{nombre}")
+
+    for lote in _lotes(filas_archivos()):
+        conn.executemany(
+            "INSERT INTO archivos (solicitud_id, tipo, nombre_archivo, ruta_archivo) VALUES (?, ?, ?, ?)", lote
+        )
+
+    def filas_datos():
+        for solicitud_id in range(1, solicitudes + 1):
+            for _, tipo_documento in DOCUMENTOS:
+                for i in range(campos):
+                    yield (solicitud_id, tipo_documento, f"campo_{i}", f"valor {i}", "93.5%")
+
+    def filas_documentos():
+        contenido = json.dumps({f"campo_{i}": {"valor": f"valor {i}", "confianza": 93.5} for i in range(campos)})
+        for solicitud_id in range(1, solicitudes + 1):
+            for _, tipo_documento in DOCUMENTOS:
+                yield (solicitud_id, tipo_documento, contenido)
+
+    if formato == "json":
+        for lote in _lotes(filas_documentos()):
+            conn.executemany("INSERT INTO extracciones (solicitud_id, tipo_documento, campos) VALUES (?, ?, ?)", lote)
+    else:
+        for lote in _lotes(filas_datos()):
+            conn.executemany(
+                "INSERT INTO datos_extraidos (solicitud_id, tipo_documento, campo, valor, confianza) VALUES (?, ?, ?, ?, ?)",
+                lote
+            )
+
+    conn.execute("INSERT OR REPLACE INTO bench_meta VALUES ('parametros', ?)", (parametros,))
+    conn.execute("COMMIT")
+    conn.execute("ANALYZE")
+    conn.close()
+    logger.info(f"🗄️ Base sembrada en {ruta}: {solicitudes} solicitudes")
+    return ruta
+
+
+def _fecha(valor):
+    # MySQL devuelve DATETIME también para agregados como MAX(actualizado);
+    # SQLite pierde el tipo declarado en esos casos y entrega el texto.
+    if isinstance(valor, str) and len(valor) >= 19 and valor[4] == "-" and valor[10] == " ":
+        try:
+            return datetime.fromisoformat(valor)
+        except ValueError:
+            pass
+    return valor
+
+
+def _traducir(sql):
+    return (sql.replace("%s", "?").replace("NOW()", "CURRENT_TIMESTAMP")
+            .replace("CURRENT_TIMESTAMP(6)", "strftime('%Y-%m-%d %H:%M:%f', 'now')"))
+
+
+class CursorLocal:
+    def __init__(self, conn, dictionary=False):
+        self._cursor = conn.cursor()
+        self._dictionary = dictionary
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, sql, parametros=()):
+        try:
+            self._cursor.execute(_traducir(sql), tuple(parametros or ()))
+        except sqlite3.IntegrityError as e:
+            raise mysql.connector.IntegrityError(msg=str(e)) from e
+        except sqlite3.Error as e:
+            raise mysql.connector.DatabaseError(msg=str(e)) from e
+
+    def executemany(self, sql, filas):
+        try:
+            self._cursor.executemany(_traducir(sql), [tuple(f) for f in filas])
+        except sqlite3.IntegrityError as e:
+            raise mysql.connector.IntegrityError(msg=str(e)) from e
+        except sqlite3.Error as e:
+            raise mysql.connector.DatabaseError(msg=str(e)) from e
+
+    def _fila(self, fila):
+        if fila is None:
+            return None
+        fila = tuple(_fecha(valor) for valor in fila)
+        if not self._dictionary:
+            return fila
+        return {columna[0]: valor for columna, valor in zip(self._cursor.description, fila)}
+
+    def fetchone(self):
+        return self._fila(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._fila(f) for f in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+
+class ConexionLocal:
+    """Conexión SQLite con la parte de la interfaz de mysql.connector que usa la app."""
+
+    def __init__(self, conn, devolver):
+        self._conn = conn
+        self._devolver = devolver
+
+    def cursor(self, dictionary=False, **_):
+        return CursorLocal(self._conn, dictionary)
+
+    def start_transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        if self._conn.in_transaction:
+            self._conn.execute("COMMIT")
+
+    def rollback(self):
+        if self._conn.in_transaction:
+            self._conn.execute("ROLLBACK")
+
+    def is_connected(self):
+        return True
+
+    def ping(self, reconnect=False, **_):
+        return None
+
+    def close(self):
+        if self._devolver is not None:
+            self.rollback()
+            devolver, self._devolver = self._devolver, None
+            devolver(self._conn)
+
+
+class PoolLocal:
+    """
+    Reemplazo de `db.pool_db`: `tamano` conexiones a la base local y la misma
+    espera acotada que el pool real (PoolError al vencer `timeout`).
+    """
+
+    def __init__(self, ruta, tamano=5, timeout=10):
+        self._timeout = timeout
+        self._libres = queue.LifoQueue()
+        for _ in range(tamano):
+            self._libres.put(_conectar(ruta))
+        self._tamano = tamano
+        self._lock = threading.Lock()
+        self.entregas = 0
+        self.timeouts = 0
+
+    def obtener(self):
+        try:
+            conn = self._libres.get(timeout=self._timeout)
+        except queue.Empty:
+            with self._lock:
+                self.timeouts += 1
+            raise mysql.connector.errors.PoolError("Sin conexiones libres en la base local")
+        with self._lock:
+            self.entregas += 1
+        return ConexionLocal(conn, self._libres.put)
+
+    def metricas(self):
+        return {
+            "tamano": self._tamano,
+            "en_uso": self._tamano - self._libres.qsize(),
+            "entregas": self.entregas,
+            "timeouts": self.timeouts,
+        }
+
+
+def instalar(ruta, tamano=5, timeout=10):
+    """Hace que `db.get_db_connection()` y `db.conexion_db()` usen la base local."""
+    import db
+    pool = PoolLocal(ruta, tamano, timeout)
+    db.pool_db = pool
+    return pool
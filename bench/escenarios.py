@@ -0,0 +1,402 @@
+"""
+Escenarios de carga para /subir, /admin y /detalle sin red ni servicios reales.
+
+Levanta la app con waitress (WSGI) y/o uvicorn (modo ASGI de asgi.py) en
+127.0.0.1, reemplaza Document AI, GCS, Secret
+Manager y Gmail por los dobles de `servicios_falsos`, y MySQL por la base local
+de `bd_local`. Cada escenario lanza `--peticiones` peticiones con
+`--concurrencia` clientes y reporta p50/p95/p99 y peticiones por segundo.
+
+Uso (desde la raíz del repositorio):
+
+    python -m bench.escenarios --escenario todos --guardar bench/base.json
+    python -m bench.escenarios --escenario todos --comparar bench/base.json
+    python -m bench.escenarios --escenario subir --servidor ambos --concurrencia 200
+
+La base sembrada se guarda en --directorio y se reutiliza entre corridas con
+los mismos parámetros de siembra.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import socket
+import argparse
+import threading
+import http.client
+from collections import Counter
+
+from bench import bd_local, servicios_falsos
+
+logger = logging.getLogger("bench")
+
+TOKEN = "token-bench"
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentil(valores_ordenados, p):
+    if not valores_ordenados:
+        return 0.0
+    indice = max(0, min(len(valores_ordenados) - 1, round(p / 100 * len(valores_ordenados) + 0.5) - 1))
+    return valores_ordenados[indice]
+
+
+def _multipart(campos, archivos):
+    limite = uuid.uuid4().hex
+    partes = []
+    for nombre, valor in campos.items():
+        partes.append(
+            f'--{limite}\r\nContent-Disposition: form-data; name="{nombre}"\r\n\r\n{valor}\r\n'.encode()
+        )
+    for nombre, (nombre_archivo, contenido, mime_type) in archivos.items():
+        partes.append(
+            f'--{limite}\r\nContent-Disposition: form-data; name="{nombre}"; filename="{nombre_archivo}"\r\n'
+            f'Content-Type: {mime_type}\r\n\r\n'.encode() + contenido + b"\r\n"
+        )
+    partes.append(f"--{limite}--\r\n".encode())
+    return b"".join(partes), f"multipart/form-data; boundary={limite}"
+
+
+def _pdf(tamano_kb, paginas=3):
+    """PDF válido de `paginas` páginas en blanco, rellenado hasta ~`tamano_kb` KB con un stream aleatorio."""
+    relleno = os.urandom(max(0, tamano_kb * 1024 - 600)).hex()[:max(0, tamano_kb * 1024 - 600)].encode()
+    hijos = " ".join(f"{4 + i} 0 R" for i in range(paginas))
+    objetos = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{hijos}] /Count {paginas} >>".encode(),
+        b"<< /Length " + str(len(relleno)).encode() + b" >>\nstream\n" + relleno + b"\nendstream",
+    ] + [b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>" for _ in range(paginas)]
+
+    salida = bytearray(b"%PDF-1.4\n")
+    posiciones = []
+    for numero, objeto in enumerate(objetos, start=1):
+        posiciones.append(len(salida))
+        salida += f"{numero} 0 obj\n".encode() + objeto + b"\nendobj\n"
+    inicio_xref = len(salida)
+    salida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode()
+    for posicion in posiciones:
+        salida += f"{posicion:010d} 00000 n \n".encode()
+    salida += f"trailer\n<< /Size {len(objetos) + 1} /Root 1 0 R >>\nstartxref\n{inicio_xref}\n%%EOF\n".encode()
+    return bytes(salida)
+
+
+class Escenarios:
+    """Generadores de peticiones: cada uno devuelve (método, ruta, cuerpo, cabeceras)."""
+
+    def __init__(self, total_solicitudes, usuarios, tamano_kb):
+        self.total_solicitudes = total_solicitudes
+        self.usuarios = usuarios
+        self.tamano_kb = tamano_kb
+        # Los fija main(): servidor bajo prueba y Storage falso (para subir_directo)
+        self.servidor = None
+        self.almacenamiento = None
+
+    def admin(self, aleatorio):
+        filtro = aleatorio.choice(["", "&estado=aprobado", "&estado=sin revisar",
+                                   f"&correo=usuario{aleatorio.randint(1, self.usuarios)}@ejemplo.com"])
+        return "GET", f"/admin?token={TOKEN}{filtro}".replace(" ", "%20"), None, {}
+
+    def admin_json(self, aleatorio):
+        metodo, ruta, cuerpo, cabeceras = self.admin(aleatorio)
+        return metodo, ruta.replace("/admin?", "/admin/solicitudes?"), cuerpo, cabeceras
+
+    def detalle(self, aleatorio):
+        id_solicitud = aleatorio.randint(1, self.total_solicitudes)
+        return "GET", f"/detalle/{id_solicitud}", None, {"Authorization": f"Bearer {TOKEN}"}
+
+    def subir_directo(self, aleatorio):
+        """
+        Subida directa a GCS: pide las URLs firmadas, simula los PUT en el
+        Storage falso y devuelve la petición a /subir/finalizar, que es la que se mide.
+        """
+        usuario = aleatorio.randint(1, self.usuarios)
+        archivos = {campo: _pdf(self.tamano_kb) for campo in ("docIdentidad", "rut", "camara")}
+        conn = http.client.HTTPConnection(*self.servidor, timeout=300)
+        conn.request("POST", "/subir/firmar", body=json.dumps({
+            "usuario_id": usuario,
+            "correo": f"usuario{usuario}@ejemplo.com",
+            "archivos": {
+                campo: {"nombre": f"{campo}.pdf", "tipo_mime": "application/pdf", "tamano": len(contenido)}
+                for campo, contenido in archivos.items()
+            },
+        }), headers={"Authorization": f"Bearer {TOKEN}", "Content-Type": "application/json"})
+        firmadas = json.loads(conn.getresponse().read())
+        conn.close()
+        for campo, subida in firmadas["subidas"].items():
+            self.almacenamiento.simular_put(
+                os.environ["GCS_BUCKET_NAME"], subida["objeto"], archivos[campo], subida["cabeceras"]["Content-Type"]
+            )
+        return "POST", "/subir/finalizar", json.dumps({"ticket": firmadas["ticket"]}), {
+            "Authorization": f"Bearer {TOKEN}", "Content-Type": "application/json"
+        }
+
+    def subir(self, aleatorio):
+        usuario = aleatorio.randint(1, self.usuarios)
+        cuerpo, tipo = _multipart(
+            {"usuario_id": usuario, "correo": f"usuario{usuario}@ejemplo.com"},
+            {
+                "docIdentidad": ("cedula.pdf", _pdf(self.tamano_kb), "application/pdf"),
+                "rut": ("rut.pdf", _pdf(self.tamano_kb), "application/pdf"),
+                "camara": ("camara.pdf", _pdf(self.tamano_kb), "application/pdf"),
+            }
+        )
+        return "POST", "/subir", cuerpo, {"Authorization": f"Bearer {TOKEN}", "Content-Type": tipo}
+
+
+def ejecutar(host, puerto, generar, peticiones, concurrencia, calentamiento=10, semilla=7):
+    """Lanza las peticiones con `concurrencia` hilos y devuelve el resumen de latencias."""
+    def una(conn, aleatorio):
+        metodo, ruta, cuerpo, cabeceras = generar(aleatorio)
+        inicio = time.perf_counter()
+        conn.request(metodo, ruta, body=cuerpo, headers=cabeceras)
+        respuesta = conn.getresponse()
+        respuesta.read()
+        return time.perf_counter() - inicio, respuesta.status
+
+    conn = http.client.HTTPConnection(host, puerto, timeout=300)
+    aleatorio = random.Random(semilla)
+    for _ in range(calentamiento):
+        una(conn, aleatorio)
+    conn.close()
+
+    latencias, codigos = [], Counter()
+    lock = threading.Lock()
+    restantes = [peticiones]
+
+    def cliente(indice):
+        aleatorio = random.Random(semilla + indice + 1)
+        conn = http.client.HTTPConnection(host, puerto, timeout=300)
+        while True:
+            with lock:
+                if restantes[0] <= 0:
+                    break
+                restantes[0] -= 1
+            try:
+                duracion, codigo = una(conn, aleatorio)
+            except (OSError, http.client.HTTPException) as e:
+                duracion, codigo = 0.0, type(e).__name__
+                conn.close()
+                conn = http.client.HTTPConnection(host, puerto, timeout=300)
+            with lock:
+                latencias.append(duracion)
+                codigos[str(codigo)] += 1
+        conn.close()
+
+    inicio = time.perf_counter()
+    hilos = [threading.Thread(target=cliente, args=(i,)) for i in range(concurrencia)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    total = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        "peticiones": peticiones,
+        "concurrencia": concurrencia,
+        "duracion_s": round(total, 3),
+        "rps": round(peticiones / total, 1) if total else 0.0,
+        "p50_ms": round(percentil(latencias, 50) * 1000, 1),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 1),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 1),
+        "max_ms": round(latencias[-1] * 1000, 1) if latencias else 0.0,
+        "codigos": dict(codigos),
+    }
+
+
+def cuenta_servicio_local(directorio):
+    ruta = os.path.join(directorio, "cuenta_servicio.json")
+    if not os.path.exists(ruta):
+        import rsa
+        _, privada = rsa.newkeys(2048)
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump({
+                "type": "service_account",
+                "project_id": "bench",
+                "private_key_id": "bench",
+                "private_key": privada.save_pkcs1().decode(),
+                "client_email": "bench@bench.iam.gserviceaccount.com",
+                "client_id": "0",
+                "token_uri": "https://oauth2.googleapis.com/token",
+            }, f)
+    return ruta
+
+
+def preparar_app(args):
+    """Configura el entorno, importa app.py e inyecta la base local y los dobles."""
+    os.makedirs(args.directorio, exist_ok=True)
+    os.environ.setdefault("GCP_PROJECT_ID", "bench")
+    os.environ.setdefault("GCS_BUCKET_NAME", "bench")
+    os.environ.setdefault("PRECALENTAR_CLIENTES", "0")
+    os.environ.setdefault("REMITENTE_CORREOS_ACTIVO", "0")
+    os.environ.setdefault("COLA_TRABAJOS_BACKEND", "memoria")
+    os.environ.setdefault("CACHE_EXTRACCION_SQLITE", os.path.join(args.directorio, "extracciones.sqlite3"))
+    if args.sin_cache_extraccion:
+        os.environ["CACHE_EXTRACCION_DESACTIVADA"] = "1"
+    formato_datos = getattr(args, "formato_datos", "eav")
+    os.environ["DATOS_EXTRAIDOS_FORMATO"] = formato_datos
+
+    # Los tickets de subida directa no se firman con la llave por defecto de Flask
+    os.environ.setdefault("FLASK_SECRET_KEY", "bench-secreto-local")
+    if not os.getenv("GCS_CREDENTIALS_PATH"):
+        # Llave desechable: las URLs firmadas de /subir/firmar se generan sin red
+        os.environ["GCS_CREDENTIALS_PATH"] = cuenta_servicio_local(args.directorio)
+
+    ruta_bd = bd_local.sembrar(
+        os.path.join(args.directorio, "bench.sqlite3" if formato_datos == "eav" else f"bench-{formato_datos}.sqlite3"),
+        solicitudes=args.solicitudes, usuarios=args.usuarios, campos=args.campos, formato=formato_datos
+    )
+
+    # Las cargas temporales (uploads/) quedan en el directorio del benchmark
+    sys.path.insert(0, RAIZ)
+    os.chdir(args.directorio)
+    import app as app_modulo
+    import metricas
+    registro_async = None
+    if args.servidor != "wsgi":
+        from clientes import registro_clientes_async as registro_async
+    logging.getLogger().setLevel(logging.INFO if args.verboso else logging.WARNING)
+
+    pool = bd_local.instalar(ruta_bd, tamano=args.pool_db)
+    metricas.registrar_colector("pool_db", pool.metricas)
+    falsos = servicios_falsos.instalar(
+        app_modulo, TOKEN,
+        latencia_documentai=servicios_falsos.Latencia(args.latencia_documentai, args.latencia_documentai / 4),
+        latencia_gcs=servicios_falsos.Latencia(args.latencia_gcs, args.latencia_gcs / 4),
+        latencia_secretos=servicios_falsos.Latencia(args.latencia_secretos),
+        latencia_gmail=servicios_falsos.Latencia(args.latencia_gmail),
+        entidades=args.entidades,
+        registro_async=registro_async,
+    )
+    return app_modulo, falsos, pool
+
+
+def iniciar_servidor(app, hilos):
+    from waitress import create_server
+    # Con mucha concurrencia waitress avisa de su cola en cada petición
+    logging.getLogger("waitress.queue").setLevel(logging.ERROR)
+    servidor = create_server(app, host="127.0.0.1", port=0, threads=hilos)
+    threading.Thread(target=servidor.run, daemon=True, name="bench-servidor").start()
+    return "127.0.0.1", servidor.effective_port
+
+
+def iniciar_servidor_asgi():
+    """Sirve `asgi.aplicacion` con uvicorn (un worker) en un hilo propio."""
+    import uvicorn
+    import asgi
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    config = uvicorn.Config(asgi.aplicacion, log_level="warning", access_log=False, timeout_keep_alive=300)
+    servidor = uvicorn.Server(config)
+    threading.Thread(target=servidor.run, kwargs={"sockets": [sock]}, daemon=True, name="bench-asgi").start()
+    while not servidor.started:
+        time.sleep(0.05)
+    return "127.0.0.1", sock.getsockname()[1]
+
+
+def comparar(actual, base, titulo="Comparación con la base"):
+    print(f"\n{titulo}:")
+    for escenario, datos in actual.items():
+        anterior = base.get(escenario)
+        if not anterior:
+            print(f"  {escenario}: sin datos en la base")
+            continue
+        partes = []
+        for clave in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            if anterior.get(clave):
+                cambio = (datos[clave] - anterior[clave]) / anterior[clave] * 100
+                partes.append(f"{clave} {anterior[clave]} → {datos[clave]} ({cambio:+.1f}%)")
+        print(f"  {escenario}: " + ", ".join(partes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--escenario", choices=["admin", "admin_json", "detalle", "subir", "subir_directo", "todos"], default="todos")
+    parser.add_argument("--peticiones", type=int, default=500)
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--servidor", choices=["wsgi", "asgi", "ambos"], default="wsgi",
+                        help="waitress (WSGI), uvicorn con asgi.py, o ambos para compararlos")
+    parser.add_argument("--hilos-servidor", type=int, default=8)
+    parser.add_argument("--pool-db", type=int, default=5)
+    parser.add_argument("--solicitudes", type=int, default=100_000)
+    parser.add_argument("--usuarios", type=int, default=5_000)
+    parser.add_argument("--campos", type=int, default=4, help="datos extraídos por documento en la siembra")
+    parser.add_argument("--formato-datos", choices=["eav", "json"], default="eav",
+                        help="almacenamiento de los datos extraídos (DATOS_EXTRAIDOS_FORMATO)")
+    parser.add_argument("--entidades", type=int, default=12, help="entidades que devuelve el Document AI falso")
+    parser.add_argument("--tamano-archivo", type=int, default=200, help="KB por archivo en /subir")
+    parser.add_argument("--latencia-documentai", type=float, default=0.8)
+    parser.add_argument("--latencia-gcs", type=float, default=0.15)
+    parser.add_argument("--latencia-secretos", type=float, default=0.05)
+    parser.add_argument("--latencia-gmail", type=float, default=0.3)
+    parser.add_argument("--sin-cache-extraccion", action="store_true")
+    parser.add_argument("--directorio", default=os.path.join(RAIZ, "bench", ".datos"))
+    parser.add_argument("--guardar", help="guarda los resultados en este JSON")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--verboso", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args.directorio = os.path.abspath(args.directorio)
+    guardar = os.path.abspath(args.guardar) if args.guardar else None
+    base = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+
+    app_modulo, falsos, pool = preparar_app(args)
+    servidores = {}
+    if args.servidor in ("wsgi", "ambos"):
+        servidores["wsgi"] = iniciar_servidor(app_modulo.app, args.hilos_servidor)
+    if args.servidor in ("asgi", "ambos"):
+        servidores["asgi"] = iniciar_servidor_asgi()
+
+    escenarios = Escenarios(args.solicitudes, args.usuarios, args.tamano_archivo)
+    escenarios.almacenamiento = falsos["storage"]
+    nombres = ["admin", "admin_json", "detalle", "subir", "subir_directo"] if args.escenario == "todos" else [args.escenario]
+
+    resultados = {}
+    for modo, (host, puerto) in servidores.items():
+        escenarios.servidor = (host, puerto)
+        for nombre in nombres:
+            # /subir es mucho más lento que las lecturas: se reduce su volumen por defecto
+            lento = nombre.startswith("subir")
+            peticiones = max(args.concurrencia, args.peticiones // 10) if lento else args.peticiones
+            llamadas_antes = {k: v.llamadas for k, v in falsos.items()}
+            resultado = ejecutar(host, puerto, getattr(escenarios, nombre), peticiones, args.concurrencia)
+            resultado["llamadas_falsas"] = {k: v.llamadas - llamadas_antes[k] for k, v in falsos.items()}
+            # Con un solo servidor se conservan las claves de siempre para poder comparar con corridas viejas
+            clave = nombre if len(servidores) == 1 and modo == "wsgi" else f"{nombre}@{modo}"
+            resultados[clave] = resultado
+            logger.warning(
+                f"📊 {clave}: {resultado['rps']} req/s | p50 {resultado['p50_ms']} ms | "
+                f"p95 {resultado['p95_ms']} ms | p99 {resultado['p99_ms']} ms | códigos {resultado['codigos']}"
+            )
+
+    if len(servidores) == 2:
+        comparar(
+            {f"{nombre}@asgi": resultados[f"{nombre}@asgi"] for nombre in nombres},
+            {f"{nombre}@asgi": resultados[f"{nombre}@wsgi"] for nombre in nombres},
+            titulo="Comparación ASGI frente a WSGI (base)",
+        )
+
+    resultados["_entorno"] = {
+        "python": sys.version.split()[0],
+        "solicitudes": args.solicitudes,
+        "concurrencia": args.concurrencia,
+        "servidor": args.servidor,
+        "pool_db": pool.metricas(),
+    }
+    if guardar:
+        with open(guardar, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False, default=str)
+    if base:
+        comparar({k: v for k, v in resultados.items() if not k.startswith("_")}, base)
+
+
+if __name__ == "__main__":
+    main()
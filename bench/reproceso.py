@@ -0,0 +1,71 @@
+"""
+Reproceso masivo (reprocesar.py) contra la base local y un Document AI falso.
+
+Mide documentos por segundo y filas reemplazadas por segundo, y comprueba que
+una ejecución cortada con --maximo se reanuda desde el checkpoint.
+
+    python -m bench.reproceso --solicitudes 100000 --lote 500
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+from bench import bd_local, servicios_falsos
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--solicitudes", type=int, default=100_000)
+    parser.add_argument("--usuarios", type=int, default=5_000)
+    parser.add_argument("--campos", type=int, default=4)
+    parser.add_argument("--tipos", nargs="+", default=["camara_comercio"])
+    parser.add_argument("--lote", type=int, default=500)
+    parser.add_argument("--latencia-lote", type=float, default=0.0, help="segundos por llamada a batch_process_documents")
+    parser.add_argument("--entidades", type=int, default=12)
+    parser.add_argument("--tasa-error", type=float, default=0.01)
+    parser.add_argument("--corte", type=int, default=0, help="interrumpe la primera ejecución tras N documentos")
+    parser.add_argument("--directorio", default=os.path.join(RAIZ, "bench", ".datos"))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    os.makedirs(args.directorio, exist_ok=True)
+    for variable in ("PROCESSOR_CEDULAS", "PROCESSOR_RUT", "PROCESSOR_CAMARA"):
+        os.environ.setdefault(variable, "procesador-bench")
+    os.environ.setdefault("GCS_BUCKET_NAME", "bench")
+
+    # El reproceso modifica datos_extraidos: se trabaja sobre una base propia
+    ruta_bd = bd_local.sembrar(
+        os.path.join(args.directorio, "reproceso.sqlite3"),
+        solicitudes=args.solicitudes, usuarios=args.usuarios, campos=args.campos
+    )
+    sys.path.insert(0, RAIZ)
+    import reprocesar
+
+    bd_local.instalar(ruta_bd, tamano=2)
+    falso = servicios_falsos.DocumentAILotesFalso(
+        servicios_falsos.Latencia(args.latencia_lote), entidades=args.entidades, tasa_error=args.tasa_error
+    )
+    checkpoint = os.path.join(args.directorio, "reproceso-checkpoint.json")
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    inicio = time.perf_counter()
+    if args.corte:
+        reprocesar.reprocesar(falso, tipos=args.tipos, lote=args.lote, ruta_checkpoint=checkpoint, maximo=args.corte)
+        print(f"Ejecución cortada tras {falso.documentos} documentos; reanudando desde el checkpoint")
+    resumen = reprocesar.reprocesar(falso, tipos=args.tipos, lote=args.lote, ruta_checkpoint=checkpoint)
+    duracion = time.perf_counter() - inicio
+
+    documentos = sum(t["documentos"] + t["errores"] for t in resumen.values())
+    print(f"Documentos: {documentos} en {duracion:.1f}s ({documentos / duracion:.0f} doc/s), "
+          f"lotes: {falso.llamadas}, enviados al doble: {falso.documentos}")
+    for tipo, avance in resumen.items():
+        print(f"  {tipo}: {avance}")
+
+
+if __name__ == "__main__":
+    main()
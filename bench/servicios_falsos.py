@@ -0,0 +1,302 @@
+"""
+Dobles locales de Document AI, Cloud Storage, Secret Manager y Gmail.
+
+Imitan solo la parte de cada cliente que usa app.py y simulan su latencia con
+`time.sleep`, así que no abren conexiones de red. Se inyectan con
+`instalar(app_modulo, ...)`, que los registra en `registro_clientes` y
+reemplaza el envío de Gmail; con `registro_async` también registra sus
+versiones asíncronas (esperan con `asyncio.sleep`) para el modo ASGI.
+`DocumentAILotesFalso` reemplaza la capa de lotes de reprocesar.py.
+"""
+import json
+import base64
+import random
+import asyncio
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+
+class Latencia:
+    """Latencia simulada: `media` segundos ± `variacion` (uniforme)."""
+
+    def __init__(self, media=0.0, variacion=0.0):
+        self.media = media
+        self.variacion = variacion
+
+    def esperar(self):
+        if self.media <= 0:
+            return
+        time.sleep(self._duracion())
+
+    async def esperar_async(self):
+        if self.media > 0:
+            await asyncio.sleep(self._duracion())
+
+    def _duracion(self):
+        return max(0.0, self.media + random.uniform(-self.variacion, self.variacion))
+
+
+class _Contador:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.llamadas = 0
+
+    def sumar(self):
+        with self._lock:
+            self.llamadas += 1
+
+
+class DocumentAIFalso(_Contador):
+    def __init__(self, latencia=None, entidades=12):
+        super().__init__()
+        self.latencia = latencia or Latencia()
+        self.entidades = entidades
+
+    def process_document(self, request):
+        self.sumar()
+        self.latencia.esperar()
+        return self._respuesta(request)
+
+    def _respuesta(self, request):
+        if "gcs_document" in request:
+            contenido = request["gcs_document"]["gcs_uri"]
+        else:
+            contenido = request["raw_document"]["content"]
+        entidades = [
+            SimpleNamespace(
+                type_=f"campo {i}",
+                mention_text=f"valor {i} ({len(contenido)} bytes)",
+                confidence=0.9,
+                # La primera entidad trae propiedades anidadas, como una dirección
+                properties=[
+                    SimpleNamespace(type_=f"parte {j}", mention_text=f"parte {j}", confidence=0.8, properties=[])
+                    for j in range(2 if i == 0 else 0)
+                ],
+            )
+            for i in range(self.entidades)
+        ]
+        return SimpleNamespace(document=SimpleNamespace(entities=entidades))
+
+
+class DocumentAIAsyncFalso:
+    """Doble de `DocumentProcessorServiceAsyncClient`; comparte contador y latencia con el síncrono."""
+
+    def __init__(self, sincrono):
+        self.sincrono = sincrono
+
+    async def process_document(self, request):
+        self.sincrono.sumar()
+        await self.sincrono.latencia.esperar_async()
+        return self.sincrono._respuesta(request)
+
+
+class _BlobFalso:
+    """Blob con solo metadatos: el contenido se lee (para medir E/S) pero no se guarda."""
+
+    def __init__(self, almacenamiento, nombre_bucket, ruta):
+        self._almacenamiento = almacenamiento
+        self.bucket_nombre = nombre_bucket
+        self.name = ruta
+        self.public_url = f"https://storage.googleapis.com/{nombre_bucket}/{ruta}"
+        self.size = None
+        self.content_type = None
+        self.md5_hash = None
+        self.crc32c = None
+        self.time_created = None
+
+    def _registrar(self, tamano, content_type, md5_hash=None, crc32c=None):
+        self.size = tamano
+        self.content_type = content_type
+        self.md5_hash = md5_hash
+        self.crc32c = crc32c
+        self.time_created = datetime.now(timezone.utc)
+        with self._almacenamiento._lock:
+            self._almacenamiento.objetos[(self.bucket_nombre, self.name)] = self
+
+    def upload_from_file(self, archivo, size=None, content_type=None, **_):
+        self._almacenamiento.sumar()
+        # Se lee todo el archivo para que el costo de E/S del lado de la app sea real
+        while archivo.read(1024 * 1024):
+            pass
+        self._almacenamiento.latencia.esperar()
+
+    def upload_from_string(self, datos, content_type=None, **_):
+        self._almacenamiento.sumar()
+        self._almacenamiento.latencia.esperar()
+        self._registrar(len(datos), content_type, crc32c=self.crc32c)
+
+    def compose(self, fuentes, **_):
+        self._almacenamiento.sumar()
+        self._almacenamiento.latencia.esperar()
+        huella = hashlib.md5("".join(f.crc32c or "" for f in fuentes).encode()).hexdigest()[:8]
+        self._registrar(sum(f.size for f in fuentes), self.content_type, crc32c=huella)
+
+    def delete(self, **_):
+        with self._almacenamiento._lock:
+            self._almacenamiento.objetos.pop((self.bucket_nombre, self.name), None)
+
+
+class StorageFalso(_Contador):
+    """
+    Doble de `storage.Client` con los objetos en memoria (solo metadatos).
+    `simular_put` registra un objeto como si el cliente lo hubiera subido con
+    una URL firmada; `get_blob`, `list_blobs`, `compose` y `delete` cubren la
+    verificación de /subir/finalizar y la subida por fragmentos.
+    """
+
+    def __init__(self, latencia=None):
+        super().__init__()
+        self.latencia = latencia or Latencia()
+        self.objetos = {}
+
+    def bucket(self, nombre):
+        return SimpleNamespace(
+            blob=lambda ruta: _BlobFalso(self, nombre, ruta),
+            get_blob=lambda ruta: self._metadatos(nombre, ruta),
+            list_blobs=lambda prefix="": self._listar(nombre, prefix),
+        )
+
+    def simular_put(self, bucket, ruta, contenido, content_type):
+        md5 = base64.b64encode(hashlib.md5(contenido).digest()).decode()
+        _BlobFalso(self, bucket, ruta)._registrar(len(contenido), content_type, md5_hash=md5)
+
+    def _metadatos(self, bucket, ruta):
+        self.sumar()
+        self.latencia.esperar()
+        return self.objetos.get((bucket, ruta))
+
+    def _listar(self, bucket, prefijo):
+        self.sumar()
+        self.latencia.esperar()
+        with self._lock:
+            return sorted(
+                (blob for (b, ruta), blob in self.objetos.items() if b == bucket and ruta.startswith(prefijo)),
+                key=lambda blob: blob.name,
+            )
+
+
+class StorageAsyncFalso:
+    """Doble de `clientes.ClienteGCSAsync`."""
+
+    def __init__(self, sincrono):
+        self.sincrono = sincrono
+
+    async def subir(self, documento, bucket, ruta):
+        self.sincrono.sumar()
+        with documento.abrir() as contenido:
+            while contenido.read(1024 * 1024):
+                pass
+        await self.sincrono.latencia.esperar_async()
+        return f"https://storage.googleapis.com/{bucket}/{ruta}"
+
+
+class SecretManagerFalso(_Contador):
+    def __init__(self, token, latencia=None):
+        super().__init__()
+        self.token = token
+        self.latencia = latencia or Latencia()
+
+    def access_secret_version(self, request):
+        self.sumar()
+        self.latencia.esperar()
+        return self._respuesta()
+
+    def _respuesta(self):
+        datos = json.dumps({"token": self.token}).encode("utf-8")
+        return SimpleNamespace(payload=SimpleNamespace(data=datos))
+
+
+class SecretManagerAsyncFalso:
+    def __init__(self, sincrono):
+        self.sincrono = sincrono
+
+    async def access_secret_version(self, request):
+        self.sincrono.sumar()
+        await self.sincrono.latencia.esperar_async()
+        return self.sincrono._respuesta()
+
+
+class GmailFalso(_Contador):
+    """Reemplaza `GestorGmail.enviar`: recibe el cuerpo ya codificado."""
+
+    def __init__(self, latencia=None):
+        super().__init__()
+        self.latencia = latencia or Latencia()
+
+    def enviar(self, cuerpo):
+        self.sumar()
+        self.latencia.esperar()
+        return {"id": f"falso-{self.llamadas}"}
+
+
+class DocumentAILotesFalso(_Contador):
+    """
+    Doble de la capa de reprocesar.py (`procesar_lote` y `leer_salida`).
+    Cada documento devuelve `entidades` entidades repartidas en `fragmentos`
+    JSON; `tasa_error` es la fracción de documentos que el lote marca fallidos.
+    """
+
+    def __init__(self, latencia_lote=None, entidades=12, fragmentos=2, tasa_error=0.0, semilla=3):
+        super().__init__()
+        self.latencia = latencia_lote or Latencia()
+        self.entidades = entidades
+        self.fragmentos = fragmentos
+        self.tasa_error = tasa_error
+        self.documentos = 0
+        self._aleatorio = random.Random(semilla)
+
+    def procesar_lote(self, processor_id, entradas, prefijo_salida):
+        self.sumar()
+        self.latencia.esperar()
+        resultados = {}
+        for i, (uri, _) in enumerate(entradas):
+            self.documentos += 1
+            if self._aleatorio.random() < self.tasa_error:
+                resultados[uri] = (None, "Documento ilegible")
+            else:
+                resultados[uri] = (f"{prefijo_salida}{i}/", None)
+        return resultados
+
+    def leer_salida(self, uri_salida):
+        for fragmento in range(self.fragmentos):
+            documento = json.loads(json.dumps({
+                "entities": [
+                    {"type": f"campo {i}", "mentionText": f"valor {i} v2", "confidence": 0.95}
+                    for i in range(fragmento, self.entidades, self.fragmentos)
+                ]
+            }))
+            yield from documento["entities"]
+
+
+def instalar(app_modulo, token, latencia_documentai=None, latencia_gcs=None,
+             latencia_secretos=None, latencia_gmail=None, entidades=12, registro_async=None):
+    """
+    Registra los dobles en el registro de clientes de `app_modulo` (y en
+    `registro_async`, si se indica) y devuelve un dict {nombre: doble} para
+    consultar cuántas llamadas recibió cada uno.
+    """
+    falsos = {
+        "documentai": DocumentAIFalso(latencia_documentai, entidades),
+        "storage": StorageFalso(latencia_gcs),
+        "secretmanager": SecretManagerFalso(token, latencia_secretos),
+        "gmail": GmailFalso(latencia_gmail),
+    }
+    registro = app_modulo.registro_clientes
+    for nombre in ("documentai", "storage", "secretmanager"):
+        registro.registrar(nombre, lambda doble=falsos[nombre]: doble)
+        registro.invalidar(nombre)
+    if registro_async is not None:
+        asincronos = {
+            "documentai": DocumentAIAsyncFalso(falsos["documentai"]),
+            "storage": StorageAsyncFalso(falsos["storage"]),
+            "secretmanager": SecretManagerAsyncFalso(falsos["secretmanager"]),
+        }
+        for nombre, doble in asincronos.items():
+            registro_async.registrar(nombre, lambda doble=doble: doble)
+            registro_async.invalidar(nombre)
+    app_modulo.gestor_gmail.enviar = falsos["gmail"].enviar
+    app_modulo.validador_token.invalidar()
+    return falsos
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# Se incrementa cuando cambia el formato guardado (v2: propiedades anidadas)
+VERSION_FORMATO = 2
+
+
+def clave_extraccion(sha256, processor_id):
+    return f"{sha256}:{processor_id}:v{VERSION_FORMATO}"
+
+
+class CacheExtracciones:
+    """
+    Caché de resultados de Document AI indexada por SHA-256 del contenido + procesador.
+
+    Tiene dos niveles: un LRU en memoria de `capacidad` entradas y, si se indica
+    `ruta_sqlite`, una tabla SQLite local que sobrevive a reinicios y se
+    comparte entre workers. Las entradas vencen a los `ttl` segundos; la tabla
+    se poda a `max_filas` eliminando las menos usadas.
+    """
+
+    def __init__(self, capacidad=256, ttl=30 * 24 * 3600, ruta_sqlite=None, max_filas=50000):
+        self._capacidad = capacidad
+        self._ttl = ttl
+        self._ruta_sqlite = ruta_sqlite
+        self._max_filas = max_filas
+
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._escrituras = 0
+
+        self.hits_memoria = 0
+        self.hits_persistente = 0
+        self.misses = 0
+        self.omitidas = 0
+
+        if ruta_sqlite:
+            directorio = os.path.dirname(ruta_sqlite)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            self._sqlite().execute("""
+                CREATE TABLE IF NOT EXISTS extracciones (
+                    clave TEXT PRIMARY KEY,
+                    resultado TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    usado REAL NOT NULL
+                )
+            """)
+            self._sqlite().execute("CREATE INDEX IF NOT EXISTS idx_extracciones_usado ON extracciones (usado)")
+
+    def _sqlite(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self._ruta_sqlite, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def obtener(self, clave):
+        ahora = time.time()
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada and ahora - entrada[0] < self._ttl:
+                self._memoria.move_to_end(clave)
+                self.hits_memoria += 1
+                return entrada[1]
+            if entrada:
+                del self._memoria[clave]
+
+        if self._ruta_sqlite:
+            try:
+                fila = self._sqlite().execute(
+                    "SELECT resultado, creado FROM extracciones WHERE clave = ? AND creado > ?",
+                    (clave, ahora - self._ttl)
+                ).fetchone()
+                if fila:
+                    self._sqlite().execute("UPDATE extracciones SET usado = ? WHERE clave = ?", (ahora, clave))
+                    resultado = json.loads(fila[0])
+                    self._guardar_memoria(clave, resultado, fila[1])
+                    with self._lock:
+                        self.hits_persistente += 1
+                    return resultado
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Error leyendo la caché persistente de extracciones: {e}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _guardar_memoria(self, clave, resultado, creado):
+        with self._lock:
+            self._memoria[clave] = (creado, resultado)
+            self._memoria.move_to_end(clave)
+            while len(self._memoria) > self._capacidad:
+                self._memoria.popitem(last=False)
+
+    def guardar(self, clave, resultado):
+        ahora = time.time()
+        self._guardar_memoria(clave, resultado, ahora)
+
+        if not self._ruta_sqlite:
+            return
+        try:
+            conn = self._sqlite()
+            conn.execute(
+                "INSERT OR REPLACE INTO extracciones (clave, resultado, creado, usado) VALUES (?, ?, ?, ?)",
+                (clave, json.dumps(resultado), ahora, ahora)
+            )
+            with self._lock:
+                self._escrituras += 1
+                podar = self._escrituras % 100 == 0
+            if podar:
+                conn.execute("DELETE FROM extracciones WHERE creado <= ?", (ahora - self._ttl,))
+                conn.execute(
+                    "DELETE FROM extracciones WHERE clave IN ("
+                    " SELECT clave FROM extracciones ORDER BY usado DESC LIMIT -1 OFFSET ?)",
+                    (self._max_filas,)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Error escribiendo la caché persistente de extracciones: {e}")
+
+    def registrar_omision(self):
+        with self._lock:
+            self.omitidas += 1
+
+    def metricas(self):
+        with self._lock:
+            hits = self.hits_memoria + self.hits_persistente
+            consultas = hits + self.misses
+            return {
+                "hits_memoria": self.hits_memoria,
+                "hits_persistente": self.hits_persistente,
+                "misses": self.misses,
+                "omitidas": self.omitidas,
+                "hit_ratio": round(hits / consultas, 3) if consultas else 0.0,
+                "llamadas_ahorradas": hits,
+                "entradas_memoria": len(self._memoria),
+            }
+
+
+def crear_cache_extracciones():
+    if os.getenv("CACHE_EXTRACCION_DESACTIVADA", "0") == "1":
+        return None
+    return CacheExtracciones(
+        capacidad=int(os.getenv("CACHE_EXTRACCION_CAPACIDAD", "256")),
+        ttl=int(os.getenv("CACHE_EXTRACCION_TTL", str(30 * 24 * 3600))),
+        ruta_sqlite=os.getenv("CACHE_EXTRACCION_SQLITE", os.path.join("uploads", "extracciones.sqlite3")) or None,
+        max_filas=int(os.getenv("CACHE_EXTRACCION_MAX_FILAS", "50000"))
+    )
@@ -0,0 +1,180 @@
+import os
+import io
+import hashlib
+import shutil
+import logging
+import mimetypes
+import tempfile
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# Tamaño a partir del cual un archivo se guarda en disco en lugar de memoria
+UMBRAL_MEMORIA = int(os.getenv("UPLOAD_UMBRAL_MEMORIA", str(20 * 1024 * 1024)))
+
+# Tamaño máximo que acepta el procesamiento en línea de Document AI (process_document).
+# Los documentos en GCS no pasan por el optimizador, así que la subida directa y la
+# fragmentada no aceptan archivos más grandes
+TAMANO_MAXIMO_DOCUMENTAI = int(os.getenv("DOCUMENTAI_TAMANO_MAXIMO", str(20 * 1024 * 1024)))
+
+# Firmas (magic numbers) de los formatos que acepta Document AI
+FIRMAS_MIME = [
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"BM", "image/bmp"),
+]
+
+
+def detectar_mime(cabecera, nombre_archivo=None):
+    """Detecta el tipo MIME a partir de los primeros bytes del contenido."""
+    for firma, mime_type in FIRMAS_MIME:
+        if cabecera.startswith(firma):
+            return mime_type
+    if cabecera[:4] == b"RIFF" and cabecera[8:12] == b"WEBP":
+        return "image/webp"
+    if nombre_archivo:
+        mime_type, _ = mimetypes.guess_type(nombre_archivo)
+        if mime_type:
+            return mime_type
+    return "application/pdf"
+
+
+class DocumentoCargado:
+    """
+    Archivo subido leído una sola vez.
+
+    Por debajo de `UMBRAL_MEMORIA` el contenido queda en memoria y se comparte
+    tal cual con GCS y Document AI. Por encima se vuelca a un archivo temporal
+    con nombre único dentro de `carpeta`.
+    """
+
+    __slots__ = ("nombre", "mime_type", "tamano", "_contenido", "_ruta", "_sha256")
+
+    def __init__(self, nombre, mime_type, tamano, contenido=None, ruta=None):
+        self.nombre = nombre
+        self.mime_type = mime_type
+        self.tamano = tamano
+        self._contenido = contenido
+        self._ruta = ruta
+        self._sha256 = None
+
+    @classmethod
+    def desde_ruta(cls, ruta, nombre, umbral=UMBRAL_MEMORIA):
+        """Carga un archivo ya guardado en disco (p. ej. por el modo asíncrono de /subir)."""
+        tamano = os.path.getsize(ruta)
+        with open(ruta, "rb") as f:
+            if tamano <= umbral:
+                contenido = f.read()
+                os.remove(ruta)
+                return cls(nombre, detectar_mime(contenido[:16], nombre), tamano, contenido=contenido)
+            cabecera = f.read(16)
+        return cls(nombre, detectar_mime(cabecera, nombre), tamano, ruta=ruta)
+
+    @property
+    def en_memoria(self):
+        return self._contenido is not None
+
+    def leer_bytes(self):
+        if self._contenido is not None:
+            return self._contenido
+        with open(self._ruta, "rb") as f:
+            return f.read()
+
+    def sha256(self):
+        """Hash del contenido; se calcula una sola vez."""
+        if self._sha256 is None:
+            if self._contenido is not None:
+                self._sha256 = hashlib.sha256(self._contenido).hexdigest()
+            else:
+                h = hashlib.sha256()
+                with open(self._ruta, "rb") as f:
+                    for bloque in iter(lambda: f.read(1024 * 1024), b""):
+                        h.update(bloque)
+                self._sha256 = h.hexdigest()
+        return self._sha256
+
+    def huella(self):
+        """Identificador del contenido para la caché de extracciones."""
+        return self.sha256()
+
+    def abrir(self):
+        """Devuelve un objeto tipo archivo sobre el contenido, sin copiarlo."""
+        if self._contenido is not None:
+            return io.BytesIO(self._contenido)
+        return open(self._ruta, "rb")
+
+    def liberar(self):
+        self._contenido = None
+        if self._ruta and os.path.exists(self._ruta):
+            os.remove(self._ruta)
+        self._ruta = None
+
+
+class DocumentoGCS:
+    """
+    Documento que el cliente ya subió al bucket con una URL firmada. No pasa
+    por el pod: Document AI lo lee con `gcs_document` y no se optimiza; con
+    `paginas` ((inicio, fin), desde 1) solo se procesan esas páginas.
+    """
+
+    __slots__ = ("nombre", "mime_type", "tamano", "bucket", "objeto", "paginas", "_huella")
+
+    def __init__(self, nombre, mime_type, tamano, bucket, objeto, huella, paginas=None):
+        self.nombre = nombre
+        self.mime_type = mime_type
+        self.tamano = tamano
+        self.bucket = bucket
+        self.objeto = objeto
+        self.paginas = paginas
+        # Hash que GCS ya calculó (MD5, o CRC32C en objetos compuestos): no hace falta descargarlo
+        self._huella = huella
+
+    def con_paginas(self, paginas):
+        """Copia que Document AI procesa solo en el rango `paginas`."""
+        return DocumentoGCS(self.nombre, self.mime_type, self.tamano, self.bucket, self.objeto, self._huella, paginas)
+
+    @property
+    def uri(self):
+        return f"gs://{self.bucket}/{self.objeto}"
+
+    @property
+    def url_publica(self):
+        # Mismo formato que `Blob.public_url`
+        return f"https://storage.googleapis.com/{self.bucket}/{quote(self.objeto, safe='/~')}"
+
+    def huella(self):
+        # El rango de páginas cambia la extracción: forma parte de la clave de la caché
+        if self.paginas:
+            return f"{self._huella}:p{self.paginas[0]}-{self.paginas[1]}"
+        return self._huella
+
+    def liberar(self):
+        pass
+
+
+def cargar_archivo(archivo, carpeta, umbral=UMBRAL_MEMORIA):
+    """Lee un `FileStorage` de Werkzeug una sola vez y devuelve un `DocumentoCargado`."""
+    stream = archivo.stream
+    stream.seek(0, os.SEEK_END)
+    tamano = stream.tell()
+    stream.seek(0)
+
+    cabecera = stream.read(16)
+    mime_type = detectar_mime(cabecera, archivo.filename)
+    stream.seek(0)
+
+    if tamano <= umbral:
+        return DocumentoCargado(archivo.filename, mime_type, tamano, contenido=stream.read())
+
+    os.makedirs(carpeta, exist_ok=True)
+    _, extension = os.path.splitext(archivo.filename or "")
+    fd, ruta = tempfile.mkstemp(prefix="carga-", suffix=extension, dir=carpeta)
+    with os.fdopen(fd, "wb") as destino:
+        shutil.copyfileobj(stream, destino, 1024 * 1024)
+    logger.info(f"💾 {archivo.filename} ({tamano} bytes) supera el umbral; se guarda en {ruta}")
+    return DocumentoCargado(archivo.filename, mime_type, tamano, ruta=ruta)
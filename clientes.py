@@ -0,0 +1,227 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import weakref
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+
+class RegistroClientes:
+    """
+    Registro de clientes de larga vida (Document AI, GCS, Secret Manager).
+
+    Cada cliente se construye la primera vez que se pide y se reutiliza en las
+    peticiones siguientes. Los canales gRPC no sobreviven a un fork, así que el
+    registro se vacía cuando cambia el PID (workers de gunicorn con --preload).
+    Los clientes registrados con `por_hilo=True` se construyen una vez por hilo
+    (para clientes cuyo transporte no es seguro entre hilos).
+    """
+
+    def __init__(self):
+        self._fabricas = {}
+        self._clientes = {}
+        self._locales = threading.local()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def registrar(self, nombre, fabrica, por_hilo=False):
+        self._fabricas[nombre] = (fabrica, por_hilo)
+
+    def _verificar_fork(self):
+        pid = os.getpid()
+        if pid != self._pid:
+            with self._lock:
+                if pid != self._pid:
+                    self._clientes = {}
+                    self._locales = threading.local()
+                    self._pid = pid
+
+    def obtener(self, nombre):
+        self._verificar_fork()
+        fabrica, por_hilo = self._fabricas[nombre]
+
+        if por_hilo:
+            clientes_hilo = self._locales.__dict__
+            if nombre not in clientes_hilo:
+                clientes_hilo[nombre] = self._construir(nombre, fabrica)
+            return clientes_hilo[nombre]
+
+        cliente = self._clientes.get(nombre)
+        if cliente is None:
+            with self._lock:
+                cliente = self._clientes.get(nombre)
+                if cliente is None:
+                    cliente = self._construir(nombre, fabrica)
+                    self._clientes[nombre] = cliente
+        return cliente
+
+    def _construir(self, nombre, fabrica):
+        inicio = time.monotonic()
+        cliente = fabrica()
+        logger.info(f"🔌 Cliente '{nombre}' inicializado en {(time.monotonic() - inicio) * 1000:.0f} ms")
+        return cliente
+
+    def invalidar(self, nombre):
+        """Descarta el cliente para que se reconstruya en el próximo uso."""
+        with self._lock:
+            self._clientes.pop(nombre, None)
+        self._locales.__dict__.pop(nombre, None)
+
+    def precalentar(self, nombres=None):
+        """Construye los clientes indicados (o todos) antes de la primera petición."""
+        for nombre in nombres or list(self._fabricas):
+            try:
+                self.obtener(nombre)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo precalentar el cliente '{nombre}': {e}")
+
+    def precalentar_en_segundo_plano(self, nombres=None):
+        hilo = threading.Thread(target=self.precalentar, args=(nombres,), daemon=True, name="precalentar-clientes")
+        hilo.start()
+        return hilo
+
+
+def _crear_documentai():
+    from google.cloud import documentai_v1 as documentai
+    return documentai.DocumentProcessorServiceClient()
+
+
+def _crear_storage():
+    from google.cloud import storage
+    return storage.Client.from_service_account_json(os.getenv("GCS_CREDENTIALS_PATH"))
+
+
+def _crear_secretmanager():
+    from google.cloud import secretmanager
+    return secretmanager.SecretManagerServiceClient()
+
+
+registro_clientes = RegistroClientes()
+registro_clientes.registrar("documentai", _crear_documentai)
+registro_clientes.registrar("storage", _crear_storage)
+registro_clientes.registrar("secretmanager", _crear_secretmanager)
+
+
+class RegistroClientesAsync:
+    """
+    Registro de clientes asíncronos para el modo ASGI (asgi.py).
+
+    Los clientes gRPC asíncronos y las sesiones HTTP quedan ligados al event
+    loop en el que se crean, así que se guardan por loop. Las fábricas son
+    funciones síncronas que se llaman dentro del loop. `cerrar()` libera los
+    clientes del loop actual al apagar el servidor.
+    """
+
+    def __init__(self):
+        self._fabricas = {}
+        self._por_loop = weakref.WeakKeyDictionary()
+
+    def registrar(self, nombre, fabrica):
+        self._fabricas[nombre] = fabrica
+
+    def _clientes_del_loop(self):
+        return self._por_loop.setdefault(asyncio.get_running_loop(), {})
+
+    async def obtener(self, nombre):
+        clientes = self._clientes_del_loop()
+        cliente = clientes.get(nombre)
+        if cliente is None:
+            # Sin await entre la consulta y el alta: no hay carreras dentro del loop
+            inicio = time.monotonic()
+            cliente = clientes[nombre] = self._fabricas[nombre]()
+            logger.info(f"🔌 Cliente asíncrono '{nombre}' inicializado en {(time.monotonic() - inicio) * 1000:.0f} ms")
+        return cliente
+
+    def invalidar(self, nombre):
+        for clientes in self._por_loop.values():
+            clientes.pop(nombre, None)
+
+    async def precalentar(self, nombres=None):
+        for nombre in nombres or list(self._fabricas):
+            try:
+                await self.obtener(nombre)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo precalentar el cliente asíncrono '{nombre}': {e}")
+
+    async def cerrar(self):
+        clientes = self._por_loop.pop(asyncio.get_running_loop(), {})
+        for nombre, cliente in clientes.items():
+            try:
+                if hasattr(cliente, "cerrar"):
+                    await cliente.cerrar()
+                elif hasattr(cliente, "transport"):
+                    await cliente.transport.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Error cerrando el cliente asíncrono '{nombre}': {e}")
+
+
+class ClienteGCSAsync:
+    """
+    Subidas a Cloud Storage con aiohttp sobre la API JSON (google-cloud-storage
+    no tiene cliente asíncrono). El token OAuth de la cuenta de servicio se
+    refresca en un hilo cuando vence.
+    """
+
+    URL_SUBIDA = "https://storage.googleapis.com/upload/storage/v1/b/{bucket}/o"
+    ALCANCE = "https://www.googleapis.com/auth/devstorage.read_write"
+
+    def __init__(self, ruta_credenciales=None):
+        import aiohttp
+        from google.oauth2 import service_account
+
+        if ruta_credenciales:
+            self._credenciales = service_account.Credentials.from_service_account_file(
+                ruta_credenciales, scopes=[self.ALCANCE]
+            )
+        else:
+            import google.auth
+            self._credenciales, _ = google.auth.default(scopes=[self.ALCANCE])
+        self._sesion = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_read=60))
+        self._lock = asyncio.Lock()
+
+    async def _token(self):
+        async with self._lock:
+            if not self._credenciales.valid:
+                from google.auth.transport.requests import Request
+                await asyncio.to_thread(self._credenciales.refresh, Request())
+        return self._credenciales.token
+
+    async def subir(self, documento, bucket, ruta):
+        """Sube `documento` (DocumentoCargado) a gs://bucket/ruta y devuelve su URL pública."""
+        cabeceras = {"Authorization": f"Bearer {await self._token()}", "Content-Type": documento.mime_type}
+        with documento.abrir() as contenido:
+            async with self._sesion.post(
+                self.URL_SUBIDA.format(bucket=bucket),
+                params={"uploadType": "media", "name": ruta},
+                data=contenido,
+                headers=cabeceras,
+            ) as respuesta:
+                if respuesta.status >= 400:
+                    raise RuntimeError(f"GCS respondió {respuesta.status}: {(await respuesta.text())[:200]}")
+        return f"https://storage.googleapis.com/{bucket}/{quote(ruta, safe='/~')}"
+
+    async def cerrar(self):
+        await self._sesion.close()
+
+
+def _crear_documentai_async():
+    from google.cloud import documentai_v1 as documentai
+    return documentai.DocumentProcessorServiceAsyncClient()
+
+
+def _crear_storage_async():
+    return ClienteGCSAsync(os.getenv("GCS_CREDENTIALS_PATH"))
+
+
+def _crear_secretmanager_async():
+    from google.cloud import secretmanager
+    return secretmanager.SecretManagerServiceAsyncClient()
+
+
+registro_clientes_async = RegistroClientesAsync()
+registro_clientes_async.registrar("documentai", _crear_documentai_async)
+registro_clientes_async.registrar("storage", _crear_storage_async)
+registro_clientes_async.registrar("secretmanager", _crear_secretmanager_async)
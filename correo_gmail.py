@@ -0,0 +1,125 @@
+import os
+import time
+import pickle
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from metricas import medir_dependencia
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorCredencialesGmail(RuntimeError):
+    """El token de Gmail no es válido y no se puede refrescar."""
+
+
+class GestorGmail:
+    """
+    Credenciales y servicio de Gmail compartidos por todo el proceso.
+
+    - Las credenciales se leen de `token_file` una vez y se vuelven a leer solo
+      si el archivo cambia (el secreto montado en /gmail se actualiza en caliente).
+    - Se refrescan antes de vencer, bajo un lock, para que envíos concurrentes
+      no disparen varios refrescos a la vez.
+    - El servicio se construye una sola vez con el documento de discovery
+      estático que trae googleapiclient, sin descargarlo ni volver a parsearlo.
+      Como httplib2 no es seguro entre hilos, cada hilo ejecuta las peticiones
+      con su propio transporte autorizado.
+    """
+
+    def __init__(self, token_file, margen_refresco=300, intervalo_revision=10):
+        self._token_file = token_file
+        self._margen_refresco = timedelta(seconds=margen_refresco)
+        self._intervalo_revision = intervalo_revision
+
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._creds = None
+        self._firma_archivo = None
+        self._ultima_revision = 0.0
+        self._servicio = None
+        self._pid = None
+
+        self.recargas = 0
+        self.refrescos = 0
+
+    def _firma(self):
+        # El secreto montado se reemplaza cambiando el enlace simbólico: se compara el destino real
+        estado = os.stat(os.path.realpath(self._token_file))
+        return (estado.st_ino, estado.st_mtime_ns, estado.st_size)
+
+    def _cargar(self):
+        with open(self._token_file, "rb") as token_file:
+            creds = pickle.load(token_file)
+        if not creds:
+            raise ErrorCredencialesGmail("El archivo de token de Gmail está vacío.")
+        self._creds = creds
+        self.recargas += 1
+        logger.info("🔑 Credenciales de Gmail cargadas desde disco.")
+
+    def _revisar_archivo(self):
+        ahora = time.monotonic()
+        if self._creds is not None and ahora - self._ultima_revision < self._intervalo_revision:
+            return
+        self._ultima_revision = ahora
+        firma = self._firma()
+        if self._creds is None or firma != self._firma_archivo:
+            self._cargar()
+            self._firma_archivo = firma
+
+    def _necesita_refresco(self):
+        creds = self._creds
+        if not creds.valid:
+            return True
+        return creds.expiry is not None and creds.expiry - datetime.utcnow() < self._margen_refresco
+
+    def credenciales(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Tras un fork no se reutilizan transportes del proceso padre
+                self._servicio = None
+                self._local = threading.local()
+                self._pid = os.getpid()
+
+            self._revisar_archivo()
+
+            if self._necesita_refresco():
+                creds = self._creds
+                if not creds.refresh_token:
+                    raise ErrorCredencialesGmail("Token inválido y sin refresh_token. Requiere reautenticación.")
+                from google.auth.transport.requests import Request
+                creds.refresh(Request())
+                self.refrescos += 1
+                logger.info("🔁 Token de Gmail refrescado exitosamente.")
+            return self._creds
+
+    def servicio(self, creds=None):
+        creds = creds or self.credenciales()
+        with self._lock:
+            if self._servicio is None:
+                from googleapiclient.discovery import build
+                self._servicio = build(
+                    'gmail', 'v1', credentials=creds, static_discovery=True, cache_discovery=False
+                )
+            return self._servicio
+
+    def _http_hilo(self, creds):
+        local = self._local
+        if getattr(local, "creds", None) is not creds:
+            import httplib2
+            import google_auth_httplib2
+            local.http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+            local.creds = creds
+        return local.http
+
+    def enviar(self, cuerpo):
+        """Envía un mensaje ya codificado ({'raw': ...}) y devuelve la respuesta de la API."""
+        with medir_dependencia("gmail"):
+            creds = self.credenciales()
+            servicio = self.servicio(creds)
+            http = self._http_hilo(creds)
+            return servicio.users().messages().send(userId="me", body=cuerpo).execute(http=http)
+
+    def metricas(self):
+        return {"recargas": self.recargas, "refrescos": self.refrescos}
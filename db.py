@@ -0,0 +1,215 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from metricas import instrumentar_dependencia
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la base de datos
+db_config = {
+    'host': os.getenv('DB_HOST'),
+    'user': os.getenv('DB_USER'),
+    'password': os.getenv('DB_PASSWORD'),
+    'database': os.getenv('DB_NAME')
+}
+
+class ErrorConexionDB(RuntimeError):
+    """No se pudo obtener una conexión del pool."""
+
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_POOL_RECICLAR = int(os.getenv('DB_POOL_RECICLAR', '1800'))
+
+
+class PoolConexiones:
+    """
+    Pool de conexiones MySQL sobre `mysql.connector.pooling`.
+
+    `MySQLConnectionPool` falla inmediatamente cuando no quedan conexiones
+    libres; aquí se espera hasta `timeout` segundos con un semáforo. Cada
+    conexión se valida con `ping` al entregarse y se recicla cuando supera
+    `reciclar` segundos de vida.
+    """
+
+    def __init__(self, config, tamano=5, timeout=10, reciclar=1800, nombre="autogestion"):
+        self._config = config
+        self._tamano = tamano
+        self._timeout = timeout
+        self._reciclar = reciclar
+        self._nombre = nombre
+
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._semaforo = threading.BoundedSemaphore(tamano)
+        self._nacimiento = {}
+
+        self.en_uso = 0
+        self.entregas = 0
+        self.esperas = 0
+        self.timeouts = 0
+        self.reciclajes = 0
+        self.invalidas = 0
+        self.tiempo_espera_total = 0.0
+        self.tiempo_espera_max = 0.0
+
+    def _obtener_pool(self):
+        # El pool se crea en el primer uso y se recrea tras un fork (workers de gunicorn).
+        # mysql.connector se importa recién aquí para no cargarlo al importar la app.
+        pid = os.getpid()
+        if self._pool is None or self._pid != pid:
+            from mysql.connector import pooling
+            with self._lock:
+                if self._pool is None or self._pid != pid:
+                    self._pool = pooling.MySQLConnectionPool(
+                        pool_name=f"{self._nombre}-{pid}",
+                        pool_size=self._tamano,
+                        pool_reset_session=True,
+                        **self._config
+                    )
+                    self._pid = pid
+                    self._semaforo = threading.BoundedSemaphore(self._tamano)
+                    self._nacimiento = {}
+                    self.en_uso = 0
+        return self._pool
+
+    def precalentar(self):
+        """Crea el pool (y sus conexiones) antes de la primera petición."""
+        try:
+            self._obtener_pool()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo precalentar el pool de MySQL: {e}")
+
+    def obtener(self):
+        from mysql.connector import pooling
+        pool = self._obtener_pool()
+        semaforo = self._semaforo
+
+        inicio = time.monotonic()
+        if not semaforo.acquire(blocking=False):
+            with self._lock:
+                self.esperas += 1
+            if not semaforo.acquire(timeout=self._timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise pooling.PoolError(f"No hay conexiones libres tras {self._timeout}s de espera")
+        espera = time.monotonic() - inicio
+
+        try:
+            conn = pool.get_connection()
+        except Exception:
+            semaforo.release()
+            raise
+        try:
+            self._preparar(conn)
+        except Exception:
+            # Si ping/reconnect fallan la conexión igual vuelve a la cola del pool:
+            # si no, tras DB_POOL_SIZE fallos quedaría agotado hasta reiniciar
+            try:
+                conn.close()
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo devolver al pool una conexión inválida: {e}")
+            finally:
+                semaforo.release()
+            raise
+
+        with self._lock:
+            self.en_uso += 1
+            self.entregas += 1
+            self.tiempo_espera_total += espera
+            self.tiempo_espera_max = max(self.tiempo_espera_max, espera)
+
+        # Al cerrar la conexión vuelve al pool y se libera su cupo
+        cerrar_original = conn.close
+        devuelta = threading.Event()
+
+        def cerrar():
+            if devuelta.is_set():
+                return
+            devuelta.set()
+            try:
+                cerrar_original()
+            finally:
+                with self._lock:
+                    self.en_uso -= 1
+                semaforo.release()
+        conn.close = cerrar
+        return conn
+
+    def _preparar(self, conn):
+        import mysql.connector
+        ahora = time.monotonic()
+        conn_id = conn.connection_id
+        # Los nacimientos y contadores se tocan bajo el lock; ping y reconnect van fuera
+        with self._lock:
+            nacimiento = self._nacimiento.setdefault(conn_id, ahora)
+            reciclar = ahora - nacimiento > self._reciclar
+            if reciclar:
+                self.reciclajes += 1
+                self._nacimiento.pop(conn_id, None)
+
+        if not reciclar:
+            try:
+                conn.ping(reconnect=False)
+                return
+            except mysql.connector.Error:
+                with self._lock:
+                    self.invalidas += 1
+                    self._nacimiento.pop(conn_id, None)
+        conn.reconnect(attempts=2, delay=0)
+        with self._lock:
+            self._nacimiento[conn.connection_id] = time.monotonic()
+
+    def metricas(self):
+        with self._lock:
+            return {
+                "tamano": self._tamano,
+                "en_uso": self.en_uso,
+                "utilizacion": round(self.en_uso / self._tamano, 2) if self._tamano else 0,
+                "entregas": self.entregas,
+                "esperas": self.esperas,
+                "timeouts": self.timeouts,
+                "reciclajes": self.reciclajes,
+                "invalidas": self.invalidas,
+                "espera_promedio_ms": round(self.tiempo_espera_total * 1000 / self.entregas, 2) if self.entregas else 0,
+                "espera_max_ms": round(self.tiempo_espera_max * 1000, 2),
+            }
+
+
+pool_db = PoolConexiones(db_config, tamano=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, reciclar=DB_POOL_RECICLAR)
+
+
+@instrumentar_dependencia("mysql", es_error=lambda conn: conn is None)
+def get_db_connection():
+    import mysql.connector
+    try:
+        return pool_db.obtener()
+    except mysql.connector.Error as err:
+        logger.error(f"Error al conectar a la base de datos: {err}")
+        return None
+
+
+@contextmanager
+def conexion_db():
+    """
+    Entrega una conexión del pool (o None si no hay) y la devuelve al salir.
+    Si el bloque lanza una excepción se hace rollback antes de devolverla.
+    """
+    conn = get_db_connection()
+    try:
+        yield conn
+    except Exception:
+        if conn is not None:
+            import mysql.connector
+            try:
+                conn.rollback()
+            except mysql.connector.Error:
+                pass
+        raise
+    finally:
+        if conn is not None:
+            conn.close()
@@ -0,0 +1,153 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from entidades import aplanar_campos
+from persistencia import FORMATO_DATOS
+
+logger = logging.getLogger(__name__)
+
+# Las tres tablas se leen en una sola consulta. Cada rama del UNION rellena las
+# mismas columnas genéricas (t1..t4) y se distingue por `fuente`.
+SQL_DETALLE = """
+    SELECT 'solicitud' AS fuente, s.id, s.usuario_id, s.fecha, s.estado, s.actualizado,
+           s.motivo_rechazo AS t1, NULL AS t2, NULL AS t3, NULL AS t4
+    FROM solicitudes s WHERE s.id = %s
+    UNION ALL
+    SELECT 'archivo', a.solicitud_id, NULL, NULL, NULL, NULL,
+           a.nombre_archivo, a.ruta_archivo, NULL, NULL
+    FROM archivos a WHERE a.solicitud_id = %s
+    UNION ALL
+    SELECT 'dato', d.solicitud_id, NULL, NULL, NULL, NULL,
+           d.tipo_documento, d.campo, d.valor, d.confianza
+    FROM datos_extraidos d WHERE d.solicitud_id = %s
+"""
+
+# Con el formato json se agrega la tabla `extracciones`; las filas de datos_extraidos
+# que aún no se migraron se siguen leyendo
+SQL_DETALLE_MIXTO = SQL_DETALLE + """
+    UNION ALL
+    SELECT 'extraccion', e.solicitud_id, NULL, NULL, NULL, NULL,
+           e.tipo_documento, e.campos, e.error, NULL
+    FROM extracciones e WHERE e.solicitud_id = %s
+"""
+
+
+def cargar_detalle(conn, id_solicitud, formato=None):
+    """
+    Devuelve el dict `solicitud` que usa detalle.html, o None si no existe.
+    Incluye `version` ((actualizado, id), lo mismo que usa el ETag).
+    """
+    cursor = conn.cursor(dictionary=True)
+    if (formato or FORMATO_DATOS) == "json":
+        cursor.execute(SQL_DETALLE_MIXTO, (id_solicitud,) * 4)
+    else:
+        cursor.execute(SQL_DETALLE, (id_solicitud,) * 3)
+    filas = cursor.fetchall()
+    return armar_detalle(filas)
+
+
+def datos_desde_json(campos, error):
+    """
+    Convierte una fila de `extracciones` al formato que muestra detalle.html:
+    campos aplanados como "padre.hija" y confianza como texto ("97.5%").
+    """
+    if error:
+        return {"error": error}
+    datos = {}
+    for campo, detalle in aplanar_campos(json.loads(campos or "{}")):
+        confianza = detalle.get("confianza")
+        datos[campo] = {"valor": detalle.get("valor", ""), "confianza": "" if confianza is None else f"{confianza}%"}
+    return datos
+
+
+def armar_detalle(filas):
+    base = None
+    archivos = []
+    datos_extraidos = {}
+    documentos_json = {}
+
+    for fila in filas:
+        fuente = fila['fuente']
+        if fuente == 'solicitud':
+            base = fila
+        elif fuente == 'archivo':
+            archivos.append({"nombre": fila['t1'], "ruta": fila['t2']})
+        elif fuente == 'extraccion':
+            documentos_json[fila['t1']] = datos_desde_json(fila['t2'], fila['t3'])
+        else:
+            tipo, campo = fila['t1'], fila['t2']
+            datos = datos_extraidos.setdefault(tipo, {})
+            if campo == "error":
+                datos["error"] = fila['t3']
+                continue
+            datos[campo] = {"valor": fila['t3'], "confianza": fila['t4']}
+
+    if base is None:
+        return None
+    # Si un documento está en ambos formatos, el JSON es el más reciente
+    datos_extraidos.update(documentos_json)
+
+    return {
+        "id": base['id'],
+        "version": (base['actualizado'], base['id']),
+        "usuario_id": base['usuario_id'],
+        "fecha": base['fecha'],
+        "estado": base['estado'],
+        "motivo": base['t1'],
+        "archivos": archivos,
+        "info": datos_extraidos
+    }
+
+
+class CacheSolicitudes:
+    """
+    Caché de lectura (read-through) del detalle de cada solicitud.
+
+    Un acierto no consulta la BD: el ETag de /detalle sale de la `version` que
+    trae la propia entrada. Los cambios de este proceso invalidan la entrada al
+    momento; los hechos por otro worker o réplica se ven al vencer `ttl`.
+    """
+
+    def __init__(self, capacidad=500, ttl=60):
+        self._capacidad = capacidad
+        self._ttl = ttl
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        # Sube con cada invalidar(): una carga que empezó antes no se guarda
+        self._generacion = 0
+        self.hits = 0
+        self.misses = 0
+
+    def obtener(self, id_solicitud, cargar):
+        """Devuelve la solicitud en caché si sigue vigente; si no, la carga con `cargar()` y la guarda."""
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(id_solicitud)
+            if entrada and ahora - entrada[0] < self._ttl:
+                self._entradas.move_to_end(id_solicitud)
+                self.hits += 1
+                return entrada[1]
+            self.misses += 1
+            generacion = self._generacion
+
+        solicitud = cargar()
+        if solicitud is not None:
+            with self._lock:
+                if generacion == self._generacion:
+                    self._entradas[id_solicitud] = (ahora, solicitud)
+                    self._entradas.move_to_end(id_solicitud)
+                    while len(self._entradas) > self._capacidad:
+                        self._entradas.popitem(last=False)
+        return solicitud
+
+    def invalidar(self, id_solicitud):
+        with self._lock:
+            self._entradas.pop(id_solicitud, None)
+            self._generacion += 1
+
+    def metricas(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entradas": len(self._entradas)}
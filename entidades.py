@@ -0,0 +1,66 @@
+# Único campo del Document que se pide a Document AI. El resto (texto completo,
+# páginas, tokens, layout e imágenes) no se usa y puede pesar varios MB por PDF.
+# La API solo admite campos de primer nivel en la máscara.
+MASCARA_ENTIDADES = {"paths": ["entities"]}
+
+
+def normalizar_tipo(tipo):
+    return (tipo or "").lower().replace(" ", "_")
+
+
+class EntidadExtraida:
+    """
+    Entidad de Document AI reducida a lo que guarda la app: tipo, valor,
+    confianza y sus propiedades anidadas (que también son entidades).
+    """
+
+    __slots__ = ("tipo", "valor", "confianza", "propiedades")
+
+    def __init__(self, tipo, valor, confianza, propiedades=()):
+        self.tipo = tipo
+        self.valor = valor
+        self.confianza = confianza
+        self.propiedades = tuple(propiedades)
+
+    @classmethod
+    def desde_proto(cls, entidad):
+        """Desde `Document.Entity` (respuesta de process_document)."""
+        return cls(
+            normalizar_tipo(entidad.type_),
+            entidad.mention_text,
+            entidad.confidence,
+            [cls.desde_proto(p) for p in entidad.properties],
+        )
+
+    @classmethod
+    def desde_json(cls, entidad):
+        """Desde el JSON de salida de batch_process_documents (claves en camelCase)."""
+        return cls(
+            normalizar_tipo(entidad.get("type")),
+            entidad.get("mentionText", ""),
+            float(entidad.get("confidence", 0)),
+            [cls.desde_json(p) for p in entidad.get("properties", ())],
+        )
+
+    def a_campo(self):
+        """Formato que guardan la caché y datos_extraidos: {valor, confianza[, propiedades]}."""
+        campo = {"valor": self.valor, "confianza": f"{round(self.confianza * 100, 2)}%"}
+        if self.propiedades:
+            campo["propiedades"] = campos_desde_entidades(self.propiedades)
+        return campo
+
+
+def campos_desde_entidades(entidades):
+    """{tipo: campo} a partir de entidades ya convertidas; si un tipo se repite gana la última."""
+    return {entidad.tipo: entidad.a_campo() for entidad in entidades}
+
+
+def aplanar_campos(campos, prefijo=""):
+    """
+    Itera (campo, detalle) incluyendo las propiedades anidadas como
+    "padre.hija", que es como se guardan en datos_extraidos.
+    """
+    for nombre, detalle in campos.items():
+        yield prefijo + nombre, detalle
+        if isinstance(detalle, dict):
+            yield from aplanar_campos(detalle.get("propiedades", {}), f"{prefijo}{nombre}.")
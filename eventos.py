@@ -0,0 +1,469 @@
+"""
+Cambios de solicitudes en vivo para el panel de administración (Server-Sent Events).
+
+/subir publica "solicitud_nueva" y /aceptar y /rechazar publican
+"solicitud_estado" después de confirmar su transacción. `DifusorEventos`
+reparte cada evento a las conexiones abiertas del proceso y guarda los últimos
+en un historial para que un navegador que se reconecta con Last-Event-ID
+reciba lo que se perdió.
+
+El transporte entre procesos es intercambiable (EVENTOS_BACKEND):
+
+- "memoria" (por defecto): solo este proceso. Con varias réplicas cada panel
+  ve únicamente los cambios hechos en la réplica a la que está conectado.
+- "mysql": cada evento se inserta en `eventos_admin` y un hilo por proceso lee
+  los nuevos cada `intervalo` segundos. El id AUTO_INCREMENT es el id del
+  evento, igual en todas las réplicas, así que se puede reanudar en cualquiera.
+"""
+import os
+import json
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+SOLICITUD_NUEVA = "solicitud_nueva"
+SOLICITUD_ESTADO = "solicitud_estado"
+# Se envía cuando no se pueden reponer los eventos perdidos: el panel recarga la página
+RECARGAR = "recargar"
+
+Evento = namedtuple("Evento", "id tipo datos")
+
+
+def formatear_sse(evento):
+    datos = json.dumps(evento.datos, ensure_ascii=False, default=str)
+    return f"id: {evento.id}\nevent: {evento.tipo}\ndata: {datos}\n\n"
+
+
+def formatear_recarga(motivo):
+    return f"event: {RECARGAR}\ndata: {json.dumps({'motivo': motivo})}\n\n"
+
+
+# Comentario SSE: lo ignora el navegador pero mantiene viva la conexión en proxies y balanceadores
+LATIDO = ": latido\n\n"
+
+
+def leer_ultimo_id(valor):
+    try:
+        return int(valor) if valor not in (None, "") else None
+    except ValueError:
+        return None
+
+
+class Suscripcion:
+    """Cola de eventos de una conexión. Si el cliente no la vacía a tiempo se marca desbordada."""
+
+    def __init__(self, difusor, capacidad):
+        self._difusor = difusor
+        self._cola = queue.Queue(capacidad)
+        self.desbordada = False
+
+    def entregar(self, evento):
+        try:
+            self._cola.put_nowait(evento)
+        except queue.Full:
+            self.desbordada = True
+
+    def siguiente(self, timeout):
+        """Siguiente evento o None si pasaron `timeout` segundos sin eventos."""
+        try:
+            return self._cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def cerrar(self):
+        self._difusor._quitar(self)
+
+
+class SuscripcionAsync(Suscripcion):
+    """Igual que `Suscripcion`, pero se espera en el event loop (modo ASGI)."""
+
+    def __init__(self, difusor, capacidad, loop):
+        self._difusor = difusor
+        self._cola = asyncio.Queue(capacidad)
+        self._loop = loop
+        self.desbordada = False
+
+    def entregar(self, evento):
+        # Los eventos se publican desde hilos de peticiones o del backend
+        self._loop.call_soon_threadsafe(self._poner, evento)
+
+    def _poner(self, evento):
+        try:
+            self._cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            self.desbordada = True
+
+    async def siguiente(self, timeout):
+        try:
+            return await asyncio.wait_for(self._cola.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class DifusorEventos:
+    """
+    Reparte los eventos del backend a las suscripciones del proceso.
+
+    `suscribir(ultimo_id)` devuelve (suscripcion, pendientes). `pendientes` son
+    los eventos posteriores a `ultimo_id` (del historial o del backend), o None
+    si ya no están disponibles y el cliente debe recargar. Un mismo evento puede
+    llegar tanto en `pendientes` como por la cola: el flujo descarta los ids
+    que ya envió.
+    """
+
+    def __init__(self, backend, historial=1000, capacidad_cola=256):
+        self.backend = backend
+        self._historial = deque(maxlen=historial)
+        self._capacidad_cola = capacidad_cola
+        self._suscripciones = set()
+        self._lock = threading.Lock()
+        self.publicados = 0
+        self.entregados = 0
+        self.desbordes = 0
+        backend.conectar(self._difundir)
+
+    def publicar(self, tipo, datos):
+        """Publica un evento. Un fallo se registra y no afecta a la petición que lo originó."""
+        self.publicar_varios(tipo, [datos])
+
+    def publicar_varios(self, tipo, lista_datos):
+        """Publica un evento por cada elemento de `lista_datos` (p. ej. una revisión masiva)."""
+        if not lista_datos:
+            return
+        try:
+            self.backend.publicar(tipo, lista_datos)
+            self.publicados += len(lista_datos)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron publicar {len(lista_datos)} eventos {tipo}: {e}")
+
+    def _difundir(self, evento):
+        with self._lock:
+            self._historial.append(evento)
+            suscripciones = list(self._suscripciones)
+        for suscripcion in suscripciones:
+            suscripcion.entregar(evento)
+            if suscripcion.desbordada:
+                self.desbordes += 1
+        self.entregados += len(suscripciones)
+
+    def suscribir(self, ultimo_id=None, loop=None):
+        if loop is None:
+            suscripcion = Suscripcion(self, self._capacidad_cola)
+        else:
+            suscripcion = SuscripcionAsync(self, self._capacidad_cola, loop)
+        try:
+            self.backend.asegurar_iniciado()
+        except Exception as e:
+            # Sin posición de lectura no se puede garantizar el flujo: el cliente recarga
+            logger.warning(f"⚠️ No se pudo iniciar la lectura de eventos del panel: {e}")
+            return suscripcion, None
+
+        # Se registra antes de leer el historial para no perder eventos entre ambos pasos
+        with self._lock:
+            self._suscripciones.add(suscripcion)
+            if ultimo_id is None:
+                return suscripcion, []
+            # Si el más antiguo del historial es el siguiente a `ultimo_id`, no falta ninguno
+            if self._historial and self._historial[0].id <= ultimo_id + 1:
+                return suscripcion, [e for e in self._historial if e.id > ultimo_id]
+
+        try:
+            pendientes = self.backend.desde(ultimo_id, self._historial.maxlen)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron leer los eventos posteriores a {ultimo_id}: {e}")
+            pendientes = None
+        return suscripcion, pendientes
+
+    def ultimo_id(self):
+        """Id del último evento conocido; la página lo usa para reanudar desde el momento en que se generó."""
+        with self._lock:
+            if self._historial:
+                return self._historial[-1].id
+        return self.backend.ultimo_id()
+
+    def _quitar(self, suscripcion):
+        with self._lock:
+            self._suscripciones.discard(suscripcion)
+
+    def metricas(self):
+        with self._lock:
+            conexiones = len(self._suscripciones)
+        return {
+            "conexiones": conexiones,
+            "publicados": self.publicados,
+            "entregados": self.entregados,
+            "desbordes": self.desbordes,
+        }
+
+
+class BackendMemoria:
+    """
+    Entrega los eventos directamente en este proceso. Los ids parten de la hora
+    de arranque en milisegundos: un Last-Event-ID de un proceso anterior queda
+    fuera del historial y el cliente recarga en vez de recibir eventos ajenos.
+    """
+
+    def __init__(self):
+        self._siguiente = int(time.time() * 1000)
+        self._lock = threading.Lock()
+        self._entregar = None
+
+    def conectar(self, entregar):
+        self._entregar = entregar
+
+    def asegurar_iniciado(self):
+        pass
+
+    def publicar(self, tipo, lista_datos):
+        # Dentro del lock para que el orden de entrega sea el de los ids
+        with self._lock:
+            for datos in lista_datos:
+                evento = Evento(self._siguiente, tipo, datos)
+                self._siguiente += 1
+                self._entregar(evento)
+
+    def ultimo_id(self):
+        with self._lock:
+            return self._siguiente - 1
+
+    def desde(self, ultimo_id, limite):
+        return [] if ultimo_id == self.ultimo_id() else None
+
+
+class BackendMySQL:
+    """
+    Eventos compartidos entre réplicas a través de la tabla `eventos_admin`.
+
+    `publicar` inserta la fila y despierta el hilo lector del proceso, así que
+    la réplica que originó el cambio lo entrega de inmediato y las demás en
+    menos de `intervalo` segundos. Las filas con más de `retencion` segundos se
+    borran periódicamente.
+
+    InnoDB asigna el AUTO_INCREMENT al insertar, no al confirmar: con dos
+    réplicas publicando a la vez el id 11 puede verse antes que el 10. Por eso
+    el lector solo avanza de a un id; ante un hueco espera hasta
+    `espera_huecos` segundos a que aparezca y, si no (rollback o id saltado),
+    lo da por perdido y sigue. Así los eventos se entregan en orden de id y el
+    flujo no descarta uno tardío por ser menor que el último enviado.
+    """
+
+    def __init__(self, obtener_conexion, intervalo=1.0, lote=500, retencion=86400, espera_huecos=2.0):
+        self._obtener_conexion = obtener_conexion
+        self._intervalo = intervalo
+        self._espera_huecos = espera_huecos
+        self._lote = lote
+        self._retencion = retencion
+        self._entregar = None
+        self._posicion = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+
+    def conectar(self, entregar):
+        self._entregar = entregar
+
+    def asegurar_iniciado(self):
+        """
+        Arranca el hilo lector del proceso (también tras un fork). La posición se
+        lee aquí, antes de registrar la primera suscripción: si la leyera el hilo
+        después, se saltaría lo que otra réplica publique entre ambos momentos.
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._posicion = self._posicion_inicial()
+            threading.Thread(target=self._bucle, daemon=True, name="lector-eventos").start()
+            self._pid = pid
+            logger.info(f"📡 Lector de eventos del panel iniciado (pid {pid})")
+
+    def publicar(self, tipo, lista_datos):
+        try:
+            self.asegurar_iniciado()
+        except Exception as e:
+            # El evento se inserta igual: las demás réplicas lo leen de la tabla
+            logger.warning(f"⚠️ No se pudo iniciar el lector de eventos del panel: {e}")
+        with self._obtener_conexion() as conn:
+            if not conn:
+                raise RuntimeError("Sin conexión a la base de datos")
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT INTO eventos_admin (tipo, datos) VALUES (%s, %s)",
+                [(tipo, json.dumps(datos, ensure_ascii=False, default=str)) for datos in lista_datos]
+            )
+            conn.commit()
+        self._despertar.set()
+
+    def _leer(self, ultimo_id, limite):
+        with self._obtener_conexion() as conn:
+            if not conn:
+                raise RuntimeError("Sin conexión a la base de datos")
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, tipo, datos FROM eventos_admin WHERE id > %s ORDER BY id LIMIT %s",
+                (ultimo_id, limite)
+            )
+            return [Evento(fila[0], fila[1], json.loads(fila[2])) for fila in cursor.fetchall()]
+
+    def ultimo_id(self):
+        if self._posicion is None:
+            self._posicion = self._posicion_inicial()
+        return self._posicion
+
+    def desde(self, ultimo_id, limite):
+        eventos = self._leer(ultimo_id, limite)
+        # Si se llenó el límite faltan eventos: es más barato recargar la página
+        if len(eventos) >= limite:
+            return None
+        # Lo posterior a la posición del lector llega por la cola (la suscripción ya
+        # está registrada), en orden y después de cualquier hueco que aún espere
+        posicion = self.ultimo_id()
+        return [evento for evento in eventos if evento.id <= posicion]
+
+    def _posicion_inicial(self):
+        with self._obtener_conexion() as conn:
+            if not conn:
+                raise RuntimeError("Sin conexión a la base de datos")
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM eventos_admin")
+            return cursor.fetchone()[0]
+
+    def _purgar(self):
+        with self._obtener_conexion() as conn:
+            if not conn:
+                return
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM eventos_admin WHERE creado < NOW() - INTERVAL %s SECOND LIMIT 1000",
+                (self._retencion,)
+            )
+            conn.commit()
+            if cursor.rowcount:
+                logger.info(f"🧹 {cursor.rowcount} eventos del panel purgados")
+
+    def _avanzar(self, eventos, hueco_desde):
+        """
+        Entrega los eventos contiguos a la posición. Devuelve (entregados, momento
+        en que se vio el hueco pendiente o None).
+        """
+        entregados = 0
+        for evento in eventos:
+            if evento.id > self._posicion + 1:
+                ahora = time.monotonic()
+                if hueco_desde is None:
+                    hueco_desde = ahora
+                if ahora - hueco_desde < self._espera_huecos:
+                    break
+                logger.warning(f"⚠️ Eventos {self._posicion + 1}-{evento.id - 1} del panel no aparecieron; se omiten")
+            hueco_desde = None
+            self._entregar(evento)
+            self._posicion = evento.id
+            entregados += 1
+        return entregados, hueco_desde
+
+    def _bucle(self):
+        proxima_purga = time.monotonic() + 3600
+        hueco_desde = None
+        while True:
+            leidos = entregados = 0
+            try:
+                eventos = self._leer(self.ultimo_id(), self._lote)
+                leidos = len(eventos)
+                entregados, hueco_desde = self._avanzar(eventos, hueco_desde)
+                if time.monotonic() >= proxima_purga:
+                    proxima_purga = time.monotonic() + 3600
+                    self._purgar()
+            except Exception as e:
+                logger.error(f"❌ Error leyendo eventos del panel: {e}")
+            if hueco_desde is not None:
+                # Un hueco suele cerrarse en milisegundos (la otra transacción confirma)
+                self._despertar.wait(min(self._intervalo, self._espera_huecos / 10))
+                self._despertar.clear()
+            elif leidos < self._lote or not entregados:
+                self._despertar.wait(self._intervalo)
+                self._despertar.clear()
+
+
+def flujo_sse(difusor, ultimo_id=None, latido=15, duracion=300, reintento_ms=3000):
+    """
+    Genera el texto del flujo SSE de una conexión: primero los eventos
+    posteriores a `ultimo_id`, luego los nuevos, con un latido cada `latido`
+    segundos. Termina a los `duracion` segundos; el navegador se reconecta solo
+    enviando Last-Event-ID, lo que libera el hilo y reparte las conexiones
+    entre réplicas.
+    """
+    suscripcion, pendientes = difusor.suscribir(ultimo_id)
+    try:
+        yield f"retry: {reintento_ms}\n\n"
+        if pendientes is None:
+            yield formatear_recarga("eventos_no_disponibles")
+            return
+        enviado = ultimo_id or 0
+        for evento in pendientes:
+            yield formatear_sse(evento)
+            enviado = evento.id
+
+        fin = time.monotonic() + duracion
+        while (restante := fin - time.monotonic()) > 0:
+            evento = suscripcion.siguiente(min(latido, restante))
+            if suscripcion.desbordada:
+                yield formatear_recarga("cola_desbordada")
+                return
+            if evento is None:
+                yield LATIDO
+            elif evento.id > enviado:
+                yield formatear_sse(evento)
+                enviado = evento.id
+    finally:
+        suscripcion.cerrar()
+
+
+async def flujo_sse_async(difusor, ultimo_id=None, latido=15, duracion=300, reintento_ms=3000):
+    """Versión de `flujo_sse` para el modo ASGI: espera en el event loop, sin ocupar un hilo."""
+    loop = asyncio.get_running_loop()
+    suscripcion, pendientes = await asyncio.to_thread(difusor.suscribir, ultimo_id, loop)
+    try:
+        yield f"retry: {reintento_ms}\n\n"
+        if pendientes is None:
+            yield formatear_recarga("eventos_no_disponibles")
+            return
+        enviado = ultimo_id or 0
+        for evento in pendientes:
+            yield formatear_sse(evento)
+            enviado = evento.id
+
+        fin = time.monotonic() + duracion
+        while (restante := fin - time.monotonic()) > 0:
+            evento = await suscripcion.siguiente(min(latido, restante))
+            if suscripcion.desbordada:
+                yield formatear_recarga("cola_desbordada")
+                return
+            if evento is None:
+                yield LATIDO
+            elif evento.id > enviado:
+                yield formatear_sse(evento)
+                enviado = evento.id
+    finally:
+        suscripcion.cerrar()
+
+
+def crear_difusor(obtener_conexion, backend=None):
+    backend = backend or os.getenv("EVENTOS_BACKEND", "memoria")
+    if backend == "mysql":
+        transporte = BackendMySQL(
+            obtener_conexion,
+            intervalo=float(os.getenv("EVENTOS_INTERVALO", "1")),
+            espera_huecos=float(os.getenv("EVENTOS_ESPERA_HUECOS", "2")),
+        )
+    elif backend == "memoria":
+        transporte = BackendMemoria()
+    else:
+        raise ValueError(f"Backend de eventos desconocido: {backend}")
+    return DifusorEventos(transporte, historial=int(os.getenv("EVENTOS_HISTORIAL", "1000")))
@@ -0,0 +1,131 @@
+import os
+import gzip
+import hashlib
+import logging
+
+from flask import request, make_response
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional; sin él se comprime solo con gzip
+    brotli = None
+
+TIPOS_COMPRIMIBLES = {"text/html", "application/json", "text/css", "application/javascript", "text/plain"}
+TAMANO_MINIMO_COMPRESION = 500
+
+# Forma parte de todos los ETag para que un despliegue con templates nuevos los invalide.
+# Se calcula en configurar_cache_http() a partir de APP_VERSION o del contenido de los templates.
+version_app = os.getenv("APP_VERSION", "")
+
+
+def _hash_templates(carpeta):
+    h = hashlib.sha1()
+    for raiz, _, archivos in sorted(os.walk(carpeta)):
+        for nombre in sorted(archivos):
+            with open(os.path.join(raiz, nombre), "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()[:12]
+
+
+def calcular_etag(*partes):
+    contenido = "|".join(str(p) for p in (version_app,) + partes)
+    return hashlib.sha1(contenido.encode("utf-8")).hexdigest()
+
+
+def respuesta_condicional(partes_version, ultima_modificacion, generar):
+    """
+    Devuelve 304 si el cliente ya tiene la versión actual; si no, llama a
+    `generar()` (que renderiza la respuesta) y le agrega ETag/Last-Modified.
+
+    `partes_version` identifica el contenido (marcador de la BD + parámetros);
+    el token de sesión se excluye para que no forme parte del ETag.
+    """
+    parametros = sorted((k, v) for k, v in request.args.items(multi=True) if k != "token")
+    etag = calcular_etag(request.path, parametros, *partes_version)
+
+    if request.if_none_match.contains_weak(etag) or (
+        not request.if_none_match and ultima_modificacion and request.if_modified_since
+        and ultima_modificacion.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    ):
+        respuesta = make_response("", 304)
+    else:
+        respuesta = make_response(generar())
+
+    respuesta.set_etag(etag)
+    if ultima_modificacion:
+        respuesta.last_modified = ultima_modificacion
+    respuesta.headers["Cache-Control"] = "private, no-cache"
+    return respuesta
+
+
+def _comprimir(respuesta):
+    if (respuesta.status_code < 200 or respuesta.status_code >= 300
+            or respuesta.direct_passthrough or respuesta.is_streamed
+            or "Content-Encoding" in respuesta.headers
+            or respuesta.mimetype not in TIPOS_COMPRIMIBLES):
+        return respuesta
+
+    datos = respuesta.get_data()
+    if len(datos) < TAMANO_MINIMO_COMPRESION:
+        return respuesta
+
+    aceptadas = request.accept_encodings
+    if brotli is not None and aceptadas["br"]:
+        comprimidos, codificacion = brotli.compress(datos, quality=5), "br"
+    elif aceptadas["gzip"]:
+        comprimidos, codificacion = gzip.compress(datos, compresslevel=6), "gzip"
+    else:
+        return respuesta
+
+    respuesta.set_data(comprimidos)
+    respuesta.headers["Content-Encoding"] = codificacion
+    respuesta.vary.add("Accept-Encoding")
+    if respuesta.headers.get("ETag"):
+        # La representación comprimida es distinta: ETag débil
+        etag, _ = respuesta.get_etag()
+        respuesta.set_etag(etag, weak=True)
+    return respuesta
+
+
+def configurar_cache_http(app, max_age_estaticos=31536000):
+    """
+    Comprime las respuestas HTML/JSON y sirve /static con huella en la URL.
+
+    `url_for('static', filename=...)` agrega `?v=<hash del archivo>`; las
+    peticiones con esa huella se cachean un año como `immutable`, porque un
+    cambio en el archivo cambia la URL.
+    """
+    global version_app
+    if not version_app:
+        version_app = _hash_templates(os.path.join(app.root_path, app.template_folder))
+
+    huellas = {}
+
+    def huella(filename):
+        if filename not in huellas:
+            ruta = os.path.join(app.static_folder, filename)
+            try:
+                with open(ruta, "rb") as f:
+                    huellas[filename] = hashlib.sha1(f.read()).hexdigest()[:12]
+            except OSError:
+                huellas[filename] = None
+        return huellas[filename]
+
+    @app.url_defaults
+    def agregar_huella_estaticos(endpoint, values):
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            valor = huella(values["filename"])
+            if valor:
+                values["v"] = valor
+
+    @app.after_request
+    def cabeceras_cache(respuesta):
+        if request.endpoint == "static" and request.args.get("v"):
+            respuesta.cache_control.no_cache = None
+            respuesta.cache_control.public = True
+            respuesta.cache_control.max_age = max_age_estaticos
+            respuesta.cache_control.immutable = True
+            return respuesta
+        return _comprimir(respuesta)
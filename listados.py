@@ -0,0 +1,120 @@
+import base64
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+LIMITE_POR_DEFECTO = 50
+LIMITE_MAXIMO = 200
+ESTADOS_VALIDOS = ('sin revisar', 'aprobado', 'rechazado')
+
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
+
+
+class ParametroInvalido(ValueError):
+    """Filtro o cursor de paginación mal formado."""
+
+
+def codificar_cursor(fecha, id_solicitud):
+    if isinstance(fecha, datetime):
+        fecha = fecha.strftime(FORMATO_FECHA)
+    return base64.urlsafe_b64encode(f"{fecha}|{id_solicitud}".encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor):
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        fecha, id_solicitud = base64.urlsafe_b64decode(cursor + relleno).decode().rsplit("|", 1)
+        return datetime.strptime(fecha, FORMATO_FECHA), int(id_solicitud)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ParametroInvalido(f"Cursor inválido: {e}")
+
+
+def _fecha_filtro(valor, nombre):
+    try:
+        return datetime.strptime(valor, "%Y-%m-%d")
+    except ValueError:
+        raise ParametroInvalido(f"'{nombre}' debe tener formato AAAA-MM-DD")
+
+
+def leer_filtros(args):
+    """Valida los parámetros de la URL y devuelve (filtros, cursor, limite)."""
+    filtros = {}
+
+    estado = args.get("estado", "").strip()
+    if estado:
+        if estado not in ESTADOS_VALIDOS:
+            raise ParametroInvalido(f"Estado desconocido: {estado}")
+        filtros["estado"] = estado
+
+    correo = args.get("correo", "").strip()
+    if correo:
+        filtros["correo"] = correo
+
+    desde = args.get("desde", "").strip()
+    if desde:
+        filtros["desde"] = _fecha_filtro(desde, "desde")
+
+    hasta = args.get("hasta", "").strip()
+    if hasta:
+        filtros["hasta"] = _fecha_filtro(hasta, "hasta")
+
+    cursor = args.get("cursor", "").strip()
+    posicion = decodificar_cursor(cursor) if cursor else None
+
+    try:
+        limite = int(args.get("limite", LIMITE_POR_DEFECTO))
+    except ValueError:
+        raise ParametroInvalido("'limite' debe ser un número")
+    limite = max(1, min(limite, LIMITE_MAXIMO))
+
+    return filtros, posicion, limite
+
+
+def consulta_solicitudes(filtros, posicion, limite):
+    """
+    Arma la consulta paginada por (fecha, id) descendente.
+
+    Se pide una fila extra para saber si hay página siguiente. La condición de
+    keyset se escribe con OR en lugar de comparar tuplas para que MySQL use
+    el índice (fecha, id).
+    """
+    condiciones, parametros = [], []
+
+    if "estado" in filtros:
+        condiciones.append("s.estado = %s")
+        parametros.append(filtros["estado"])
+    if "correo" in filtros:
+        condiciones.append("s.correo = %s")
+        parametros.append(filtros["correo"])
+    if "desde" in filtros:
+        condiciones.append("s.fecha >= %s")
+        parametros.append(filtros["desde"])
+    if "hasta" in filtros:
+        condiciones.append("s.fecha < %s")
+        parametros.append(filtros["hasta"] + timedelta(days=1))
+    if posicion:
+        fecha, id_solicitud = posicion
+        condiciones.append("(s.fecha < %s OR (s.fecha = %s AND s.id < %s))")
+        parametros.extend([fecha, fecha, id_solicitud])
+
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    sql = f"""
+        SELECT s.id, s.fecha, s.estado, s.usuario_id, u.correo
+        FROM solicitudes s
+        LEFT JOIN usuarios u ON s.usuario_id = u.id
+        {where}
+        ORDER BY s.fecha DESC, s.id DESC
+        LIMIT %s
+    """
+    parametros.append(limite + 1)
+    return sql, parametros
+
+
+def paginar(filas, limite):
+    """Recorta la fila extra y devuelve (filas, cursor_siguiente)."""
+    if len(filas) <= limite:
+        return filas, None
+    filas = filas[:limite]
+    ultima = filas[-1]
+    return filas, codificar_cursor(ultima["fecha"], ultima["id"])
@@ -0,0 +1,228 @@
+import os
+import time
+import logging
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+from secretos import comparar_tokens
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _formatear_etiquetas(nombres, valores, extra=None):
+    pares = list(zip(nombres, valores))
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ""
+    contenido = ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in pares)
+    return "{" + contenido + "}"
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def encabezado(self):
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, *etiquetas, valor=1):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def exponer(self):
+        lineas = self.encabezado()
+        with self._lock:
+            for etiquetas, valor in self._valores.items():
+                lineas.append(f"{self.nombre}{_formatear_etiquetas(self.etiquetas, etiquetas)} {valor}")
+        return lineas
+
+
+class Medidor(_Metrica):
+    tipo = "gauge"
+
+    def inc(self, *etiquetas, valor=1):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def dec(self, *etiquetas, valor=1):
+        self.inc(*etiquetas, valor=-valor)
+
+    def exponer(self):
+        return Contador.exponer(self)
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(buckets)
+
+    def observar(self, valor, *etiquetas):
+        with self._lock:
+            serie = self._valores.get(etiquetas)
+            if serie is None:
+                serie = self._valores[etiquetas] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    def exponer(self):
+        lineas = self.encabezado()
+        with self._lock:
+            for etiquetas, (conteos, suma, total) in self._valores.items():
+                acumulado = 0
+                for limite, conteo in zip(self.buckets, conteos):
+                    acumulado += conteo
+                    lineas.append(
+                        f"{self.nombre}_bucket{_formatear_etiquetas(self.etiquetas, etiquetas, ('le', limite))} {acumulado}"
+                    )
+                lineas.append(f"{self.nombre}_bucket{_formatear_etiquetas(self.etiquetas, etiquetas, ('le', '+Inf'))} {total}")
+                lineas.append(f"{self.nombre}_sum{_formatear_etiquetas(self.etiquetas, etiquetas)} {suma}")
+                lineas.append(f"{self.nombre}_count{_formatear_etiquetas(self.etiquetas, etiquetas)} {total}")
+        return lineas
+
+
+# 🔹 Métricas HTTP por ruta
+peticiones_duracion = Histograma(
+    "autogestion_http_duracion_segundos", "Latencia de las peticiones HTTP por ruta.", ("ruta", "metodo")
+)
+peticiones_total = Contador(
+    "autogestion_http_peticiones_total", "Peticiones HTTP por ruta y código de estado.", ("ruta", "metodo", "codigo")
+)
+peticiones_en_curso = Medidor(
+    "autogestion_http_en_curso", "Peticiones HTTP en curso por ruta.", ("ruta",)
+)
+
+# 🔹 Métricas por dependencia externa
+dependencia_duracion = Histograma(
+    "autogestion_dependencia_duracion_segundos", "Latencia de las llamadas a dependencias externas.", ("dependencia",)
+)
+dependencia_errores = Contador(
+    "autogestion_dependencia_errores_total", "Llamadas a dependencias externas que fallaron.", ("dependencia",)
+)
+dependencia_en_curso = Medidor(
+    "autogestion_dependencia_en_curso", "Llamadas a dependencias externas en curso.", ("dependencia",)
+)
+
+_metricas = [
+    peticiones_duracion, peticiones_total, peticiones_en_curso,
+    dependencia_duracion, dependencia_errores, dependencia_en_curso,
+]
+_colectores = {}
+
+
+@contextmanager
+def medir_dependencia(dependencia):
+    """Mide el bloque como una llamada a `dependencia` (latencia, errores y en curso)."""
+    dependencia_en_curso.inc(dependencia)
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        dependencia_errores.inc(dependencia)
+        raise
+    finally:
+        dependencia_duracion.observar(time.perf_counter() - inicio, dependencia)
+        dependencia_en_curso.dec(dependencia)
+
+
+def instrumentar_dependencia(dependencia, es_error=None):
+    """
+    Decorador equivalente a `medir_dependencia`. `es_error(resultado)` permite
+    contar como error las funciones que informan fallos devolviendo un valor
+    (p. ej. None) en lugar de lanzar una excepción.
+    """
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with medir_dependencia(dependencia):
+                resultado = funcion(*args, **kwargs)
+            if es_error is not None and es_error(resultado):
+                dependencia_errores.inc(dependencia)
+            return resultado
+        return envoltura
+    return decorador
+
+
+def registrar_colector(componente, funcion):
+    """Expone como gauges el dict que devuelve `funcion()` (p. ej. `pool_db.metricas`)."""
+    _colectores[componente] = funcion
+
+
+def exponer():
+    lineas = []
+    for metrica in _metricas:
+        lineas.extend(metrica.exponer())
+
+    lineas.append("# HELP autogestion_componente Estadísticas internas de cachés, pools y colas.")
+    lineas.append("# TYPE autogestion_componente gauge")
+    for componente, funcion in _colectores.items():
+        try:
+            valores = funcion() or {}
+        except Exception as e:
+            logger.warning(f"⚠️ Error leyendo métricas de {componente}: {e}")
+            continue
+        for nombre, valor in valores.items():
+            if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+                continue
+            etiquetas = _formatear_etiquetas(("componente", "metrica"), (componente, nombre))
+            lineas.append(f"autogestion_componente{etiquetas} {valor}")
+    return "\n".join(lineas) + "\n"
+
+
+def configurar_metricas(app, ruta="/metrics"):
+    """Registra los hooks que miden cada petición y el endpoint en formato Prometheus."""
+    from flask import g, request, Response, jsonify
+
+    token_metricas = os.getenv("METRICS_TOKEN")
+    if not token_metricas:
+        logger.warning(f"⚠️ METRICS_TOKEN no configurado: {ruta} queda abierto a cualquiera que llegue al servicio.")
+
+    def _ruta():
+        return request.url_rule.rule if request.url_rule else "sin_ruta"
+
+    @app.before_request
+    def _inicio_peticion():
+        g._metricas_inicio = time.perf_counter()
+        g._metricas_ruta = _ruta()
+        peticiones_en_curso.inc(g._metricas_ruta)
+
+    @app.after_request
+    def _estado_peticion(respuesta):
+        g._metricas_codigo = respuesta.status_code
+        return respuesta
+
+    @app.teardown_request
+    def _fin_peticion(_error=None):
+        inicio = g.pop("_metricas_inicio", None)
+        if inicio is None:
+            return
+        ruta = g.pop("_metricas_ruta")
+        codigo = g.pop("_metricas_codigo", 500)
+        peticiones_duracion.observar(time.perf_counter() - inicio, ruta, request.method)
+        peticiones_total.inc(ruta, request.method, codigo)
+        peticiones_en_curso.dec(ruta)
+
+    @app.route(ruta)
+    def metrics():
+        if token_metricas and not comparar_tokens(request.headers.get("Authorization", ""), f"Bearer {token_metricas}"):
+            return jsonify({"error": "No autorizado"}), 401
+        return Response(exponer(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,6 @@
+-- Índices para el listado paginado de /admin (keyset sobre fecha, id)
+-- y sus filtros por estado y correo.
+
+CREATE INDEX idx_solicitudes_fecha_id ON solicitudes (fecha, id);
+CREATE INDEX idx_solicitudes_estado_fecha_id ON solicitudes (estado, fecha, id);
+CREATE INDEX idx_solicitudes_correo_fecha_id ON solicitudes (correo, fecha, id);
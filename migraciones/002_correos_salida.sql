@@ -0,0 +1,21 @@
+-- Bandeja de salida de correos de aprobación y rechazo.
+-- /aceptar y /rechazar insertan aquí en la misma transacción que el cambio
+-- de estado; el remitente en segundo plano la vacía y registra el resultado.
+
+CREATE TABLE correos_salida (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    solicitud_id INT NULL,
+    destinatario VARCHAR(255) NOT NULL,
+    asunto VARCHAR(255) NOT NULL,
+    mensaje_html MEDIUMTEXT NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+    intentos INT NOT NULL DEFAULT 0,
+    proximo_intento DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    reclamado_por CHAR(32) NULL,
+    ultimo_error TEXT NULL,
+    creado DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    enviado_en DATETIME NULL,
+    INDEX idx_correos_salida_pendientes (estado, proximo_intento, id),
+    INDEX idx_correos_salida_reclamo (reclamado_por),
+    INDEX idx_correos_salida_solicitud (solicitud_id)
+);
@@ -0,0 +1,8 @@
+-- Marca de última modificación de cada solicitud. Se usa como versión barata
+-- para los ETag de /admin y /detalle (MAX(actualizado) se resuelve con el índice).
+
+ALTER TABLE solicitudes
+    ADD COLUMN actualizado TIMESTAMP(6) NOT NULL
+        DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6);
+
+CREATE INDEX idx_solicitudes_actualizado ON solicitudes (actualizado);
@@ -0,0 +1,4 @@
+-- Índice para que reprocesar.py recorra los archivos de un tipo de documento
+-- por lotes (keyset sobre id) sin escanear la tabla completa.
+
+CREATE INDEX idx_archivos_tipo_id ON archivos (tipo, id);
@@ -0,0 +1,12 @@
+-- Eventos del panel de administración para EVENTOS_BACKEND=mysql.
+-- Cada réplica inserta aquí los cambios de solicitudes y las demás los leen
+-- por id para enviarlos por SSE; el id es el Last-Event-ID del navegador.
+-- Las filas se purgan al pasar la retención (24 h por defecto).
+
+CREATE TABLE eventos_admin (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    tipo VARCHAR(40) NOT NULL,
+    datos JSON NOT NULL,
+    creado DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_eventos_admin_creado (creado)
+);
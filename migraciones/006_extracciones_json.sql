@@ -0,0 +1,25 @@
+-- Datos extraídos compactos: una fila por (solicitud, tipo_documento) con los
+-- campos en una columna JSON y la confianza numérica, en lugar de una fila por
+-- campo en datos_extraidos. Con DATOS_EXTRAIDOS_FORMATO=json la app escribe
+-- aquí y migrar_extracciones.py convierte las filas antiguas por lotes.
+--
+-- campos: {"campo": {"valor": "...", "confianza": 97.5, "propiedades": {...}}}
+--
+-- Los campos que se buscan por valor se exponen como columnas generadas
+-- (VIRTUAL: no ocupan espacio en la fila) con índice secundario. Para buscar
+-- otro campo se agrega una columna con el mismo patrón; el nombre dentro del
+-- JSON es el tipo de entidad del procesador de Document AI.
+
+CREATE TABLE extracciones (
+    solicitud_id INT NOT NULL,
+    tipo_documento VARCHAR(50) NOT NULL,
+    campos JSON NOT NULL,
+    error TEXT NULL,
+    numero_identificacion VARCHAR(64)
+        AS (LEFT(campos->>'$.numero_identificacion.valor', 64)) VIRTUAL,
+    nit VARCHAR(64)
+        AS (LEFT(campos->>'$.nit.valor', 64)) VIRTUAL,
+    PRIMARY KEY (solicitud_id, tipo_documento),
+    INDEX idx_extracciones_numero_identificacion (numero_identificacion),
+    INDEX idx_extracciones_nit (nit)
+);
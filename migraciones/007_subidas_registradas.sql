@@ -0,0 +1,13 @@
+-- Registro único de las subidas en dos pasos (/subir/finalizar y
+-- /subir/fragmentos/<sesion>/completar). `clave` es el id del ticket o de la
+-- sesión: la primera petición la reserva y guarda el resultado; un reintento o
+-- una repetición del ticket devuelve ese resultado en vez de crear otra solicitud.
+-- Las filas se purgan pasada la vigencia de tickets y sesiones (7 días por defecto).
+
+CREATE TABLE subidas_registradas (
+    clave VARCHAR(64) PRIMARY KEY,
+    solicitud_id INT NULL,
+    resultado JSON NULL,
+    creado DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_subidas_registradas_creado (creado)
+);
@@ -0,0 +1,165 @@
+"""
+Convierte las filas de `datos_extraidos` (una por campo) a la tabla
+`extracciones` (una por solicitud y tipo de documento, campos en JSON y
+confianza numérica; migración 006).
+
+Recorre las solicitudes por lotes en orden de id (keyset), así que la memoria
+y cada transacción quedan acotadas por `--lote`. Cada lote inserta los
+documentos convertidos y borra sus filas antiguas en la misma transacción:
+si el comando se interrumpe, al volver a ejecutarlo sigue con lo que queda.
+Si un documento ya existe en `extracciones` se sobrescribe: la app y el
+reproceso borran las filas de ambas tablas al escribir, así que cuando quedan
+filas antiguas son la versión vigente (la copia en JSON es la de una ejecución
+anterior con --conservar).
+
+Antes de migrar, la app debe escribir y leer en el formato nuevo
+(DATOS_EXTRAIDOS_FORMATO=json): solo entonces /detalle lee ambas tablas. Por
+eso las filas antiguas solo se borran si este comando corre también con
+DATOS_EXTRAIDOS_FORMATO=json; si no, se copian y se conservan (--conservar), y
+una ejecución posterior en modo json las borra.
+
+    python migrar_extracciones.py --lote 500 --pausa 0.2
+"""
+import json
+import time
+import logging
+import argparse
+
+from db import conexion_db
+from persistencia import filas_extracciones, FORMATO_DATOS
+
+logger = logging.getLogger(__name__)
+
+LOTE_POR_DEFECTO = 500
+
+
+def campos_desde_filas(filas):
+    """
+    Reconstruye {tipo_documento: {campo: {valor, confianza[, propiedades]}}} a
+    partir de filas (tipo_documento, campo, valor, confianza) de una solicitud.
+    Los campos "padre.hija" vuelven a anidarse bajo su padre si está presente.
+    """
+    documentos = {}
+    for tipo_doc, campo, valor, confianza in filas:
+        datos = documentos.setdefault(tipo_doc, {})
+        if campo == "error":
+            datos.clear()
+            datos["error"] = valor
+            continue
+        if "error" in datos:
+            continue
+        partes = campo.split(".")
+        nodo = datos
+        while len(partes) > 1 and partes[0] in nodo:
+            nodo = nodo[partes.pop(0)].setdefault("propiedades", {})
+        nodo[".".join(partes)] = {"valor": valor or "", "confianza": confianza}
+    return documentos
+
+
+def migrar(obtener_conexion=conexion_db, lote=LOTE_POR_DEFECTO, desde_id=0, maximo=None, pausa=0.0, conservar=False):
+    """
+    Migra los datos extraídos de las solicitudes con id mayor que `desde_id`.
+    `maximo` limita las solicitudes de esta ejecución; `pausa` espera entre
+    lotes para no saturar la réplica; con `conservar` no se borran las filas
+    antiguas, lo que se fuerza si FORMATO_DATOS no es json. Devuelve un resumen.
+    """
+    if FORMATO_DATOS != "json" and not conservar:
+        # Los pods en modo eav no leen `extracciones`: borrar dejaría /detalle sin datos extraídos
+        logger.warning("⚠️ DATOS_EXTRAIDOS_FORMATO no es json: se copian los datos pero se conservan las filas antiguas.")
+        conservar = True
+
+    resumen = {
+        "solicitudes": 0, "documentos": 0, "reemplazados": 0, "filas_antiguas": 0, "ultimo_id": desde_id,
+        "filas_antiguas_borradas": not conservar,
+    }
+    ultimo = desde_id
+    while maximo is None or resumen["solicitudes"] < maximo:
+        tamano = lote if maximo is None else min(lote, maximo - resumen["solicitudes"])
+        inicio = time.monotonic()
+        with obtener_conexion() as conn:
+            if not conn:
+                raise RuntimeError("Error al conectar a la base de datos")
+            conn.start_transaction()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT DISTINCT solicitud_id FROM datos_extraidos WHERE solicitud_id > %s "
+                    "ORDER BY solicitud_id LIMIT %s",
+                    (ultimo, tamano)
+                )
+                ids = [fila[0] for fila in cursor.fetchall()]
+                if not ids:
+                    conn.commit()
+                    break
+                rango = (ids[0], ids[-1])
+
+                cursor.execute(
+                    "SELECT solicitud_id, tipo_documento, campo, valor, confianza FROM datos_extraidos "
+                    "WHERE solicitud_id BETWEEN %s AND %s ORDER BY solicitud_id, id",
+                    rango
+                )
+                por_solicitud = {}
+                filas_antiguas = 0
+                for solicitud_id, tipo_doc, campo, valor, confianza in cursor.fetchall():
+                    por_solicitud.setdefault(solicitud_id, []).append((tipo_doc, campo, valor, confianza))
+                    filas_antiguas += 1
+
+                filas = [
+                    fila
+                    for solicitud_id, filas_solicitud in por_solicitud.items()
+                    for fila in filas_extracciones(solicitud_id, campos_desde_filas(filas_solicitud))
+                ]
+                reemplazados = 0
+                if filas:
+                    cursor.execute(
+                        "DELETE FROM extracciones WHERE (solicitud_id, tipo_documento) IN ("
+                        + ", ".join(["(%s, %s)"] * len(filas)) + ")",
+                        [valor for fila in filas for valor in fila[:2]]
+                    )
+                    reemplazados = cursor.rowcount
+                    cursor.executemany(
+                        "INSERT INTO extracciones (solicitud_id, tipo_documento, campos, error) VALUES (%s, %s, %s, %s)",
+                        filas
+                    )
+                if not conservar:
+                    cursor.execute("DELETE FROM datos_extraidos WHERE solicitud_id BETWEEN %s AND %s", rango)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logger.error(f"❌ Error migrando las solicitudes posteriores a {ultimo}; se hizo rollback.")
+                raise
+
+        ultimo = ids[-1]
+        resumen["solicitudes"] += len(ids)
+        resumen["documentos"] += len(filas)
+        resumen["reemplazados"] += reemplazados
+        resumen["filas_antiguas"] += filas_antiguas
+        resumen["ultimo_id"] = ultimo
+        logger.info(
+            f"📦 Lote hasta la solicitud {ultimo}: {filas_antiguas} filas -> {len(filas)} documentos "
+            f"en {(time.monotonic() - inicio) * 1000:.0f} ms (total {resumen['solicitudes']} solicitudes)"
+        )
+        if pausa:
+            time.sleep(pausa)
+
+    return resumen
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lote", type=int, default=LOTE_POR_DEFECTO, help="solicitudes por transacción")
+    parser.add_argument("--desde-id", type=int, default=0, help="empezar después de esta solicitud")
+    parser.add_argument("--maximo", type=int, help="detenerse tras esta cantidad de solicitudes")
+    parser.add_argument("--pausa", type=float, default=0.0, help="segundos de espera entre lotes")
+    parser.add_argument("--conservar", action="store_true", help="no borrar las filas de datos_extraidos")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    resumen = migrar(
+        lote=args.lote, desde_id=args.desde_id, maximo=args.maximo, pausa=args.pausa, conservar=args.conservar
+    )
+    print(json.dumps(resumen, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import io
+import os
+import re
+import random
+import logging
+import threading
+from functools import lru_cache
+
+from cargas import DocumentoCargado, DocumentoGCS
+
+logger = logging.getLogger(__name__)
+
+# Formatos de imagen que se reescalan (GIF y TIFF pueden tener varios cuadros/páginas)
+IMAGENES_REESCALABLES = {"image/jpeg", "image/png", "image/bmp", "image/webp"}
+
+
+@lru_cache(maxsize=None)
+def _pillow():
+    # Pillow y pypdf son opcionales y se importan en el primer uso (no en el arranque)
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        logger.warning("⚠️ Pillow no está instalado: las imágenes se enviarán sin reescalar.")
+        return None
+    return Image, ImageOps
+
+
+@lru_cache(maxsize=None)
+def _pypdf():
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        logger.warning("⚠️ pypdf no está instalado: los PDF se enviarán completos.")
+        return None
+    return PdfReader, PdfWriter
+
+
+def leer_rango_paginas(texto):
+    """'1-3' -> (1, 3); '2' -> (2, 2); vacío -> None. Páginas numeradas desde 1."""
+    if not texto:
+        return None
+    coincidencia = re.fullmatch(r"\s*(\d+)\s*(?:-\s*(\d+)\s*)?", texto)
+    if not coincidencia:
+        raise ValueError(f"Rango de páginas inválido: {texto!r}")
+    inicio = int(coincidencia.group(1))
+    fin = int(coincidencia.group(2) or inicio)
+    if inicio < 1 or fin < inicio:
+        raise ValueError(f"Rango de páginas inválido: {texto!r}")
+    return inicio, fin
+
+
+def confianza_media(campos):
+    """Promedio de las confianzas ("93.5%") de un resultado de extracción, o None."""
+    valores = []
+    for detalle in campos.values():
+        if isinstance(detalle, dict):
+            try:
+                valores.append(float(str(detalle.get("confianza", "")).rstrip("%")))
+            except ValueError:
+                pass
+    return round(sum(valores) / len(valores), 2) if valores else None
+
+
+class OptimizadorDocumentos:
+    """
+    Prepara cada documento antes de enviarlo a Document AI.
+
+    - Imágenes: corrige la orientación EXIF, reduce el lado mayor a
+      `lado_maximo` px y recomprime en JPEG con `calidad`.
+    - PDF: conserva solo el rango de páginas configurado para su tipo
+      (`rangos_paginas`, p. ej. {"camara_comercio": (1, 4)}).
+    - Documentos en GCS: no se descargan; se pide a Document AI que procese
+      solo ese rango o, sin rango, las primeras `paginas_maximas` páginas
+      (el límite del procesamiento en línea).
+
+    Si una imagen recomprimida no pesa menos se envía la original. El original
+    se archiva en GCS sin cambios. Con `tasa_comparacion` > 0 una fracción de los
+    documentos optimizados se extrae también en su versión original para
+    comparar la confianza obtenida.
+    """
+
+    def __init__(self, lado_maximo=2000, calidad=85, rangos_paginas=None, tasa_comparacion=0.0, activo=True,
+                 paginas_maximas=15):
+        self.lado_maximo = lado_maximo
+        self.calidad = calidad
+        self.rangos_paginas = rangos_paginas or {}
+        self.paginas_maximas = paginas_maximas
+        self.tasa_comparacion = tasa_comparacion
+        self.activo = activo
+
+        self._lock = threading.Lock()
+        self._totales = {
+            "documentos": 0, "optimizados": 0,
+            "bytes_originales": 0, "bytes_enviados": 0,
+            "paginas_originales": 0, "paginas_enviadas": 0,
+            "comparaciones": 0, "confianza_original_suma": 0.0, "confianza_optimizada_suma": 0.0,
+        }
+
+    def optimizar(self, documento, tipo):
+        """Devuelve (documento a enviar, reporte). El documento puede ser el mismo original."""
+        reporte = {
+            "accion": "ninguna",
+            "bytes_originales": documento.tamano,
+            "bytes_enviados": documento.tamano,
+            "paginas_originales": None,
+            "paginas_enviadas": None,
+        }
+        enviado = documento
+        # Los documentos de la subida directa los lee Document AI del bucket: no se descargan
+        if isinstance(documento, DocumentoGCS):
+            if documento.mime_type in ("application/pdf", "image/tiff", "image/gif"):
+                enviado = self._seleccionar_paginas(documento, tipo, reporte)
+        elif self.activo:
+            try:
+                if documento.mime_type == "application/pdf":
+                    enviado = self._recortar_pdf(documento, tipo, reporte)
+                elif documento.mime_type in IMAGENES_REESCALABLES:
+                    enviado = self._reescalar_imagen(documento, reporte)
+            except Exception as e:
+                # Un archivo que no se puede optimizar se envía tal cual
+                logger.warning(f"⚠️ No se pudo optimizar {documento.nombre}: {e}")
+                enviado = documento
+                reporte.update(accion="error", bytes_enviados=documento.tamano,
+                               paginas_enviadas=reporte["paginas_originales"])
+
+        with self._lock:
+            t = self._totales
+            t["documentos"] += 1
+            t["optimizados"] += enviado is not documento
+            t["bytes_originales"] += reporte["bytes_originales"]
+            t["bytes_enviados"] += reporte["bytes_enviados"]
+            # Las páginas de un documento en GCS no se conocen: no cuentan en el ahorro de páginas
+            if not isinstance(documento, DocumentoGCS):
+                t["paginas_originales"] += reporte["paginas_originales"] or 1
+                t["paginas_enviadas"] += reporte["paginas_enviadas"] or 1
+        return enviado, reporte
+
+    def _recortar_pdf(self, documento, tipo, reporte):
+        pypdf = _pypdf()
+        if pypdf is None:
+            return documento
+        PdfReader, PdfWriter = pypdf
+        # pypdf lee las páginas bajo demanda: el archivo sigue abierto hasta escribir la copia
+        with documento.abrir() as archivo:
+            lector = PdfReader(archivo)
+            total = len(lector.pages)
+            reporte["paginas_originales"] = reporte["paginas_enviadas"] = total
+
+            rango = self.rangos_paginas.get(tipo)
+            if not rango or (rango[0] == 1 and rango[1] >= total):
+                return documento
+
+            inicio, fin = rango[0], min(rango[1], total)
+            if inicio > total:
+                # El documento es más corto que el rango: se envía completo
+                return documento
+            escritor = PdfWriter()
+            for indice in range(inicio - 1, fin):
+                escritor.add_page(lector.pages[indice])
+            salida = io.BytesIO()
+            escritor.write(salida)
+            contenido = salida.getvalue()
+
+        # Se envía aunque no pese menos: Document AI cobra y tarda por página
+        reporte.update(accion=f"paginas {inicio}-{fin}", paginas_enviadas=fin - inicio + 1, bytes_enviados=len(contenido))
+        return DocumentoCargado(documento.nombre, "application/pdf", len(contenido), contenido=contenido)
+
+    def _seleccionar_paginas(self, documento, tipo, reporte):
+        # Se aplica aunque la optimización esté desactivada: sin ella Document AI rechaza los documentos largos
+        rango = (self.activo and self.rangos_paginas.get(tipo)) or (1, self.paginas_maximas)
+        reporte["accion"] = f"paginas {rango[0]}-{rango[1]} (gcs)"
+        return documento.con_paginas(rango)
+
+    def _reescalar_imagen(self, documento, reporte):
+        reporte["paginas_originales"] = reporte["paginas_enviadas"] = 1
+        pillow = _pillow()
+        if pillow is None:
+            return documento
+        Image, ImageOps = pillow
+
+        with documento.abrir() as archivo, Image.open(archivo) as imagen:
+            imagen = ImageOps.exif_transpose(imagen)
+            if max(imagen.size) <= self.lado_maximo and documento.mime_type == "image/jpeg":
+                return documento
+            imagen.thumbnail((self.lado_maximo, self.lado_maximo), Image.LANCZOS)
+            if imagen.mode not in ("RGB", "L"):
+                # JPEG no admite transparencia: se aplana sobre fondo blanco
+                imagen = imagen.convert("RGBA")
+                fondo = Image.new("RGB", imagen.size, "white")
+                fondo.paste(imagen, mask=imagen.getchannel("A"))
+                imagen = fondo
+            salida = io.BytesIO()
+            imagen.save(salida, "JPEG", quality=self.calidad, optimize=True)
+            contenido = salida.getvalue()
+
+        if len(contenido) >= documento.tamano:
+            return documento
+        reporte.update(accion=f"imagen {imagen.size[0]}x{imagen.size[1]}", bytes_enviados=len(contenido))
+        nombre = os.path.splitext(documento.nombre or "imagen")[0] + ".jpg"
+        return DocumentoCargado(nombre, "image/jpeg", len(contenido), contenido=contenido)
+
+    def debe_comparar(self, original, enviado):
+        # Un documento en GCS completo puede superar el límite de páginas en línea: no se compara
+        if enviado is original or isinstance(original, DocumentoGCS):
+            return False
+        return self.tasa_comparacion > 0 and random.random() < self.tasa_comparacion
+
+    def registrar_extraccion(self, reporte, campos):
+        reporte["confianza_media"] = confianza_media(campos)
+
+    def registrar_comparacion(self, reporte, campos_originales):
+        """Guarda en el reporte la confianza que dio el original frente a la del optimizado."""
+        original = confianza_media(campos_originales)
+        reporte["confianza_media_original"] = original
+        optimizada = reporte.get("confianza_media")
+        if original is None or optimizada is None:
+            return
+        with self._lock:
+            self._totales["comparaciones"] += 1
+            self._totales["confianza_original_suma"] += original
+            self._totales["confianza_optimizada_suma"] += optimizada
+        logger.info(f"🔬 Comparación de optimización: confianza original {original}% vs optimizada {optimizada}%")
+
+    def metricas(self):
+        with self._lock:
+            t = dict(self._totales)
+        comparaciones = t.pop("comparaciones")
+        original = t.pop("confianza_original_suma")
+        optimizada = t.pop("confianza_optimizada_suma")
+        t["comparaciones"] = comparaciones
+        t["confianza_original_media"] = round(original / comparaciones, 2) if comparaciones else 0.0
+        t["confianza_optimizada_media"] = round(optimizada / comparaciones, 2) if comparaciones else 0.0
+        t["ahorro_bytes_ratio"] = round(1 - t["bytes_enviados"] / t["bytes_originales"], 3) if t["bytes_originales"] else 0.0
+        t["ahorro_paginas_ratio"] = round(1 - t["paginas_enviadas"] / t["paginas_originales"], 3) if t["paginas_originales"] else 0.0
+        return t
+
+
+def crear_optimizador():
+    """
+    Optimizador configurado por entorno:
+    OPTIMIZACION_DESACTIVADA=1, IMAGEN_LADO_MAXIMO, IMAGEN_CALIDAD_JPEG,
+    PAGINAS_DOC_IDENTIDAD / PAGINAS_RUT / PAGINAS_CAMARA_COMERCIO (p. ej. "1-4"),
+    OPTIMIZACION_TASA_COMPARACION (fracción 0..1) y DOCUMENTAI_PAGINAS_MAXIMAS.
+    """
+    rangos = {}
+    for tipo in ("doc_identidad", "rut", "camara_comercio"):
+        rango = leer_rango_paginas(os.getenv(f"PAGINAS_{tipo.upper()}"))
+        if rango:
+            rangos[tipo] = rango
+    return OptimizadorDocumentos(
+        lado_maximo=int(os.getenv("IMAGEN_LADO_MAXIMO", "2000")),
+        calidad=int(os.getenv("IMAGEN_CALIDAD_JPEG", "85")),
+        rangos_paginas=rangos,
+        tasa_comparacion=float(os.getenv("OPTIMIZACION_TASA_COMPARACION", "0")),
+        activo=os.getenv("OPTIMIZACION_DESACTIVADA", "0") != "1",
+        paginas_maximas=int(os.getenv("DOCUMENTAI_PAGINAS_MAXIMAS", "15")),
+    )
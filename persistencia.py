@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import logging
+from datetime import datetime, timedelta
+
+from entidades import aplanar_campos
+
+logger = logging.getLogger(__name__)
+
+# Formato de los datos extraídos al escribir:
+# - "eav": una fila por campo en `datos_extraidos` (confianza como texto "97.5%").
+# - "json": una fila por (solicitud, tipo_documento) en `extracciones` (migración
+#   006) con los campos en una columna JSON y la confianza numérica.
+# /detalle lee ambos mientras migrar_extracciones.py convierte las filas antiguas.
+FORMATO_DATOS = os.getenv("DATOS_EXTRAIDOS_FORMATO", "eav")
+FORMATOS_DATOS = ("eav", "json")
+if FORMATO_DATOS not in FORMATOS_DATOS:
+    raise ValueError(f"DATOS_EXTRAIDOS_FORMATO desconocido: {FORMATO_DATOS}")
+
+
+def filas_datos_extraidos(solicitud_id, extracciones):
+    """
+    Aplana {tipo_documento: {campo: {valor, confianza}}} en filas para datos_extraidos.
+    Las propiedades anidadas de un campo se guardan como "campo.propiedad".
+    """
+    filas = []
+    for tipo_doc, datos in extracciones.items():
+        for campo, detalle in aplanar_campos(datos):
+            if campo == "error":
+                # Error de extracción: se guarda para que el revisor lo vea en /detalle
+                detalle = {"valor": detalle, "confianza": ""}
+            filas.append((solicitud_id, tipo_doc, campo, detalle.get("valor", ""), detalle.get("confianza", "")))
+    return filas
+
+
+def confianza_numerica(confianza):
+    """'97.5%' -> 97.5; vacío o ilegible -> None."""
+    if isinstance(confianza, (int, float)):
+        return float(confianza)
+    try:
+        return float(str(confianza).strip().rstrip("%"))
+    except ValueError:
+        return None
+
+
+def campos_compactos(campos):
+    """{campo: {valor, confianza[, propiedades]}} con la confianza numérica y las propiedades anidadas."""
+    compactos = {}
+    for nombre, detalle in campos.items():
+        campo = {"valor": detalle.get("valor", ""), "confianza": confianza_numerica(detalle.get("confianza"))}
+        if detalle.get("propiedades"):
+            campo["propiedades"] = campos_compactos(detalle["propiedades"])
+        compactos[nombre] = campo
+    return compactos
+
+
+def filas_extracciones(solicitud_id, extracciones):
+    """
+    Una fila (solicitud_id, tipo_documento, campos_json, error) por documento
+    para la tabla `extracciones`. Un documento con error guarda `{}` y el mensaje.
+    """
+    filas = []
+    for tipo_doc, datos in extracciones.items():
+        if "error" in datos:
+            filas.append((solicitud_id, tipo_doc, "{}", str(datos["error"])))
+            continue
+        campos = json.dumps(campos_compactos(datos), ensure_ascii=False, separators=(",", ":"))
+        filas.append((solicitud_id, tipo_doc, campos, None))
+    return filas
+
+
+def _insertar_datos(cursor, extracciones_por_solicitud, formato):
+    """Inserta los datos extraídos en el formato indicado y devuelve cuántas filas escribió."""
+    filas = []
+    if formato == "json":
+        for solicitud_id, extracciones in extracciones_por_solicitud.items():
+            filas.extend(filas_extracciones(solicitud_id, extracciones))
+        if filas:
+            cursor.executemany(
+                "INSERT INTO extracciones (solicitud_id, tipo_documento, campos, error) VALUES (%s, %s, %s, %s)",
+                filas
+            )
+        return len(filas)
+
+    for solicitud_id, extracciones in extracciones_por_solicitud.items():
+        filas.extend(filas_datos_extraidos(solicitud_id, extracciones))
+    if filas:
+        cursor.executemany(
+            "INSERT INTO datos_extraidos (solicitud_id, tipo_documento, campo, valor, confianza) VALUES (%s, %s, %s, %s, %s)",
+            filas
+        )
+    return len(filas)
+
+
+def guardar_solicitud(conn, usuario_id, correo, fecha, archivos, extracciones, formato=None):
+    """
+    Registra una solicitud con sus archivos y datos extraídos en una sola transacción.
+
+    `archivos` es una lista de (tipo, nombre_archivo, ruta_archivo). Las filas de
+    `archivos` y de los datos extraídos (en `formato`, FORMATO_DATOS por defecto)
+    se insertan con `executemany`, que el conector convierte en un único INSERT
+    de varias filas. Si algo falla se hace rollback y se relanza la excepción.
+
+    Devuelve (solicitud_id, metricas).
+    """
+    formato = formato or FORMATO_DATOS
+    inicio = time.monotonic()
+    conn.start_transaction()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO solicitudes (usuario_id, fecha, estado, correo) VALUES (%s, %s, %s, %s)",
+            (usuario_id, fecha, 'sin revisar', correo)
+        )
+        solicitud_id = cursor.lastrowid
+
+        filas_archivos = [(solicitud_id, tipo, nombre, ruta) for tipo, nombre, ruta in archivos]
+        if filas_archivos:
+            cursor.executemany(
+                "INSERT INTO archivos (solicitud_id, tipo, nombre_archivo, ruta_archivo) VALUES (%s, %s, %s, %s)",
+                filas_archivos
+            )
+
+        filas_datos = _insertar_datos(cursor, {solicitud_id: extracciones}, formato)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        logger.error("❌ Error guardando la solicitud; se hizo rollback.")
+        raise
+
+    metricas = {
+        "filas": 1 + len(filas_archivos) + filas_datos,
+        "filas_archivos": len(filas_archivos),
+        "filas_datos_extraidos": filas_datos,
+        "formato_datos": formato,
+        "duracion_ms": round((time.monotonic() - inicio) * 1000, 1),
+    }
+    logger.info(f"💾 Solicitud {solicitud_id} guardada: {metricas}")
+    return solicitud_id, metricas
+
+
+def reemplazar_datos_extraidos(conn, extracciones_por_solicitud, formato=None):
+    """
+    Reemplaza en bloque los datos extraídos de varias solicitudes (reproceso).
+
+    `extracciones_por_solicitud` es {solicitud_id: {tipo_documento: {campo: {valor, confianza}}}}.
+    Solo se tocan los tipos de documento presentes: se borran sus filas de ambas
+    tablas (para no dejar una copia vieja en el otro formato, p. ej. la que deja
+    la migración con --conservar) y se insertan las nuevas con `executemany`. También se marca
+    `solicitudes.actualizado` para que los ETag de /admin y /detalle cambien.
+    Todo ocurre en una transacción; si algo falla se hace rollback y se relanza.
+    """
+    formato = formato or FORMATO_DATOS
+    claves = [
+        (solicitud_id, tipo_doc)
+        for solicitud_id, extracciones in extracciones_por_solicitud.items()
+        for tipo_doc in extracciones
+    ]
+    if not claves:
+        return {"documentos": 0, "filas_datos_extraidos": 0, "duracion_ms": 0.0}
+
+    inicio = time.monotonic()
+    ids = list(extracciones_por_solicitud)
+    condicion = "(solicitud_id, tipo_documento) IN (" + ", ".join(["(%s, %s)"] * len(claves)) + ")"
+    valores_claves = [valor for clave in claves for valor in clave]
+
+    conn.start_transaction()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"DELETE FROM datos_extraidos WHERE {condicion}", valores_claves)
+        cursor.execute(f"DELETE FROM extracciones WHERE {condicion}", valores_claves)
+        filas_datos = _insertar_datos(cursor, extracciones_por_solicitud, formato)
+        cursor.execute(
+            "UPDATE solicitudes SET actualizado = CURRENT_TIMESTAMP(6) WHERE id IN ("
+            + ", ".join(["%s"] * len(ids)) + ")",
+            ids
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        logger.error("❌ Error reemplazando datos extraídos; se hizo rollback.")
+        raise
+
+    return {
+        "documentos": len(claves),
+        "filas_datos_extraidos": filas_datos,
+        "duracion_ms": round((time.monotonic() - inicio) * 1000, 1),
+    }
+
+
+def _fecha_db(momento):
+    return momento.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def reservar_subida(conn, clave, vencimiento):
+    """
+    Reserva `clave` (id del ticket o de la sesión de fragmentos) antes de
+    registrar su solicitud (migración 007). Devuelve (reservada, resultado):
+    (True, None) si esta petición debe registrarla, (False, dict) con el
+    resultado guardado si ya se registró y (False, None) si otra petición la
+    está registrando. Una reserva sin resultado de hace más de `vencimiento`
+    segundos (el proceso que la tomó murió) se vuelve a tomar.
+    """
+    import mysql.connector
+    ahora = datetime.now()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO subidas_registradas (clave, creado) VALUES (%s, %s)", (clave, _fecha_db(ahora)))
+        conn.commit()
+        return True, None
+    except mysql.connector.IntegrityError:
+        conn.rollback()
+
+    cursor.execute("SELECT resultado FROM subidas_registradas WHERE clave = %s", (clave,))
+    fila = cursor.fetchone()
+    if fila and fila[0]:
+        return False, json.loads(fila[0])
+    cursor.execute(
+        "UPDATE subidas_registradas SET creado = %s WHERE clave = %s AND resultado IS NULL AND creado < %s",
+        (_fecha_db(ahora), clave, _fecha_db(ahora - timedelta(seconds=vencimiento)))
+    )
+    conn.commit()
+    return cursor.rowcount == 1, None
+
+
+def confirmar_subida(conn, clave, solicitud_id, resultado):
+    """Guarda el resultado de la solicitud creada para `clave`."""
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE subidas_registradas SET solicitud_id = %s, resultado = %s WHERE clave = %s",
+        (solicitud_id, json.dumps(resultado, ensure_ascii=False, default=str), clave)
+    )
+    conn.commit()
+
+
+def liberar_subida(conn, clave):
+    """Quita una reserva que no llegó a crear la solicitud, para que el cliente pueda reintentar."""
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM subidas_registradas WHERE clave = %s AND resultado IS NULL", (clave,))
+    conn.commit()
+
+
+def purgar_subidas(conn, retencion):
+    """Borra los registros de más de `retencion` segundos. Devuelve cuántos borró."""
+    cursor = conn.cursor()
+    cursor.execute(
+        "DELETE FROM subidas_registradas WHERE creado < %s",
+        (_fecha_db(datetime.now() - timedelta(seconds=retencion)),)
+    )
+    conn.commit()
+    return cursor.rowcount
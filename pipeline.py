@@ -0,0 +1,189 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Hilos para las tareas de todas las peticiones; /subir usa hasta 6 (3 subidas + 3 extracciones)
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "24"))
+
+_executor = None
+_cupos = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+class Cupos:
+    """
+    Cuenta los hilos libres del executor. Una petición reserva de una vez un
+    cupo por tarea, así sus tareas empiezan al enviarse en lugar de esperar en
+    la cola detrás de las de otras peticiones. Cada cupo se libera cuando su
+    tarea termina de verdad: una tarea vencida lo sigue ocupando mientras corre.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self._libres = total
+        self._condicion = threading.Condition()
+
+    def reservar(self, cantidad, timeout):
+        """Reserva `cantidad` cupos (como mucho `total`); False si no se liberan antes de `timeout` segundos."""
+        cantidad = min(cantidad, self.total)
+        with self._condicion:
+            if not self._condicion.wait_for(lambda: self._libres >= cantidad, timeout):
+                return False
+            self._libres -= cantidad
+            return True
+
+    def liberar(self, cantidad=1):
+        with self._condicion:
+            self._libres += cantidad
+            self._condicion.notify_all()
+
+
+def obtener_executor():
+    """
+    Executor compartido y acotado y sus cupos; se recrean si el proceso fue
+    bifurcado (gunicorn). Devuelve (executor, cupos).
+    """
+    global _executor, _cupos, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+                _cupos = Cupos(PIPELINE_WORKERS)
+                _executor_pid = pid
+    return _executor, _cupos
+
+
+class ResultadoTarea:
+    __slots__ = ("ok", "valor", "error", "duracion")
+
+    def __init__(self, ok, valor=None, error=None, duracion=0.0):
+        self.ok = ok
+        self.valor = valor
+        self.error = error
+        self.duracion = duracion
+
+    def resumen(self):
+        if self.ok:
+            return {"estado": "ok", "duracion_ms": round(self.duracion * 1000)}
+        return {"estado": "error", "error": self.error, "duracion_ms": round(self.duracion * 1000)}
+
+
+class _Inicio:
+    """Momento en que una tarea empezó a correr en un hilo del executor."""
+
+    __slots__ = ("evento", "instante")
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.instante = None
+
+
+def _medir(funcion, inicio, cupos):
+    inicio.instante = time.monotonic()
+    inicio.evento.set()
+    try:
+        valor = funcion()
+        return valor, time.monotonic() - inicio.instante
+    finally:
+        if cupos is not None:
+            cupos.liberar()
+
+
+def _esperar(futuro, inicio, timeout, envio):
+    """
+    Resultado de `futuro`. El tiempo límite se cuenta desde que la tarea empieza
+    a correr; si ni siquiera empezó `timeout` segundos después del envío se
+    cancela (sin haber ocupado un hilo). Devuelve (valor, duracion) o lanza.
+    """
+    if not inicio.evento.wait(max(0.0, envio + timeout - time.monotonic())) and futuro.cancel():
+        raise FuturesTimeoutError()
+    inicio.evento.wait()
+    return futuro.result(timeout=max(0.0, inicio.instante + timeout - time.monotonic()))
+
+
+def ejecutar_en_paralelo(tareas):
+    """
+    Ejecuta `tareas` ({clave: (funcion_sin_argumentos, timeout_segundos)}) en el
+    executor compartido y devuelve {clave: ResultadoTarea}.
+
+    Antes de enviar se reserva un hilo por tarea (`Cupos`), así las peticiones
+    concurrentes esperan su turno sin que corra el plazo de sus tareas; si no
+    hay hilos libres antes del plazo más largo, todas fallan sin ejecutarse.
+    Cada timeout se cuenta desde que su tarea empieza. Una tarea que falla o
+    vence no afecta al resto; el hilo que vence no se puede cancelar, pero su
+    resultado se descarta y su cupo vuelve a quedar libre cuando termina.
+    """
+    if not tareas:
+        return {}
+    executor, cupos = obtener_executor()
+    if len(tareas) > cupos.total:
+        logger.warning(f"⚠️ {len(tareas)} tareas y solo {cupos.total} hilos (PIPELINE_WORKERS): algunas esperarán en cola")
+
+    espera_maxima = max(timeout for _, timeout in tareas.values())
+    inicio_espera = time.monotonic()
+    if not cupos.reservar(len(tareas), espera_maxima):
+        logger.error(f"🚦 Pipeline saturado: sin {len(tareas)} hilos libres tras {espera_maxima}s")
+        return {
+            clave: ResultadoTarea(False, error="Servicio saturado, intenta de nuevo", duracion=espera_maxima)
+            for clave in tareas
+        }
+    espera = time.monotonic() - inicio_espera
+    if espera > 0.1:
+        logger.info(f"🚦 Se esperaron {espera:.2f}s por hilos libres del pipeline")
+
+    envio = time.monotonic()
+    futuros = {}
+    for indice, (clave, (funcion, timeout)) in enumerate(tareas.items()):
+        inicio = _Inicio()
+        # Con más tareas que hilos, las que sobran no tienen cupo propio y esperan en la cola del executor
+        cupo = cupos if indice < cupos.total else None
+        futuros[clave] = (executor.submit(_medir, funcion, inicio, cupo), inicio, cupo, timeout)
+
+    resultados = {}
+    # Se espera primero a las tareas con plazo más corto para respetar cada límite
+    for clave, (futuro, inicio, cupo, timeout) in sorted(futuros.items(), key=lambda item: item[1][3]):
+        try:
+            valor, duracion = _esperar(futuro, inicio, timeout, envio)
+            resultados[clave] = ResultadoTarea(True, valor=valor, duracion=duracion)
+        except FuturesTimeoutError:
+            if futuro.cancelled() and cupo is not None:
+                # No llegó a correr: su cupo no lo libera _medir
+                cupo.liberar()
+            logger.error(f"⏱️ Tarea {clave} superó el tiempo límite de {timeout}s")
+            resultados[clave] = ResultadoTarea(False, error=f"Tiempo límite excedido ({timeout}s)", duracion=timeout)
+        except Exception as e:
+            logger.error(f"❌ Tarea {clave} falló: {e}")
+            duracion = time.monotonic() - (inicio.instante or envio)
+            resultados[clave] = ResultadoTarea(False, error=str(e), duracion=duracion)
+    return {clave: resultados[clave] for clave in tareas}
+
+
+async def _medir_async(fabrica, timeout):
+    inicio = time.monotonic()
+    try:
+        valor = await asyncio.wait_for(fabrica(), timeout)
+        return ResultadoTarea(True, valor=valor, duracion=time.monotonic() - inicio)
+    except asyncio.TimeoutError:
+        return ResultadoTarea(False, error=f"Tiempo límite excedido ({timeout}s)", duracion=timeout)
+    except Exception as e:
+        return ResultadoTarea(False, error=str(e), duracion=time.monotonic() - inicio)
+
+
+async def ejecutar_en_paralelo_async(tareas):
+    """
+    Versión para el modo ASGI: `tareas` es {clave: (fabrica_de_corrutina, timeout_segundos)}.
+    Las corrutinas corren concurrentes en el event loop, sin ocupar hilos, y
+    la que vence se cancela de verdad. Devuelve {clave: ResultadoTarea}.
+    """
+    resultados = await asyncio.gather(*(_medir_async(fabrica, timeout) for fabrica, timeout in tareas.values()))
+    for clave, resultado in zip(tareas, resultados):
+        if not resultado.ok:
+            logger.error(f"❌ Tarea {clave} falló: {resultado.error}")
+    return dict(zip(tareas, resultados))
@@ -0,0 +1,293 @@
+"""
+Reproceso masivo de documentos con `batch_process_documents` de Document AI.
+
+Cuando cambia la versión de un procesador hay que volver a extraer los campos
+de solicitudes ya registradas. Este comando selecciona los archivos guardados
+en GCS (por fecha, estado y tipo de documento), los envía en lotes grandes a
+Document AI, lee los JSON de salida fragmento por fragmento y reemplaza en
+bloque las filas de `datos_extraidos`.
+
+El avance se guarda en un archivo de checkpoint después de confirmar cada
+lote en la BD; si el comando se interrumpe, al volver a ejecutarlo con el
+mismo checkpoint continúa desde el último lote terminado.
+
+    python reprocesar.py --tipos camara_comercio --desde 2025-01-01 --checkpoint reproceso.json
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+import mimetypes
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, unquote
+
+from db import conexion_db
+from persistencia import reemplazar_datos_extraidos
+from entidades import EntidadExtraida, campos_desde_entidades
+
+logger = logging.getLogger(__name__)
+
+LOTE_POR_DEFECTO = 500
+TIMEOUT_LOTE = 3600
+
+# Mismo mapeo que DOCUMENTOS en app.py: tipo en `archivos` -> (tipo en datos_extraidos, variable del procesador)
+DOCUMENTOS = {
+    "doc_identidad": ("cedulas", "PROCESSOR_CEDULAS"),
+    "rut": ("RUT", "PROCESSOR_RUT"),
+    "camara_comercio": ("camara_comercio", "PROCESSOR_CAMARA"),
+}
+
+
+def uri_gcs(ruta_archivo):
+    """Convierte la URL pública guardada en `archivos.ruta_archivo` en gs://bucket/objeto."""
+    if not ruta_archivo:
+        return None
+    if ruta_archivo.startswith("gs://"):
+        return ruta_archivo
+    url = urlparse(ruta_archivo)
+    if url.netloc != "storage.googleapis.com":
+        return None
+    bucket, _, objeto = url.path.lstrip("/").partition("/")
+    if not bucket or not objeto:
+        return None
+    return f"gs://{bucket}/{unquote(objeto)}"
+
+
+def _separar_uri(uri):
+    bucket, _, prefijo = uri[len("gs://"):].partition("/")
+    return bucket, prefijo
+
+
+def campos_desde_json(entidades):
+    """Convierte las entidades del JSON de salida al formato de procesar_documento_con_ai."""
+    return campos_desde_entidades(EntidadExtraida.desde_json(e) for e in entidades)
+
+
+class ClienteLotesDocumentAI:
+    """
+    Capa de Document AI y GCS que usa el reproceso. Se puede reemplazar por
+    cualquier objeto con los mismos dos métodos (ver bench/servicios_falsos.py).
+    """
+
+    def __init__(self, proyecto, ubicacion, timeout=TIMEOUT_LOTE):
+        self._proyecto = proyecto
+        self._ubicacion = ubicacion
+        self._timeout = timeout
+
+    def procesar_lote(self, processor_id, entradas, prefijo_salida):
+        """
+        Envía `entradas` [(gs_uri, mime_type)] al procesador y espera a que
+        termine. Devuelve {gs_uri_entrada: (gs_uri_salida o None, error o None)}.
+        """
+        from google.cloud import documentai_v1 as documentai
+        from clientes import registro_clientes
+
+        cliente = registro_clientes.obtener("documentai")
+        solicitud = documentai.BatchProcessRequest(
+            name=f"projects/{self._proyecto}/locations/{self._ubicacion}/processors/{processor_id}",
+            input_documents=documentai.BatchDocumentsInputConfig(
+                gcs_documents=documentai.GcsDocuments(documents=[
+                    documentai.GcsDocument(gcs_uri=uri, mime_type=mime_type) for uri, mime_type in entradas
+                ])
+            ),
+            document_output_config=documentai.DocumentOutputConfig(
+                gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(
+                    gcs_uri=prefijo_salida, field_mask="entities"
+                )
+            ),
+        )
+        operacion = cliente.batch_process_documents(request=solicitud)
+        operacion.result(timeout=self._timeout)
+
+        metadata = documentai.BatchProcessMetadata(operacion.metadata)
+        if metadata.state != documentai.BatchProcessMetadata.State.SUCCEEDED:
+            raise RuntimeError(f"El lote terminó en estado {metadata.state.name}: {metadata.state_message}")
+        resultados = {}
+        for estado in metadata.individual_process_statuses:
+            error = estado.status.message if estado.status.code else None
+            resultados[estado.input_gcs_source] = (estado.output_gcs_destination or None, error)
+        return resultados
+
+    def leer_salida(self, uri_salida):
+        """Itera las entidades de todos los fragmentos JSON bajo `uri_salida`, uno a la vez."""
+        from clientes import registro_clientes
+
+        cliente = registro_clientes.obtener("storage")
+        bucket, prefijo = _separar_uri(uri_salida)
+        for blob in cliente.list_blobs(bucket, prefix=prefijo):
+            if not blob.name.endswith(".json"):
+                continue
+            with blob.open("rb") as fragmento:
+                documento = json.load(fragmento)
+            yield from documento.get("entities", [])
+
+
+class Checkpoint:
+    """Avance del reproceso por tipo de documento, guardado de forma atómica en JSON."""
+
+    def __init__(self, ruta, filtros):
+        self._ruta = ruta
+        self.estado = {"filtros": filtros, "tipos": {}, "errores": []}
+        if ruta and os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                guardado = json.load(f)
+            if guardado.get("filtros") != filtros:
+                raise ValueError(
+                    f"El checkpoint {ruta} corresponde a otros filtros: {guardado.get('filtros')}"
+                )
+            self.estado = guardado
+            logger.info(f"↩️ Reanudando reproceso desde {ruta}")
+
+    def tipo(self, tipo):
+        return self.estado["tipos"].setdefault(
+            tipo, {"ultimo_archivo_id": 0, "documentos": 0, "errores": 0, "terminado": False}
+        )
+
+    def guardar(self):
+        if not self._ruta:
+            return
+        temporal = f"{self._ruta}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(self.estado, f, ensure_ascii=False, indent=2)
+        os.replace(temporal, self._ruta)
+
+
+def seleccionar_archivos(conn, tipo, despues_de, limite, desde=None, hasta=None, estado=None):
+    """Siguiente página de archivos del tipo indicado (keyset sobre archivos.id)."""
+    condiciones = ["a.tipo = %s", "a.id > %s"]
+    parametros = [tipo, despues_de]
+    if estado:
+        condiciones.append("s.estado = %s")
+        parametros.append(estado)
+    if desde:
+        condiciones.append("s.fecha >= %s")
+        parametros.append(desde)
+    if hasta:
+        condiciones.append("s.fecha < %s")
+        parametros.append(hasta + timedelta(days=1))
+    parametros.append(limite)
+
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(
+        "SELECT a.id, a.solicitud_id, a.nombre_archivo, a.ruta_archivo "
+        "FROM archivos a JOIN solicitudes s ON s.id = a.solicitud_id "
+        f"WHERE {' AND '.join(condiciones)} ORDER BY a.id LIMIT %s",
+        parametros
+    )
+    return cursor.fetchall()
+
+
+def reprocesar(cliente, tipos=None, desde=None, hasta=None, estado=None, lote=LOTE_POR_DEFECTO,
+               bucket_salida=None, ruta_checkpoint=None, obtener_conexion=conexion_db, maximo=None):
+    """
+    Reprocesa los archivos seleccionados y devuelve un resumen por tipo.
+
+    `cliente` es la capa de Document AI (ClienteLotesDocumentAI o un doble).
+    `maximo` limita la cantidad de documentos de esta ejecución.
+    """
+    tipos = tipos or list(DOCUMENTOS)
+    filtros = {
+        "tipos": sorted(tipos), "estado": estado,
+        "desde": desde.isoformat() if desde else None, "hasta": hasta.isoformat() if hasta else None,
+    }
+    checkpoint = Checkpoint(ruta_checkpoint, filtros)
+    corrida = checkpoint.estado.setdefault("corrida", uuid.uuid4().hex[:12])
+    bucket_salida = bucket_salida or os.getenv("GCS_BUCKET_NAME")
+    enviados = 0
+
+    for tipo in tipos:
+        tipo_doc, variable = DOCUMENTOS[tipo]
+        processor_id = os.getenv(variable)
+        if not processor_id:
+            raise ValueError(f"{variable} no está definido")
+        avance = checkpoint.tipo(tipo)
+
+        while not avance["terminado"]:
+            if maximo is not None and enviados >= maximo:
+                checkpoint.guardar()
+                return checkpoint.estado["tipos"]
+
+            tamano = lote if maximo is None else min(lote, maximo - enviados)
+            with obtener_conexion() as conn:
+                if not conn:
+                    raise RuntimeError("Error al conectar a la base de datos")
+                archivos = seleccionar_archivos(conn, tipo, avance["ultimo_archivo_id"], tamano, desde, hasta, estado)
+            if not archivos:
+                avance["terminado"] = True
+                checkpoint.guardar()
+                break
+
+            entradas, por_uri = [], {}
+            for archivo in archivos:
+                uri = uri_gcs(archivo["ruta_archivo"])
+                if not uri:
+                    avance["errores"] += 1
+                    checkpoint.estado["errores"].append({"archivo_id": archivo["id"], "error": "ruta no es de GCS"})
+                    continue
+                mime_type = mimetypes.guess_type(archivo["nombre_archivo"] or "")[0] or "application/pdf"
+                entradas.append((uri, mime_type))
+                por_uri[uri] = archivo
+
+            inicio = time.monotonic()
+            prefijo = f"gs://{bucket_salida}/reproceso/{corrida}/{tipo}/{archivos[0]['id']}/"
+            resultados = cliente.procesar_lote(processor_id, entradas, prefijo) if entradas else {}
+            duracion_lote = time.monotonic() - inicio
+
+            extracciones = {}
+            for uri, archivo in por_uri.items():
+                uri_salida, error = resultados.get(uri, (None, "sin resultado del lote"))
+                if error or not uri_salida:
+                    avance["errores"] += 1
+                    checkpoint.estado["errores"].append({"archivo_id": archivo["id"], "error": error})
+                    continue
+                campos = campos_desde_json(cliente.leer_salida(uri_salida))
+                extracciones.setdefault(archivo["solicitud_id"], {})[tipo_doc] = campos
+
+            with obtener_conexion() as conn:
+                if not conn:
+                    raise RuntimeError("Error al conectar a la base de datos")
+                metricas = reemplazar_datos_extraidos(conn, extracciones)
+
+            avance["documentos"] += metricas["documentos"]
+            avance["ultimo_archivo_id"] = archivos[-1]["id"]
+            enviados += len(archivos)
+            checkpoint.guardar()
+            logger.info(
+                f"🔁 {tipo}: lote de {len(archivos)} archivos en {duracion_lote:.1f}s; "
+                f"{metricas['filas_datos_extraidos']} filas reemplazadas (total {avance['documentos']}, errores {avance['errores']})"
+            )
+
+    return checkpoint.estado["tipos"]
+
+
+def _fecha(texto):
+    return datetime.strptime(texto, "%Y-%m-%d")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tipos", nargs="+", choices=list(DOCUMENTOS), help="tipos de documento a reprocesar (todos por defecto)")
+    parser.add_argument("--desde", type=_fecha, help="fecha mínima de la solicitud (AAAA-MM-DD)")
+    parser.add_argument("--hasta", type=_fecha, help="fecha máxima de la solicitud, inclusive (AAAA-MM-DD)")
+    parser.add_argument("--estado", choices=["sin revisar", "aprobado", "rechazado"])
+    parser.add_argument("--lote", type=int, default=LOTE_POR_DEFECTO, help="documentos por llamada a batch_process_documents")
+    parser.add_argument("--maximo", type=int, help="detenerse tras esta cantidad de documentos")
+    parser.add_argument("--bucket-salida", help="bucket para los JSON de salida (GCS_BUCKET_NAME por defecto)")
+    parser.add_argument("--checkpoint", default="reproceso-checkpoint.json")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    cliente = ClienteLotesDocumentAI(
+        os.getenv("GCP_PROJECT_ID", "co-impocali-cld-01"), os.getenv("GCP_REGION", "us")
+    )
+    resumen = reprocesar(
+        cliente, tipos=args.tipos, desde=args.desde, hasta=args.hasta, estado=args.estado, lote=args.lote,
+        bucket_salida=args.bucket_salida, ruta_checkpoint=args.checkpoint, maximo=args.maximo
+    )
+    print(json.dumps(resumen, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
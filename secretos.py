@@ -0,0 +1,132 @@
+import hmac
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def comparar_tokens(recibido, esperado):
+    """Compara dos tokens en tiempo constante."""
+    if not recibido or not esperado:
+        return False
+    return hmac.compare_digest(recibido.encode("utf-8"), esperado.encode("utf-8"))
+
+
+class ValidadorToken:
+    """
+    Mantiene en memoria el token leído desde Secret Manager.
+
+    El valor se sirve desde caché durante `ttl` segundos. Cuando se consume
+    pasado el umbral de refresco (`ttl * (1 - margen_refresco)`) se lanza una
+    recarga en segundo plano, de modo que las peticiones no esperan a Secret
+    Manager. Si una recarga falla se sigue sirviendo el último valor válido.
+    """
+
+    def __init__(self, cargador, ttl=300, margen_refresco=0.2, espera_reintento=30):
+        self._cargador = cargador
+        self._ttl = ttl
+        self._margen_refresco = margen_refresco
+        self._espera_reintento = espera_reintento
+
+        self._lock = threading.Lock()
+        self._valor = None
+        self._cargado_en = 0.0
+        self._proximo_intento = 0.0
+        self._refrescando = False
+
+        self.hits = 0
+        self.misses = 0
+        self.refrescos = 0
+        self.errores_refresco = 0
+
+    def _umbral_refresco(self):
+        return self._cargado_en + self._ttl * (1 - self._margen_refresco)
+
+    def _expirado(self, ahora):
+        return self._valor is None or ahora >= self._cargado_en + self._ttl
+
+    def _desde_cache(self):
+        """(True, valor) si se puede servir sin esperar a Secret Manager; (False, None) si hay que cargarlo."""
+        ahora = time.monotonic()
+        with self._lock:
+            if not self._expirado(ahora):
+                self.hits += 1
+                if ahora >= self._umbral_refresco() and ahora >= self._proximo_intento and not self._refrescando:
+                    self._refrescando = True
+                    threading.Thread(target=self._refrescar, daemon=True, name="refresco-token").start()
+                return True, self._valor
+            self.misses += 1
+            if self._valor is not None and ahora < self._proximo_intento:
+                # Secret Manager falló hace poco: se sirve el valor anterior sin reintentar.
+                return True, self._valor
+        return False, None
+
+    def obtener(self):
+        disponible, valor = self._desde_cache()
+        if disponible:
+            return valor
+
+        self._refrescar()
+        with self._lock:
+            return self._valor
+
+    async def obtener_async(self, cargador_async):
+        """
+        Igual que `obtener`, pero si hay que esperar a Secret Manager se usa
+        `cargador_async` para no bloquear el event loop (modo ASGI). Los
+        refrescos anticipados siguen en un hilo con el cargador síncrono.
+        """
+        disponible, valor = self._desde_cache()
+        if disponible:
+            return valor
+
+        try:
+            nuevo = await cargador_async()
+        except Exception as e:
+            logger.error(f"❌ Error refrescando token en caché: {e}")
+            nuevo = None
+        self._aplicar(nuevo)
+        with self._lock:
+            return self._valor
+
+    def _refrescar(self):
+        try:
+            nuevo = self._cargador()
+        except Exception as e:
+            logger.error(f"❌ Error refrescando token en caché: {e}")
+            nuevo = None
+        self._aplicar(nuevo)
+
+    def _aplicar(self, nuevo):
+        with self._lock:
+            self._refrescando = False
+            if nuevo:
+                self._valor = nuevo
+                self._cargado_en = time.monotonic()
+                self._proximo_intento = 0.0
+                self.refrescos += 1
+            else:
+                self.errores_refresco += 1
+                self._proximo_intento = time.monotonic() + self._espera_reintento
+                if self._valor is not None:
+                    logger.warning("⚠️ No se pudo refrescar el token; se mantiene el último valor válido.")
+
+    def validar(self, token):
+        return comparar_tokens(token, self.obtener())
+
+    def invalidar(self):
+        with self._lock:
+            self._valor = None
+            self._cargado_en = 0.0
+            self._proximo_intento = 0.0
+
+    def metricas(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refrescos": self.refrescos,
+                "errores_refresco": self.errores_refresco,
+                "edad_segundos": round(time.monotonic() - self._cargado_en, 1) if self._valor else None,
+            }
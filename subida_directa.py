@@ -0,0 +1,163 @@
+"""
+Subida directa del navegador a Cloud Storage con URLs firmadas V4.
+
+1. POST /subir/firmar devuelve, por archivo, una URL PUT firmada dentro de la
+   `carpeta_gcs` del usuario y un ticket firmado con los objetos esperados.
+2. El cliente sube cada archivo con PUT a su URL, enviando las cabeceras
+   indicadas (Content-Type, x-goog-content-length-range y
+   x-goog-if-generation-match forman parte de la firma).
+3. POST /subir/finalizar con el ticket: se verifica que los objetos existan y
+   Document AI los lee desde el bucket.
+
+Cada ticket lleva un id único (`subida`) que va en el nombre de sus objetos y
+con el que la app registra la solicitud una sola vez. La URL solo crea el
+objeto (if-generation-match: 0): no sirve para reemplazarlo una vez subido.
+
+La firma se hace localmente con la llave de la cuenta de servicio
+(GCS_CREDENTIALS_PATH), sin llamar a la API. El bucket necesita una regla CORS
+que permita PUT desde el origen del portal.
+"""
+import os
+import uuid
+import logging
+from datetime import timedelta
+from functools import lru_cache
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+from cargas import DocumentoGCS, FIRMAS_MIME, TAMANO_MAXIMO_DOCUMENTAI
+
+logger = logging.getLogger(__name__)
+
+# Document AI lee estos archivos tal cual del bucket: no pueden superar su límite en línea
+TAMANO_MAXIMO = min(
+    int(os.getenv("SUBIDA_DIRECTA_TAMANO_MAXIMO", str(50 * 1024 * 1024))), TAMANO_MAXIMO_DOCUMENTAI
+)
+VIGENCIA_URL = int(os.getenv("SUBIDA_DIRECTA_VIGENCIA", "900"))
+# Tiempo para llamar a /subir/finalizar después de pedir las URLs
+VIGENCIA_TICKET = int(os.getenv("SUBIDA_DIRECTA_VIGENCIA_TICKET", "3600"))
+# Endpoint de las URLs firmadas (p. ej. un emulador de GCS para pruebas locales)
+ENDPOINT_FIRMA = os.getenv("GCS_ENDPOINT_FIRMA") or None
+
+MIME_PERMITIDOS = {mime_type for _, mime_type in FIRMAS_MIME} | {"image/webp"}
+
+
+class ErrorSubidaDirecta(ValueError):
+    """Petición de firma o finalización inválida (se responde 400)."""
+
+
+@lru_cache(maxsize=None)
+def credenciales_firma():
+    from google.oauth2 import service_account
+    return service_account.Credentials.from_service_account_file(os.getenv("GCS_CREDENTIALS_PATH"))
+
+
+@lru_cache(maxsize=None)
+def _cliente_firma():
+    # Cliente anónimo: solo aporta endpoint y dominio a generate_signed_url, no abre conexiones
+    from google.cloud import storage
+    return storage.Client.create_anonymous_client()
+
+
+def firmar_put(bucket, objeto, mime_type, tamano_maximo=TAMANO_MAXIMO, vigencia=VIGENCIA_URL, credenciales=None):
+    """
+    URL PUT firmada (V4) y las cabeceras que el cliente debe enviar con ella.
+    La precondición de generación 0 hace que solo pueda crear el objeto, no
+    sobrescribir uno ya subido (y quizá ya procesado).
+    """
+    rango = f"0,{tamano_maximo}"
+    cabeceras = {"x-goog-content-length-range": rango, "x-goog-if-generation-match": "0"}
+    url = _cliente_firma().bucket(bucket).blob(objeto).generate_signed_url(
+        version="v4",
+        method="PUT",
+        expiration=timedelta(seconds=vigencia),
+        content_type=mime_type,
+        headers=dict(cabeceras),
+        credentials=credenciales or credenciales_firma(),
+        api_access_endpoint=ENDPOINT_FIRMA,
+    )
+    return url, dict(cabeceras, **{"Content-Type": mime_type})
+
+
+def _serializador(secreto):
+    return URLSafeTimedSerializer(secreto, salt="subida-directa")
+
+
+def nombre_seguro(nombre):
+    """Solo el nombre base: el cliente no puede elegir la carpeta del objeto."""
+    nombre = os.path.basename((nombre or "").replace("\\", "/")).strip()
+    if not nombre or nombre in (".", ".."):
+        raise ErrorSubidaDirecta("Nombre de archivo inválido")
+    return nombre
+
+
+def preparar_subidas(secreto, bucket, usuario_id, correo, carpeta, fecha_para_archivo, archivos):
+    """
+    `archivos` es {tipo: {"nombre", "tipo_mime", "tamano"}}. Devuelve
+    ({tipo: {"url", "metodo", "cabeceras", "objeto"}}, ticket).
+    """
+    if not secreto:
+        raise ValueError("Se necesita un secreto para firmar los tickets de subida")
+    subida = uuid.uuid4().hex
+    subidas, objetos = {}, {}
+    for tipo, datos in archivos.items():
+        if not isinstance(datos, dict):
+            raise ErrorSubidaDirecta(f"Datos del archivo '{tipo}' inválidos")
+        nombre = nombre_seguro(datos.get("nombre"))
+        mime_type = datos.get("tipo_mime")
+        if mime_type not in MIME_PERMITIDOS:
+            raise ErrorSubidaDirecta(f"Tipo de archivo no permitido para '{tipo}': {mime_type}")
+        try:
+            tamano = int(datos.get("tamano", 0))
+        except (TypeError, ValueError):
+            raise ErrorSubidaDirecta(f"Tamaño inválido para '{tipo}'")
+        if not 0 < tamano <= TAMANO_MAXIMO:
+            raise ErrorSubidaDirecta(f"El archivo '{tipo}' supera el máximo de {TAMANO_MAXIMO} bytes")
+
+        # El id de la subida y el campo evitan que dos archivos con el mismo nombre compartan objeto
+        objeto = f"{carpeta}/{fecha_para_archivo}-{subida[:12]}-{tipo}-{nombre}"
+        url, cabeceras = firmar_put(bucket, objeto, mime_type)
+        subidas[tipo] = {"url": url, "metodo": "PUT", "cabeceras": cabeceras, "objeto": objeto}
+        objetos[tipo] = {"objeto": objeto, "nombre": nombre, "tipo_mime": mime_type}
+
+    ticket = _serializador(secreto).dumps({
+        "subida": subida, "usuario_id": usuario_id, "correo": correo, "carpeta": carpeta, "objetos": objetos
+    })
+    return subidas, ticket
+
+
+def leer_ticket(secreto, ticket, vigencia=VIGENCIA_TICKET):
+    if not secreto:
+        raise ValueError("Se necesita un secreto para leer los tickets de subida")
+    try:
+        datos = _serializador(secreto).loads(ticket or "", max_age=vigencia)
+    except SignatureExpired:
+        raise ErrorSubidaDirecta("El ticket de subida expiró; solicita nuevas URLs")
+    except BadSignature:
+        raise ErrorSubidaDirecta("Ticket de subida inválido")
+    if not datos.get("subida"):
+        # Ticket emitido antes de que llevaran id: no se puede registrar una sola vez
+        raise ErrorSubidaDirecta("Ticket de subida sin identificador; solicita nuevas URLs")
+    return datos
+
+
+def verificar_objetos(cliente_storage, bucket, objetos):
+    """
+    Comprueba que cada objeto del ticket exista con el tipo firmado y devuelve
+    {tipo: DocumentoGCS}. Lanza ErrorSubidaDirecta con los que faltan.
+    """
+    gcs_bucket = cliente_storage.bucket(bucket)
+    documentos, faltantes = {}, []
+    for tipo, datos in objetos.items():
+        blob = gcs_bucket.get_blob(datos["objeto"])
+        if blob is None:
+            faltantes.append(tipo)
+            continue
+        if blob.size > TAMANO_MAXIMO or blob.content_type != datos["tipo_mime"]:
+            raise ErrorSubidaDirecta(f"El archivo '{tipo}' no coincide con lo firmado")
+        huella = f"md5:{blob.md5_hash}" if blob.md5_hash else f"crc32c:{blob.crc32c}:{blob.size}"
+        documentos[tipo] = DocumentoGCS(datos["nombre"], blob.content_type, blob.size, bucket, datos["objeto"], huella)
+
+    if faltantes:
+        raise ErrorSubidaDirecta(f"Faltan por subir: {', '.join(faltantes)}")
+    return documentos
@@ -0,0 +1,324 @@
+"""
+Subida por fragmentos, reanudable, para archivos grandes (cámara de comercio escaneada).
+
+1. POST /subir/fragmentos: declara los archivos (como /subir/firmar) y recibe
+   la sesión y cuántos fragmentos espera de cada uno.
+2. PUT /subir/fragmentos/<sesion>/<campo>/<n>: cada fragmento, con su CRC32C
+   (base64, como lo da GCS) en la cabecera X-Goog-Hash: crc32c=... Se guarda
+   como un objeto temporal en el bucket; reenviar un fragmento lo reemplaza.
+3. GET /subir/fragmentos/<sesion>: fragmentos recibidos y el siguiente que
+   falta, para reanudar tras un corte.
+4. POST /subir/fragmentos/<sesion>/completar: une los fragmentos con
+   `compose`, borra los temporales y procesa la solicitud.
+
+La sesión es un token firmado, así que cualquier réplica atiende cualquier
+fragmento sin estado compartido. Solo `completar` se registra en la base
+(subidas_registradas, por id de sesión): un reintento devuelve la misma
+solicitud en vez de crear otra. Cada petición lee a lo sumo un fragmento en
+memoria. Los temporales de sesiones abandonadas se borran con
+`limpiar_sesiones_abandonadas` (en segundo plano desde la app, o con
+`python subida_fragmentada.py limpiar` como CronJob).
+"""
+import os
+import sys
+import time
+import uuid
+import base64
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+from cargas import DocumentoGCS, TAMANO_MAXIMO_DOCUMENTAI
+from subida_directa import MIME_PERMITIDOS, nombre_seguro
+
+logger = logging.getLogger(__name__)
+
+TAMANO_FRAGMENTO = int(os.getenv("FRAGMENTOS_TAMANO", str(8 * 1024 * 1024)))
+TAMANO_FRAGMENTO_MINIMO = 256 * 1024
+# Document AI lee el archivo unido tal cual del bucket: no puede superar su límite en línea
+TAMANO_MAXIMO = min(
+    int(os.getenv("FRAGMENTOS_TAMANO_MAXIMO", str(200 * 1024 * 1024))), TAMANO_MAXIMO_DOCUMENTAI
+)
+PREFIJO = os.getenv("FRAGMENTOS_PREFIJO", "_fragmentos")
+# Vida de una sesión: después su token deja de valer y sus temporales se borran
+VIGENCIA_SESION = int(os.getenv("FRAGMENTOS_VIGENCIA", str(24 * 3600)))
+INTERVALO_LIMPIEZA = int(os.getenv("FRAGMENTOS_INTERVALO_LIMPIEZA", "3600"))
+
+# Máximo de objetos fuente por llamada a compose
+MAX_COMPOSE = 32
+
+
+class ErrorFragmentos(ValueError):
+    """Petición inválida para la sesión de subida; `codigo` es el estado HTTP a responder."""
+
+    def __init__(self, mensaje, codigo=400):
+        super().__init__(mensaje)
+        self.codigo = codigo
+
+
+def crc32c_base64(datos):
+    """CRC32C en el formato de GCS: 4 bytes big-endian en base64."""
+    import google_crc32c
+    return base64.b64encode(google_crc32c.value(datos).to_bytes(4, "big")).decode()
+
+
+def crc32c_de_cabecera(valor):
+    """Extrae el crc32c de una cabecera X-Goog-Hash ("crc32c=...,md5=...")."""
+    for parte in (valor or "").split(","):
+        nombre, _, dato = parte.strip().partition("=")
+        if nombre == "crc32c" and dato:
+            return dato
+    return None
+
+
+def _serializador(secreto):
+    if not secreto:
+        # Con la llave por defecto de Flask cualquiera podría fabricar sesiones
+        raise ErrorFragmentos("Subida por fragmentos deshabilitada: falta configurar FLASK_SECRET_KEY", 503)
+    return URLSafeTimedSerializer(secreto, salt="subida-fragmentada")
+
+
+def _prefijo_sesion(sesion, campo=None):
+    return f"{PREFIJO}/{sesion['id']}/" + (f"{campo}/" if campo else "")
+
+
+def _total_fragmentos(tamano, tamano_fragmento):
+    return -(-tamano // tamano_fragmento)
+
+
+def iniciar_sesion(secreto, usuario_id, correo, carpeta, fecha_para_archivo, archivos, tamano_fragmento=None):
+    """
+    `archivos` es {campo: {"nombre", "tipo_mime", "tamano"}}. Devuelve
+    (token de sesión, {campo: {"fragmentos", "tamano_fragmento", "objeto"}}).
+    """
+    tamano_fragmento = int(tamano_fragmento or TAMANO_FRAGMENTO)
+    if not TAMANO_FRAGMENTO_MINIMO <= tamano_fragmento <= TAMANO_FRAGMENTO:
+        raise ErrorFragmentos(
+            f"tamano_fragmento debe estar entre {TAMANO_FRAGMENTO_MINIMO} y {TAMANO_FRAGMENTO} bytes"
+        )
+
+    id_sesion = uuid.uuid4().hex
+    declarados, plan = {}, {}
+    for campo, datos in archivos.items():
+        if not isinstance(datos, dict):
+            raise ErrorFragmentos(f"Datos del archivo '{campo}' inválidos")
+        try:
+            nombre = nombre_seguro(datos.get("nombre"))
+        except ValueError as e:
+            raise ErrorFragmentos(str(e))
+        mime_type = datos.get("tipo_mime")
+        if mime_type not in MIME_PERMITIDOS:
+            raise ErrorFragmentos(f"Tipo de archivo no permitido para '{campo}': {mime_type}")
+        try:
+            tamano = int(datos.get("tamano", 0))
+        except (TypeError, ValueError):
+            raise ErrorFragmentos(f"Tamaño inválido para '{campo}'")
+        if not 0 < tamano <= TAMANO_MAXIMO:
+            raise ErrorFragmentos(f"El archivo '{campo}' supera el máximo de {TAMANO_MAXIMO} bytes")
+
+        # Como en la subida directa: la sesión y el campo separan archivos con el mismo nombre
+        objeto = f"{carpeta}/{fecha_para_archivo}-{id_sesion[:12]}-{campo}-{nombre}"
+        declarados[campo] = {"nombre": nombre, "tipo_mime": mime_type, "tamano": tamano, "objeto": objeto}
+        plan[campo] = {
+            "fragmentos": _total_fragmentos(tamano, tamano_fragmento),
+            "tamano_fragmento": tamano_fragmento,
+            "objeto": objeto,
+        }
+
+    token = _serializador(secreto).dumps({
+        "id": id_sesion,
+        "usuario_id": usuario_id,
+        "correo": correo,
+        "carpeta": carpeta,
+        "tamano_fragmento": tamano_fragmento,
+        "archivos": declarados,
+    })
+    return token, plan
+
+
+def leer_sesion(secreto, token):
+    try:
+        return _serializador(secreto).loads(token or "", max_age=VIGENCIA_SESION)
+    except SignatureExpired:
+        raise ErrorFragmentos("La sesión de subida expiró; inicia una nueva", 410)
+    except BadSignature:
+        raise ErrorFragmentos("Sesión de subida inválida", 404)
+
+
+def tamano_esperado(sesion, campo, numero):
+    """Tamaño que debe tener el fragmento `numero` de `campo` (todos iguales salvo el último)."""
+    archivo = sesion["archivos"].get(campo)
+    if archivo is None:
+        raise ErrorFragmentos(f"El archivo '{campo}' no pertenece a la sesión", 404)
+    total = _total_fragmentos(archivo["tamano"], sesion["tamano_fragmento"])
+    if not 0 <= numero < total:
+        raise ErrorFragmentos(f"Fragmento {numero} fuera de rango (0-{total - 1})", 404)
+    if numero < total - 1:
+        return sesion["tamano_fragmento"]
+    return archivo["tamano"] - sesion["tamano_fragmento"] * (total - 1)
+
+
+def guardar_fragmento(cliente_storage, bucket, sesion, campo, numero, contenido, crc32c):
+    """Verifica tamaño y CRC32C del fragmento y lo guarda como objeto temporal."""
+    esperado = tamano_esperado(sesion, campo, numero)
+    if len(contenido) != esperado:
+        raise ErrorFragmentos(f"El fragmento {numero} debe tener {esperado} bytes y tiene {len(contenido)}")
+    if not crc32c:
+        raise ErrorFragmentos("Falta la cabecera X-Goog-Hash con el crc32c del fragmento")
+    calculado = crc32c_base64(contenido)
+    if calculado != crc32c:
+        raise ErrorFragmentos(f"CRC32C del fragmento {numero} no coincide; reenvíalo", 422)
+
+    blob = cliente_storage.bucket(bucket).blob(f"{_prefijo_sesion(sesion, campo)}{numero:05d}")
+    blob.crc32c = calculado
+    # GCS vuelve a validar el CRC32C al recibirlo
+    blob.upload_from_string(contenido, content_type="application/octet-stream", checksum="crc32c")
+    return calculado
+
+
+def _fragmentos_recibidos(cliente_storage, bucket, sesion):
+    """{campo: {numero: blob}} de los temporales de la sesión (una sola consulta de listado)."""
+    recibidos = {campo: {} for campo in sesion["archivos"]}
+    for blob in cliente_storage.bucket(bucket).list_blobs(prefix=_prefijo_sesion(sesion)):
+        campo, _, numero = blob.name[len(_prefijo_sesion(sesion)):].partition("/")
+        if campo in recibidos and numero.isdigit():
+            recibidos[campo][int(numero)] = blob
+    return recibidos
+
+
+def estado_sesion(cliente_storage, bucket, sesion, recibidos=None):
+    """Por archivo: fragmentos recibidos (con tamaño válido), faltantes y el siguiente a enviar."""
+    if recibidos is None:
+        recibidos = _fragmentos_recibidos(cliente_storage, bucket, sesion)
+    estado = {}
+    for campo, blobs in recibidos.items():
+        total = _total_fragmentos(sesion["archivos"][campo]["tamano"], sesion["tamano_fragmento"])
+        validos = sorted(n for n, blob in blobs.items() if n < total and blob.size == tamano_esperado(sesion, campo, n))
+        faltantes = sorted(set(range(total)) - set(validos))
+        estado[campo] = {
+            "fragmentos": total,
+            "recibidos": validos,
+            "faltantes": faltantes,
+            "siguiente": faltantes[0] if faltantes else None,
+        }
+    return estado
+
+
+def _componer(gcs_bucket, destino, fuentes, prefijo_parciales, content_type):
+    """Une `fuentes` en `destino`; con más de MAX_COMPOSE se compone por niveles. Devuelve los parciales creados."""
+    parciales = []
+    nivel = 0
+    while len(fuentes) > MAX_COMPOSE:
+        siguientes = []
+        for inicio in range(0, len(fuentes), MAX_COMPOSE):
+            parcial = gcs_bucket.blob(f"{prefijo_parciales}parcial-{nivel}-{inicio // MAX_COMPOSE:05d}")
+            parcial.content_type = content_type
+            parcial.compose(fuentes[inicio:inicio + MAX_COMPOSE])
+            siguientes.append(parcial)
+        parciales.extend(siguientes)
+        fuentes = siguientes
+        nivel += 1
+    destino.content_type = content_type
+    destino.compose(fuentes)
+    return parciales
+
+
+def completar_sesion(cliente_storage, bucket, sesion):
+    """
+    Une los fragmentos de cada archivo en su objeto final, borra los temporales y
+    devuelve {campo: DocumentoGCS}. Lanza ErrorFragmentos (409) si falta alguno.
+    """
+    gcs_bucket = cliente_storage.bucket(bucket)
+    recibidos = _fragmentos_recibidos(cliente_storage, bucket, sesion)
+    estado = estado_sesion(cliente_storage, bucket, sesion, recibidos)
+
+    # Primero se comprueba que estén todos: no se compone nada si falta un fragmento
+    existentes, incompletos = {}, {}
+    for campo, archivo in sesion["archivos"].items():
+        if not estado[campo]["faltantes"]:
+            continue
+        # Si se compuso pero no se llegó a registrar la solicitud, el reintento ya
+        # no encuentra temporales pero sí el objeto final
+        existente = gcs_bucket.get_blob(archivo["objeto"]) if not estado[campo]["recibidos"] else None
+        if existente is not None and existente.size == archivo["tamano"]:
+            existentes[campo] = existente
+        else:
+            incompletos[campo] = estado[campo]["faltantes"]
+
+    if incompletos:
+        detalle = "; ".join(f"{campo}: faltan {len(faltan)}" for campo, faltan in incompletos.items())
+        raise ErrorFragmentos(f"Subida incompleta ({detalle})", 409)
+
+    documentos = {}
+    for campo, archivo in sesion["archivos"].items():
+        destino = existentes.get(campo)
+        if destino is None:
+            destino = gcs_bucket.blob(archivo["objeto"])
+            fuentes = [recibidos[campo][n] for n in range(estado[campo]["fragmentos"])]
+            parciales = _componer(gcs_bucket, destino, fuentes, _prefijo_sesion(sesion, campo), archivo["tipo_mime"])
+            if destino.size != archivo["tamano"]:
+                raise ErrorFragmentos(
+                    f"El archivo '{campo}' quedó con {destino.size} bytes y se declararon {archivo['tamano']}", 409
+                )
+            for blob in fuentes + parciales:
+                blob.delete()
+
+        documentos[campo] = DocumentoGCS(
+            archivo["nombre"], archivo["tipo_mime"], destino.size, bucket, archivo["objeto"],
+            f"crc32c:{destino.crc32c}:{destino.size}"
+        )
+    return documentos
+
+
+def limpiar_sesiones_abandonadas(cliente_storage, bucket, antiguedad=VIGENCIA_SESION):
+    """Borra los temporales creados hace más de `antiguedad` segundos. Devuelve cuántos borró."""
+    limite = datetime.now(timezone.utc) - timedelta(seconds=antiguedad)
+    borrados = 0
+    for blob in cliente_storage.bucket(bucket).list_blobs(prefix=f"{PREFIJO}/"):
+        if blob.time_created and blob.time_created < limite:
+            try:
+                blob.delete()
+                borrados += 1
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo borrar el fragmento abandonado {blob.name}: {e}")
+    if borrados:
+        logger.info(f"🧹 {borrados} fragmentos de sesiones abandonadas eliminados")
+    return borrados
+
+
+_ultima_limpieza = 0.0
+_lock_limpieza = threading.Lock()
+
+
+def programar_limpieza(obtener_cliente, bucket):
+    """Lanza la limpieza en segundo plano si pasó INTERVALO_LIMPIEZA desde la última en este proceso."""
+    global _ultima_limpieza
+    if INTERVALO_LIMPIEZA <= 0:
+        return
+    with _lock_limpieza:
+        ahora = time.monotonic()
+        if _ultima_limpieza and ahora - _ultima_limpieza < INTERVALO_LIMPIEZA:
+            return
+        _ultima_limpieza = ahora
+
+    def limpiar():
+        try:
+            limpiar_sesiones_abandonadas(obtener_cliente(), bucket)
+        except Exception as e:
+            logger.warning(f"⚠️ Falló la limpieza de fragmentos abandonados: {e}")
+
+    threading.Thread(target=limpiar, daemon=True, name="limpieza-fragmentos").start()
+
+
+if __name__ == "__main__":
+    # python subida_fragmentada.py limpiar [antigüedad_segundos]
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != "limpiar":
+        print("Uso: python subida_fragmentada.py limpiar [antigüedad_segundos]")
+        sys.exit(2)
+    from clientes import registro_clientes
+    antiguedad = int(sys.argv[2]) if len(sys.argv) > 2 else VIGENCIA_SESION
+    total = limpiar_sesiones_abandonadas(registro_clientes.obtener("storage"), os.getenv("GCS_BUCKET_NAME"), antiguedad)
+    print(f"Fragmentos eliminados: {total}")
@@ -0,0 +1,55 @@
+import mysql.connector
+import pytest
+from mysql.connector import pooling
+
+import db
+
+
+class ConexionFalsa:
+    def __init__(self, pool, connection_id):
+        self._pool = pool
+        self.connection_id = connection_id
+
+    def ping(self, reconnect=False):
+        if self._pool.caida:
+            raise mysql.connector.Error("sin conexión")
+
+    def reconnect(self, attempts=1, delay=0):
+        if self._pool.caida:
+            raise mysql.connector.Error("sin conexión")
+
+    def close(self):
+        self._pool.libres.append(self)
+
+
+class PoolFalso:
+    """Como MySQLConnectionPool: entrega de una cola fija y falla si está vacía."""
+
+    def __init__(self, pool_size, **_):
+        self.caida = False
+        self.libres = [ConexionFalsa(self, i) for i in range(pool_size)]
+
+    def get_connection(self):
+        if not self.libres:
+            raise pooling.PoolError("Failed getting connection; pool exhausted")
+        return self.libres.pop()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(pooling, "MySQLConnectionPool", PoolFalso)
+    return db.PoolConexiones({}, tamano=2, timeout=0.1)
+
+
+def test_preparar_fallido_devuelve_la_conexion(pool):
+    pool._obtener_pool().caida = True
+    for _ in range(5):
+        with pytest.raises(mysql.connector.Error):
+            pool.obtener()
+
+    pool._obtener_pool().caida = False
+    conexiones = [pool.obtener(), pool.obtener()]
+    assert pool.metricas()["en_uso"] == 2
+    for conn in conexiones:
+        conn.close()
+    assert pool.metricas()["en_uso"] == 0
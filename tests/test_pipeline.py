@@ -0,0 +1,61 @@
+import time
+import threading
+
+import pytest
+
+import pipeline
+
+
+@pytest.fixture
+def executor_de(monkeypatch):
+    def crear(hilos):
+        monkeypatch.setattr(pipeline, "PIPELINE_WORKERS", hilos)
+        monkeypatch.setattr(pipeline, "_executor", None)
+        return pipeline.obtener_executor()
+    return crear
+
+
+def test_el_plazo_cuenta_desde_que_la_tarea_empieza(executor_de):
+    executor_de(2)
+    resultados = []
+
+    def peticion():
+        tareas = {clave: (lambda: time.sleep(0.2) or "ok", 0.5) for clave in ("a", "b")}
+        resultados.append(pipeline.ejecutar_en_paralelo(tareas))
+
+    # Tres peticiones de dos tareas con dos hilos: la última espera ~0.4 s a que haya hilos
+    hilos = [threading.Thread(target=peticion) for _ in range(3)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert all(resultado.ok for por_tarea in resultados for resultado in por_tarea.values())
+
+
+def test_tarea_vencida_conserva_su_hilo_hasta_terminar(executor_de):
+    _, cupos = executor_de(2)
+    liberar = threading.Event()
+
+    resultados = pipeline.ejecutar_en_paralelo({
+        "lenta": (lambda: liberar.wait(5), 0.1),
+        "rapida": (lambda: "ok", 1.0),
+    })
+
+    assert not resultados["lenta"].ok and resultados["rapida"].ok
+    saturado = pipeline.ejecutar_en_paralelo({"a": (lambda: "ok", 0.1), "b": (lambda: "ok", 0.1)})
+    assert not any(resultado.ok for resultado in saturado.values())
+
+    liberar.set()
+    assert pipeline.ejecutar_en_paralelo({"a": (lambda: "ok", 1.0), "b": (lambda: "ok", 1.0)})["b"].ok
+    assert cupos._libres == 2
+
+
+def test_mas_tareas_que_hilos(executor_de):
+    _, cupos = executor_de(2)
+
+    resultados = pipeline.ejecutar_en_paralelo({i: (lambda i=i: i, 1.0) for i in range(5)})
+
+    assert [resultados[i].valor for i in range(5)] == list(range(5))
+    time.sleep(0.05)
+    assert cupos._libres == 2
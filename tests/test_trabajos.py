@@ -0,0 +1,54 @@
+import trabajos
+from trabajos import ColaSQLite, ColaMemoria, PENDIENTE, PROCESANDO, COMPLETADO, ERROR
+
+
+def test_pendientes_sobreviven_a_un_reinicio(tmp_path):
+    ruta = str(tmp_path / "trabajos.sqlite3")
+    job_id = ColaSQLite(ruta).encolar({"archivos": {}})
+
+    trabajo = ColaSQLite(ruta).tomar(timeout=0)
+
+    assert trabajo["job_id"] == job_id
+    assert trabajo["estado"] == PROCESANDO
+
+
+def test_huerfano_se_marca_como_error_sin_repetirse(tmp_path, monkeypatch):
+    cola = ColaSQLite(str(tmp_path / "trabajos.sqlite3"), timeout_huerfanos=900)
+    job_id = cola.encolar({"archivos": {}})
+    assert cola.tomar(timeout=0)["job_id"] == job_id
+
+    ahora = trabajos._ahora()
+    monkeypatch.setattr(trabajos, "_ahora", lambda: ahora + 901)
+
+    assert cola.tomar(timeout=0) is None
+    trabajo = cola.obtener(job_id)
+    assert trabajo["estado"] == ERROR
+    assert trabajo["error"]
+
+
+def test_terminados_se_purgan_pasada_la_retencion(tmp_path, monkeypatch):
+    cola = ColaSQLite(str(tmp_path / "trabajos.sqlite3"), retencion=60)
+    terminado = cola.encolar({})
+    cola.actualizar(cola.tomar(timeout=0)["job_id"], estado=COMPLETADO)
+    pendiente = cola.encolar({})
+
+    ahora = trabajos._ahora()
+    monkeypatch.setattr(trabajos, "_ahora", lambda: ahora + 61)
+    cola._ultima_purga = 0.0
+    cola._purgar()
+
+    assert cola.obtener(terminado) is None
+    assert cola.obtener(pendiente)["estado"] == PENDIENTE
+
+
+def test_memoria_purga_terminados(monkeypatch):
+    cola = ColaMemoria(retencion=60)
+    terminado = cola.encolar({})
+    cola.actualizar(cola.tomar(timeout=0)["job_id"], estado=ERROR, error="x")
+
+    ahora = trabajos._ahora()
+    monkeypatch.setattr(trabajos, "_ahora", lambda: ahora + 61)
+    nuevo = cola.encolar({})
+
+    assert cola.obtener(terminado) is None
+    assert cola.obtener(nuevo)["estado"] == PENDIENTE
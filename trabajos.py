@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+PENDIENTE = "pendiente"
+PROCESANDO = "procesando"
+COMPLETADO = "completado"
+ERROR = "error"
+
+# Segundos que se conservan los trabajos terminados para consultar su estado
+RETENCION_TRABAJOS = int(os.getenv("COLA_TRABAJOS_RETENCION", "86400"))
+
+
+def _ahora():
+    return time.time()
+
+
+class ColaMemoria:
+    """Cola en el propio proceso. Los trabajos se pierden si el proceso se reinicia."""
+
+    persistente = False
+
+    def __init__(self, retencion=RETENCION_TRABAJOS):
+        self._retencion = retencion
+        self._trabajos = {}
+        self._pendientes = queue.Queue()
+        self._lock = threading.Lock()
+
+    def encolar(self, payload, job_id=None):
+        job_id = job_id or uuid.uuid4().hex
+        with self._lock:
+            self._purgar()
+            self._trabajos[job_id] = {
+                "job_id": job_id,
+                "estado": PENDIENTE,
+                "progreso": {"etapa": "en_cola", "porcentaje": 0},
+                "payload": payload,
+                "resultado": None,
+                "error": None,
+                "creado": _ahora(),
+                "actualizado": _ahora(),
+            }
+        self._pendientes.put(job_id)
+        return job_id
+
+    def tomar(self, timeout=1.0):
+        try:
+            job_id = self._pendientes.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            trabajo = self._trabajos[job_id]
+            trabajo["estado"] = PROCESANDO
+            trabajo["actualizado"] = _ahora()
+            return dict(trabajo)
+
+    def actualizar(self, job_id, estado=None, progreso=None, resultado=None, error=None):
+        with self._lock:
+            trabajo = self._trabajos.get(job_id)
+            if not trabajo:
+                return
+            if estado:
+                trabajo["estado"] = estado
+            if progreso:
+                trabajo["progreso"] = progreso
+            if resultado is not None:
+                trabajo["resultado"] = resultado
+            if error is not None:
+                trabajo["error"] = error
+            trabajo["actualizado"] = _ahora()
+
+    def obtener(self, job_id):
+        with self._lock:
+            trabajo = self._trabajos.get(job_id)
+            return dict(trabajo) if trabajo else None
+
+    def _purgar(self):
+        limite = _ahora() - self._retencion
+        vencidos = [
+            job_id for job_id, trabajo in self._trabajos.items()
+            if trabajo["estado"] in (COMPLETADO, ERROR) and trabajo["actualizado"] < limite
+        ]
+        for job_id in vencidos:
+            del self._trabajos[job_id]
+
+
+class ColaSQLite:
+    """
+    Cola persistente en un archivo SQLite local. Sobrevive a reinicios y se
+    puede compartir entre los workers de gunicorn de un mismo pod.
+
+    Un trabajo que sigue "procesando" pasado `timeout_huerfanos` se marca como
+    error en lugar de reintentarse: sus archivos ya se consumieron al tomarlo.
+    Los trabajos terminados se borran pasados `retencion` segundos.
+    """
+
+    persistente = True
+
+    def __init__(self, ruta, intervalo_sondeo=0.5, timeout_huerfanos=900, retencion=RETENCION_TRABAJOS):
+        self._ruta = ruta
+        self._intervalo_sondeo = intervalo_sondeo
+        self._timeout_huerfanos = timeout_huerfanos
+        self._retencion = retencion
+        self._ultima_purga = 0.0
+        self._local = threading.local()
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        with self._conexion() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS trabajos (
+                    job_id TEXT PRIMARY KEY,
+                    estado TEXT NOT NULL,
+                    progreso TEXT,
+                    payload TEXT NOT NULL,
+                    resultado TEXT,
+                    error TEXT,
+                    creado REAL NOT NULL,
+                    actualizado REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos (estado, creado)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_actualizado ON trabajos (estado, actualizado)")
+
+    def _conexion(self):
+        # Una conexión por hilo y proceso; sqlite3 no permite compartirlas entre hilos
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self._ruta, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return _Transaccion(conn)
+
+    def encolar(self, payload, job_id=None):
+        job_id = job_id or uuid.uuid4().hex
+        progreso = json.dumps({"etapa": "en_cola", "porcentaje": 0})
+        with self._conexion() as conn:
+            conn.execute(
+                "INSERT INTO trabajos (job_id, estado, progreso, payload, creado, actualizado) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, PENDIENTE, progreso, json.dumps(payload), _ahora(), _ahora())
+            )
+        return job_id
+
+    def tomar(self, timeout=1.0):
+        limite = time.monotonic() + timeout
+        while True:
+            self._purgar()
+            with self._conexion() as conn:
+                # Trabajos que quedaron "procesando" tras una caída: sus archivos temporales
+                # ya se leyeron (y borraron) al tomarlos, así que no se pueden repetir
+                huerfanos = conn.execute(
+                    "UPDATE trabajos SET estado = ?, error = ?, actualizado = ? WHERE estado = ? AND actualizado < ?",
+                    (ERROR, "Trabajo interrumpido; vuelve a enviar los documentos", _ahora(),
+                     PROCESANDO, _ahora() - self._timeout_huerfanos)
+                ).rowcount
+                if huerfanos:
+                    logger.warning(f"⚠️ {huerfanos} trabajos interrumpidos marcados como error")
+                fila = conn.execute(
+                    "SELECT * FROM trabajos WHERE estado = ? ORDER BY creado LIMIT 1", (PENDIENTE,)
+                ).fetchone()
+                if fila:
+                    conn.execute(
+                        "UPDATE trabajos SET estado = ?, actualizado = ? WHERE job_id = ?",
+                        (PROCESANDO, _ahora(), fila["job_id"])
+                    )
+                    trabajo = self._a_dict(fila)
+                    trabajo["estado"] = PROCESANDO
+                    return trabajo
+            if time.monotonic() >= limite:
+                return None
+            time.sleep(self._intervalo_sondeo)
+
+    def _purgar(self):
+        # Como mucho una vez por minuto por proceso; basta para acotar la tabla
+        if time.monotonic() - self._ultima_purga < 60:
+            return
+        self._ultima_purga = time.monotonic()
+        with self._conexion() as conn:
+            borrados = conn.execute(
+                "DELETE FROM trabajos WHERE estado IN (?, ?) AND actualizado < ?",
+                (COMPLETADO, ERROR, _ahora() - self._retencion)
+            ).rowcount
+        if borrados:
+            logger.info(f"🧹 {borrados} trabajos terminados purgados de la cola")
+
+    def actualizar(self, job_id, estado=None, progreso=None, resultado=None, error=None):
+        campos, valores = ["actualizado = ?"], [_ahora()]
+        if estado:
+            campos.append("estado = ?")
+            valores.append(estado)
+        if progreso:
+            campos.append("progreso = ?")
+            valores.append(json.dumps(progreso))
+        if resultado is not None:
+            campos.append("resultado = ?")
+            valores.append(json.dumps(resultado))
+        if error is not None:
+            campos.append("error = ?")
+            valores.append(error)
+        valores.append(job_id)
+        with self._conexion() as conn:
+            conn.execute(f"UPDATE trabajos SET {', '.join(campos)} WHERE job_id = ?", valores)
+
+    def obtener(self, job_id):
+        with self._conexion() as conn:
+            fila = conn.execute("SELECT * FROM trabajos WHERE job_id = ?", (job_id,)).fetchone()
+        return self._a_dict(fila) if fila else None
+
+    @staticmethod
+    def _a_dict(fila):
+        trabajo = dict(fila)
+        for campo in ("progreso", "payload", "resultado"):
+            if trabajo.get(campo):
+                trabajo[campo] = json.loads(trabajo[campo])
+        return trabajo
+
+
+class _Transaccion:
+    """Ejecuta el bloque dentro de BEGIN IMMEDIATE ... COMMIT/ROLLBACK."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, tipo_error, *_):
+        self._conn.execute("ROLLBACK" if tipo_error else "COMMIT")
+        return False
+
+
+class PoolTrabajadores:
+    """
+    Hilos que toman trabajos de la cola y los pasan a `manejador(trabajo, reportar)`.
+    `reportar(etapa, porcentaje)` actualiza el progreso visible en el endpoint de estado.
+    El manejador devuelve el resultado del trabajo o lanza una excepción.
+    """
+
+    def __init__(self, cola, manejador, cantidad=2):
+        self._cola = cola
+        self._manejador = manejador
+        self._cantidad = cantidad
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def asegurar_iniciado(self):
+        # Los hilos no sobreviven a un fork: se arrancan en el proceso que los usa
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            for i in range(self._cantidad):
+                threading.Thread(target=self._bucle, daemon=True, name=f"trabajador-{i}").start()
+            self._pid = pid
+            logger.info(f"👷 {self._cantidad} trabajadores de /subir iniciados (pid {pid})")
+
+    def _bucle(self):
+        while True:
+            try:
+                trabajo = self._cola.tomar(timeout=1.0)
+            except Exception as e:
+                logger.error(f"❌ Error leyendo la cola de trabajos: {e}")
+                time.sleep(1)
+                continue
+            if trabajo:
+                self._ejecutar(trabajo)
+
+    def _ejecutar(self, trabajo):
+        job_id = trabajo["job_id"]
+
+        def reportar(etapa, porcentaje):
+            self._cola.actualizar(job_id, progreso={"etapa": etapa, "porcentaje": porcentaje})
+
+        try:
+            resultado = self._manejador(trabajo, reportar)
+            self._cola.actualizar(
+                job_id, estado=COMPLETADO, progreso={"etapa": "completado", "porcentaje": 100}, resultado=resultado
+            )
+            logger.info(f"✅ Trabajo {job_id} completado")
+        except Exception as e:
+            logger.error(f"❌ Trabajo {job_id} falló: {e}", exc_info=True)
+            self._cola.actualizar(job_id, estado=ERROR, error=str(e))
+
+
+def crear_cola(backend=None):
+    backend = backend or os.getenv("COLA_TRABAJOS_BACKEND", "memoria")
+    if backend == "sqlite":
+        return ColaSQLite(os.getenv("COLA_TRABAJOS_SQLITE", os.path.join("uploads", "trabajos.sqlite3")))
+    if backend == "memoria":
+        return ColaMemoria()
+    raise ValueError(f"Backend de cola desconocido: {backend}")